@@ -0,0 +1,24 @@
+"""
+Gunicorn settings: `gunicorn -c config/gunicorn.conf.py config.wsgi`
+
+With preload_app the master imports config.wsgi once, which warms the
+application up (store/warmup.py); every worker forked from it, including
+ones recycled by max_requests, starts with compiled templates, URL tables
+and the catalog snapshot already in memory.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True
+max_requests = 2000
+max_requests_jitter = 200
+timeout = 30
+
+
+def post_fork(server, worker):
+    # Connections opened in the master during warm-up must not be shared
+    from django.db import connections
+
+    connections.close_all()
@@ -37,16 +37,21 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
+    'django_filters',
     'store',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'store.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'store.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'store.ratelimit.AdmissionControlMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -56,8 +61,11 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Project templates are minified once, when first compiled (store/minify.py)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', ['store.minify.Loader']),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -77,6 +85,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than memory, so tests can share it with forked processes
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -123,6 +133,18 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads are stored under the SHA-256 of their content, so identical images
+# are kept once; `manage.py ingest_images` bulk-loads them. Media URLs carry
+# the file's version, /media/v/<version>/<name>, and are served with a
+# one-year immutable Cache-Control (see store/media.py).
+STORAGES = {
+    'default': {'BACKEND': 'store.media.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+MEDIA_MAX_AGE = 3600  # seconds, for unversioned /media/ URLs
+MEDIA_OFFLOAD = None  # 'x-accel-redirect' behind nginx, 'x-sendfile' behind Apache/lighttpd
+MEDIA_ACCEL_PREFIX = '/protected-media/'  # nginx internal location aliased to MEDIA_ROOT
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -133,6 +155,146 @@ LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'home'
 
+# Cache
+# Per-process memory cache. Use a shared backend (Redis/Memcached) in
+# production so the API response cache and cache warming are shared by
+# all workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Public base URL, used where absolute links are built outside a request
+SITE_URL = 'https://elite-shop.onrender.com'
+
+# Email
+DEFAULT_FROM_EMAIL = 'Elite Shop <noreply@eliteshop.tn>'
+CONTACT_EMAIL = 'contact@eliteshop.tn'
+if DEBUG:
+    # For real SMTP round trips run `manage.py smtp_debug_server` and use the
+    # SMTP backend with EMAIL_HOST = '127.0.0.1' and EMAIL_PORT = 1025
+    EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Outbound mail spool (see store/mail.py)
+MAIL_SPOOL_INTERVAL = 5  # seconds; emails queued in one window share an SMTP connection
+MAIL_SPOOL_BATCH_SIZE = 100  # emails per SMTP connection
+MAIL_MAX_ATTEMPTS = 5
+WRITE_BUFFER_FLUSH_INTERVAL = 1  # seconds between bulk inserts of buffered rows
+
+# Background jobs (see store/jobs.py, run with `manage.py run_jobs`)
+JOB_QUEUES = {  # queue name -> jobs running at once across all workers
+    'default': 4,
+    'email': 2,
+    'media': 2,
+    'payments': 4,
+}
+JOB_RETRY_BASE_DELAY = 10  # seconds, doubled on every retry
+JOB_LOCK_TIMEOUT = 600  # seconds before a silent running job is handed out again
+
+# Order numbers (see store/sequences.py)
+ORDER_NUMBER_START = 100001
+ORDER_NUMBER_BLOCK_SIZE = 50  # numbers reserved per database round trip and worker
+ORDER_NUMBER_FORMAT = 'ES-{number}'
+
+# Order archival (see store/archive.py, run `manage.py archive_orders` from cron)
+ORDER_ARCHIVE_AFTER_DAYS = 365  # delivered/cancelled orders untouched this long leave the live tables
+ORDER_ARCHIVE_BATCH_SIZE = 500  # orders moved per transaction
+
+# Sitemaps and merchant feed (see store/feeds.py, run `manage.py generate_feeds` from cron)
+FEEDS_ROOT = MEDIA_ROOT / 'feeds'
+FEED_SHARD_SIZE = 50000  # products per sitemap/feed file
+FEED_CURRENCY = 'TND'
+
+# Sessions (store/views.py only creates one once a cart needs storing).
+# Kept in the database while CACHES is per-process: with cached_db on
+# LocMemCache a logout would only evict the session from one worker's cache.
+# Once CACHES is a shared cache such as Redis, switch to cached_db (or
+# 'django.contrib.sessions.backends.cache') to take reads off the database;
+# the store.E001 check refuses a cache-backed engine on a per-process cache.
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+SESSION_CLEANUP_BATCH_SIZE = 1000  # run `manage.py clear_expired_sessions` from cron
+
+# Flash messages travel in a signed cookie instead of the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Promotions (see store/promotions.py). Rule changes reprice the catalog in a
+# background job; `manage.py reprice_products` does it on demand.
+PROMOTION_REPRICE_DELAY = 5  # seconds to wait so a burst of rule edits reprices once
+PROMOTION_WRITE_BATCH_SIZE = 1000  # changed prices written per statement
+
+# Stock ledger (see store/stock.py, `manage.py check_stock` to audit it)
+LOW_STOCK_THRESHOLD = 5  # units left that trigger a low-stock alert
+STOCK_ALERT_EMAIL = CONTACT_EMAIL
+
+# Customers (see store/customers.py). `manage.py sync_customers` backfills
+# them from existing orders.
+CUSTOMER_SYNC_BATCH_SIZE = 2000  # orders per transaction
+
+# Worker warm-up on boot (see store/warmup.py, config/gunicorn.conf.py);
+# `manage.py profile_startup` measures it
+WARMUP_ON_BOOT = not DEBUG
+WARMUP_PATHS = ['/', '/products/']
+
+# HTML minification and response compression (see store/minify.py,
+# store/compression.py); `manage.py benchmark_pages` measures both
+HTML_MINIFY = not DEBUG
+COMPRESS_MIN_SIZE = 200  # bytes
+COMPRESS_BROTLI_QUALITY = 5  # 0-11; brotli is used when the Brotli package is installed
+COMPRESS_GZIP_LEVEL = 6
+
+# Sampling profiler (see store/profiling.py). Staff can profile one request
+# with an `X-Profile: 1` header; `manage.py diff_profiles` compares profiles.
+PROFILE_SAMPLE_RATE = 0  # fraction of requests, e.g. 0.01 while chasing a regression
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_REQUEST_INTERVAL = 0.001  # for a single header-triggered request
+PROFILE_ROOT = BASE_DIR / 'profiles'  # collapsed-stack files for flamegraph.pl/speedscope
+PROFILE_FLUSH_INTERVAL = 60  # seconds between rewrites of the per-URL aggregates
+
+# Admission control for checkout, login and cart (policies in store/urls.py).
+# Counters are per process with the local-memory cache; use a shared cache
+# in production so limits apply site-wide.
+RATELIMIT_ENABLED = True
+RATELIMIT_CACHE = 'default'
+RATELIMIT_IP_META = 'REMOTE_ADDR'  # e.g. 'HTTP_X_REAL_IP' behind a reverse proxy
+
+# Admin changelists count at most this many rows past the page shown (see store/admin.py)
+ADMIN_COUNT_LIMIT = 10000
+
+# REST API (see store/api.py)
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'rest_framework.throttling.AnonRateThrottle',
+        'rest_framework.throttling.UserRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': '120/minute',
+        'user': '600/minute',
+    },
+}
+
+# Product popularity (see store/popularity.py)
+PRODUCT_VIEWS_FLUSH_INTERVAL = 30  # seconds between batched view count writes
+POPULARITY_HALF_LIFE = 7 * 24 * 3600  # seconds
+
+# In-memory catalog snapshot per worker (see store/snapshot.py)
+CATALOG_SNAPSHOT_CHECK_INTERVAL = 1  # seconds between catalog version checks
+CATALOG_SNAPSHOT_MAX_AGE = 300  # seconds, so popularity ordering stays current
+CATALOG_LISTING_CACHE_IDS = 1_000_000  # product ids held by memoized filtered listings
+
 # Stripe Configuration (for future payment integration)
 STRIPE_PUBLIC_KEY = 'your_stripe_public_key_here'
 STRIPE_SECRET_KEY = 'your_stripe_secret_key_here'
+
+# Online payments (see store/payments.py). In development the gateway is
+# `manage.py fake_payment_gateway`, which speaks the same API.
+PAYMENT_PROVIDER = 'store.payments.GatewayProvider'
+PAYMENT_GATEWAY_URL = 'http://127.0.0.1:8765'
+PAYMENT_WEBHOOK_SECRET = 'whsec_local_development'
+PAYMENT_CURRENCY = 'tnd'
+PAYMENT_RECONCILE_AFTER = 15 * 60  # seconds before a waiting payment is checked with the provider
+PAYMENT_EXPIRES_AFTER = 24 * 3600  # seconds before an unpaid intent is cancelled
@@ -14,15 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+
+from store.views import media_file
+
+media_prefix = re.escape(settings.MEDIA_URL.lstrip('/'))
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('store.urls')),
-]
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Uploaded media, in production too (see store/media.py)
+    re_path(rf'^{media_prefix}v/(?P<version>[0-9a-f]{{12}})/(?P<path>.+)$', media_file, name='media_file_versioned'),
+    re_path(rf'^{media_prefix}(?P<path>.+)$', media_file, name='media_file'),
+]
\ No newline at end of file
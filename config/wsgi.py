@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# Compile templates, build the URL tables and the catalog snapshot before the
+# first real request (WARMUP_ON_BOOT, see store/warmup.py)
+from store.warmup import warm_up_on_boot  # noqa: E402
+
+warm_up_on_boot()
@@ -1,46 +1,262 @@
-from django.contrib import admin
-from .models import Product, Category, CartItem, Order, OrderItem, Customer
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.forms.models import BaseInlineFormSet
+from django.http import QueryDict
+from django.utils.functional import cached_property
+from django.utils.html import format_html, format_html_join
+from .models import Product, Category, CartItem, Order, OrderItem, Customer, Job, PaymentEvent, ContactMessage, OutboundEmail, ArchivedOrder, Promotion, StockMovement
+from .promotions import schedule_reprice
+from .stock import return_order_stock, set_stock
+from .tasks import process_image
+
+# Changelists count at most this many rows; beyond it the count is an estimate
+ADMIN_COUNT_LIMIT = getattr(settings, 'ADMIN_COUNT_LIMIT', 10000)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Avoids COUNT(*) over a whole table. Unfiltered lists on PostgreSQL use the
+    planner's row estimate; everything else is counted up to ADMIN_COUNT_LIMIT
+    rows past the page being shown, so paging on always reaches further rows.
+    """
+
+    def __init__(self, *args, page_number=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_number = page_number
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if not query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [self.object_list.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > ADMIN_COUNT_LIMIT:
+                return row[0]
+        limit = self.page_number * self.per_page + ADMIN_COUNT_LIMIT
+        count = self.object_list.values('pk')[:limit].count()
+        self.capped = count >= limit
+        return count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = max(int(request.GET.get(PAGE_VAR, 1)), 1)
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        if getattr(changelist.paginator, 'capped', False):
+            self.message_user(
+                request,
+                f'Only the first {changelist.result_count:,} matches were counted; '
+                f'the last page links on to the ones after them. Search or filter to narrow the list.',
+                messages.INFO,
+            )
+        return changelist
+
+
+class ImageProcessingMixin:
+    """Resize/orient a newly uploaded image in the background after saving"""
+    image_model_name = None
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data and obj.image:
+            transaction.on_commit(lambda: process_image.enqueue(model=self.image_model_name, pk=obj.pk))
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(ImageProcessingMixin, admin.ModelAdmin):
+    image_model_name = 'category'
     list_display = ['name', 'slug', 'created_at']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'old_price', 'stock', 'available', 'featured', 'created_at']
+class ProductAdmin(ImageProcessingMixin, LargeTableAdmin):
+    image_model_name = 'product'
+    list_display = ['name', 'category', 'regular_price', 'compare_at_price', 'price', 'promotion', 'stock', 'available', 'featured', 'created_at']
     list_filter = ['available', 'featured', 'category', 'created_at']
-    list_editable = ['price', 'stock', 'available', 'featured']
-    search_fields = ['name', 'description']
+    list_editable = ['regular_price', 'compare_at_price', 'stock', 'available', 'featured']
+    list_select_related = ['category', 'promotion']
+    search_fields = ['name']
+    readonly_fields = ['price', 'old_price', 'promotion']
+    search_help_text = 'Product id, or the start of the name'
     prepopulated_fields = {'slug': ('name',)}
-    date_hierarchy = 'created_at'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Stock only changes through the ledger; an edit becomes a restock or adjustment
+        if change and 'stock' in form.changed_data:
+            set_stock(obj.pk, form.cleaned_data['stock'], note=f'Edited in admin by {request.user}')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Indexed lookups only: exact id or case-insensitive name prefix
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(id=int(term)), False
+        return queryset.annotate(name_lower=Lower('name')).filter(name_lower__startswith=term.lower()), False
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(LargeTableAdmin):
+    """The stock ledger, read-only; movements are only ever appended by store.stock"""
+    list_display = ['product', 'kind', 'quantity', 'balance', 'order', 'note', 'created_at']
+    list_filter = ['kind', 'created_at']
+    list_select_related = ['product', 'order']
+    search_fields = ['=product__id', '=order__order_number']
+    raw_id_fields = ['product', 'order']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    """Saving or deleting a rule reprices the whole catalog in one background batch"""
+    list_display = ['name', 'kind', 'amount', 'starts_at', 'ends_at', 'published']
+    list_filter = ['published', 'kind']
+    list_editable = ['published']
+    search_fields = ['name']
+    filter_horizontal = ['categories']
+    raw_id_fields = ['products']
+    actions = ['publish', 'unpublish']
+
+    def save_related(self, request, form, formsets, change):
+        # After the M2M scope is saved, so the repricing sees it
+        super().save_related(request, form, formsets, change)
+        transaction.on_commit(schedule_reprice)
+
+    def save_model(self, request, obj, form, change):
+        # list_editable saves go through here without save_related
+        super().save_model(request, obj, form, change)
+        transaction.on_commit(schedule_reprice)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        transaction.on_commit(schedule_reprice)
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        transaction.on_commit(schedule_reprice)
+
+    @admin.action(description='Publish selected promotions')
+    def publish(self, request, queryset):
+        queryset.update(published=True)
+        transaction.on_commit(schedule_reprice)
+
+    @admin.action(description='Unpublish selected promotions')
+    def unpublish(self, request, queryset):
+        queryset.update(published=False)
+        transaction.on_commit(schedule_reprice)
 
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(LargeTableAdmin):
     list_display = ['product', 'user', 'session_key', 'quantity', 'created_at']
     list_filter = ['created_at']
+    list_select_related = ['product', 'user']
     search_fields = ['product__name', 'user__username']
 
 
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """Edits one page of the related rows instead of all of them"""
+    per_page = 50
+    page_number = 1
+    page_var = 'items_page'
+    query = QueryDict()
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            self.paginator = Paginator(super().get_queryset(), self.per_page)
+            self.page = self.paginator.get_page(self.page_number)
+        return self.page.object_list
+
+    def page_links(self):
+        """(number, query string) per page, keeping the rest of the query (_changelist_filters, ...)"""
+        params = self.query.copy()
+        links = []
+        for number in self.page.paginator.page_range:
+            params[self.page_var] = number
+            links.append((number, params.urlencode()))
+        return links
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
     readonly_fields = ['product', 'product_name', 'product_price', 'quantity', 'get_total']
+    formset = PaginatedInlineFormSet
+    template = 'admin/store/order/paginated_tabular_inline.html'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product').order_by('id')
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.page_number = request.GET.get(formset.page_var, 1)
+        formset.query = request.GET
+        return formset
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ['order_number', 'user', 'full_name', 'email', 'status', 'payment_method', 'total_amount', 'created_at']
-    list_filter = ['status', 'payment_method', 'payment_completed', 'created_at']
-    search_fields = ['order_number', 'full_name', 'email', 'phone']
-    readonly_fields = ['order_number', 'created_at', 'updated_at']
+class OrderAdmin(LargeTableAdmin):
+    list_display = ['order_number', 'user', 'full_name', 'email', 'status', 'payment_method', 'payment_status', 'total_amount', 'created_at']
+    list_filter = ['status', 'payment_method', 'payment_status', 'payment_completed', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['order_number', 'full_name', 'email', 'phone', 'stripe_payment_intent']
+    search_help_text = 'Order number, email, phone, payment intent id, or the start of the customer name'
+    readonly_fields = ['order_number', 'payment_status', 'payment_updated_at', 'payment_url', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
-    date_hierarchy = 'created_at'
-    
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # A cancelled order's reserved or sold items go back on sale
+        if change and 'status' in form.changed_data and obj.status == 'cancelled':
+            return_order_stock(obj.pk, note=f'Cancelled in admin by {request.user}')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Each kind of term maps to one indexed lookup instead of
+        # OR-ing icontains scans over five columns
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if '@' in term:
+            return queryset.annotate(email_lower=Lower('email')).filter(email_lower=term.lower()), False
+        if term.startswith('pi_'):
+            return queryset.filter(stripe_payment_intent=term), False
+        exact = queryset.filter(Q(order_number__in={term, term.upper()}) | Q(phone=term))
+        if exact.exists():
+            return exact, False
+        return queryset.annotate(full_name_lower=Lower('full_name')).filter(
+            full_name_lower__startswith=term.lower()
+        ), False
+
     fieldsets = (
         ('Order Information', {
             'fields': ('order_number', 'user', 'status', 'created_at', 'updated_at')
@@ -52,14 +268,82 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('address', 'city', 'postal_code', 'country')
         }),
         ('Payment Information', {
-            'fields': ('payment_method', 'payment_completed', 'stripe_payment_intent', 'total_amount', 'shipping_cost')
+            'fields': ('payment_method', 'payment_status', 'payment_updated_at', 'payment_completed',
+                       'stripe_payment_intent', 'payment_url', 'total_amount', 'shipping_cost')
         }),
     )
 
 
 @admin.register(Customer)
 class CustomerAdmin(admin.ModelAdmin):
-    list_display = ['email', 'user', 'phone', 'city', 'country', 'created_at']
+    list_display = ['email', 'full_name', 'user', 'phone', 'city', 'country', 'updated_at']
+    list_select_related = ['user']
     search_fields = ['email', 'phone', 'user__username']
     list_filter = ['country', 'created_at']
 
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['task', 'queue', 'status', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'queue']
+    search_fields = ['task', 'idempotency_key']
+    readonly_fields = ['created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error']
+
+
+@admin.register(PaymentEvent)
+class PaymentEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'order', 'applied', 'received_at']
+    list_filter = ['type', 'applied', 'provider']
+    search_fields = ['event_id', 'intent_id', 'order__order_number']
+    raw_id_fields = ['order']
+    readonly_fields = ['provider', 'event_id', 'type', 'intent_id', 'order', 'payload', 'applied', 'received_at']
+
+
+@admin.register(ContactMessage)
+class ContactMessageAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'name', 'email', 'handled', 'created_at']
+    list_filter = ['handled', 'created_at']
+    list_editable = ['handled']
+    search_fields = ['name', 'email', 'subject']
+    readonly_fields = ['name', 'email', 'phone', 'subject', 'message', 'created_at']
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'to_email', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['to_email', 'subject']
+    readonly_fields = ['created_at', 'claimed_at', 'sent_at', 'last_error']
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(LargeTableAdmin):
+    """Read-only view of orders moved out of the live tables by archive_orders"""
+    list_display = ['order_number', 'user', 'email', 'status', 'total', 'created_at', 'archived_at']
+    list_filter = ['status']
+    list_select_related = ['user']
+    search_fields = ['=order_number', '=email']
+    raw_id_fields = ['user']
+    fields = ['order_number', 'user', 'email', 'status', 'total', 'created_at', 'archived_at', 'shipping', 'items']
+    readonly_fields = fields
+
+    def shipping(self, obj):
+        data = obj.data
+        return format_html(
+            '{}<br>{}<br>{} {}, {}<br>{}', data.get('full_name'), data.get('address'),
+            data.get('postal_code'), data.get('city'), data.get('country'), data.get('phone'),
+        )
+
+    def items(self, obj):
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td></tr>',
+            ((item['product_name'], item['product_price'], item['quantity']) for item in obj.data.get('items', [])),
+        )
+        return format_html('<table><tr><th>Product</th><th>Price</th><th>Qty</th></tr>{}</table>', rows)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
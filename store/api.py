@@ -0,0 +1,130 @@
+import hashlib
+
+import django_filters
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import permissions, status, viewsets
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .catalog import get_catalog_state, get_catalog_version, get_stock_version
+from .models import Category, Order, Product
+from .serializers import CategorySerializer, OrderSerializer, ProductSerializer
+
+
+class NewestFirstPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
+
+
+class NamePagination(NewestFirstPagination):
+    ordering = ('name', 'id')
+
+
+class ProductFilter(django_filters.FilterSet):
+    category = django_filters.CharFilter(field_name='category__slug')
+    min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_discount = django_filters.NumberFilter(field_name='discount_percentage', lookup_expr='gte')
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
+    on_sale = django_filters.BooleanFilter(method='filter_on_sale')
+
+    class Meta:
+        model = Product
+        fields = ['category', 'featured']
+
+    def filter_in_stock(self, queryset, name, value):
+        return queryset.filter(stock__gt=0) if value else queryset.filter(stock=0)
+
+    def filter_on_sale(self, queryset, name, value):
+        on_sale = {'old_price__gt': F('price')}
+        return queryset.filter(**on_sale) if value else queryset.exclude(**on_sale)
+
+
+class CachedReadMixin:
+    """
+    Versioned response cache for read-only viewsets. The cache key and the
+    ETag both contain a version that changes whenever the underlying rows are
+    saved, so stale entries are never served and simply expire.
+    """
+    cache_timeout = 300
+
+    def get_cache_version(self):
+        raise NotImplementedError
+
+    def cached_response(self, request, build_response):
+        version = self.get_cache_version()
+        # Host and scheme are part of the key: pagination links are absolute
+        raw = '|'.join([version, request.build_absolute_uri(), request.accepted_renderer.format])
+        etag = quote_etag(hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = f'store.api:{etag}'
+            data = cache.get(key)
+            if data is None:
+                data = build_response().data
+                cache.set(key, data, self.cache_timeout)
+            response = Response(data)
+
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedReadMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedReadMixin, self).retrieve(request, *args, **kwargs))
+
+
+class ProductViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
+    """Available products, newest first"""
+    queryset = Product.objects.filter(available=True).select_related('category')
+    serializer_class = ProductSerializer
+    pagination_class = NewestFirstPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = ProductFilter
+
+    def get_cache_version(self):
+        # Products carry their stock count; categories don't need its version
+        state = get_catalog_state()
+        return f'{get_catalog_version(state)}|{get_stock_version(state)}'
+
+
+class CategoryViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    pagination_class = NamePagination
+    lookup_field = 'slug'
+
+    def get_cache_version(self):
+        return get_catalog_version()
+
+
+class OrderViewSet(CachedReadMixin, viewsets.ReadOnlyModelViewSet):
+    """The signed-in user's orders"""
+    serializer_class = OrderSerializer
+    pagination_class = NewestFirstPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Order.objects.filter(user=self.request.user).prefetch_related('items')
+
+    def get_cache_version(self):
+        state = Order.objects.filter(user=self.request.user).aggregate(
+            updated=Max('updated_at'), count=Count('id')
+        )
+        return f"user{self.request.user.pk}:{state['updated']}:{state['count']}"
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        # Per-user data: browsers may revalidate it, shared caches must not keep it
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
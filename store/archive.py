@@ -0,0 +1,108 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+from django.utils import timezone
+
+from .models import ArchivedOrder, Order, OrderItem
+
+# Delivered and cancelled orders untouched for this long move to ArchivedOrder
+ORDER_ARCHIVE_AFTER_DAYS = getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 365)
+
+# Orders moved per transaction, so locks and undo logs stay small
+ORDER_ARCHIVE_BATCH_SIZE = getattr(settings, 'ORDER_ARCHIVE_BATCH_SIZE', 500)
+
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+ORDER_FIELDS = Order._meta.concrete_fields
+ITEM_FIELDS = [field for field in OrderItem._meta.concrete_fields if field.attname != 'order_id']
+
+
+def _values(instance, fields):
+    values = {field.attname: field.value_from_object(instance) for field in fields}
+    # DjangoJSONEncoder would cut datetimes to milliseconds
+    return {
+        name: value.isoformat() if isinstance(value, datetime) else value for name, value in values.items()
+    }
+
+
+def _restore(model, fields, data):
+    return model(**{field.attname: field.to_python(data.get(field.attname)) for field in fields})
+
+
+def to_archive(order):
+    """ArchivedOrder for an order whose items are prefetched"""
+    data = _values(order, ORDER_FIELDS)
+    data['items'] = [_values(item, ITEM_FIELDS) for item in order.items.all()]
+    return ArchivedOrder(
+        id=order.id, order_number=order.order_number, user_id=order.user_id, email=order.email,
+        status=order.status, total=order.get_total(), created_at=order.created_at, data=data,
+    )
+
+
+def from_archive(archived):
+    """
+    Rebuild the Order with its items from an archive row, read-only. Templates
+    written for live orders (order.items.all, get_total, ...) work unchanged.
+    """
+    order = _restore(Order, ORDER_FIELDS, archived.data)
+    items = [_restore(OrderItem, ITEM_FIELDS, item) for item in archived.data.get('items', [])]
+    for item in items:
+        item.order_id = order.id
+    order._prefetched_objects_cache = {'items': items}
+    order.is_archived = True
+    return order
+
+
+def archive_batch(cutoff, batch_size=ORDER_ARCHIVE_BATCH_SIZE):
+    """Move one batch of finished orders older than `cutoff`; returns how many moved"""
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update()
+            .filter(status__in=ARCHIVABLE_STATUSES, updated_at__lt=cutoff)
+            .order_by('updated_at', 'id')
+            .prefetch_related('items')[:batch_size]
+        )
+        if not orders:
+            return 0
+        ArchivedOrder.objects.bulk_create([to_archive(order) for order in orders])
+        order_ids = [order.id for order in orders]
+        OrderItem.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(id__in=order_ids).delete()
+    return len(orders)
+
+
+def archive_orders(older_than_days=ORDER_ARCHIVE_AFTER_DAYS, batch_size=ORDER_ARCHIVE_BATCH_SIZE,
+                   max_batches=None, pause=0):
+    """Archive in bounded batches, optionally pausing between them to spare the database"""
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def get_order_or_404(order_id, **filters):
+    """A live order, or the read-only archived one, matching `filters`"""
+    order = Order.objects.filter(id=order_id, **filters).prefetch_related('items').first()
+    if order is not None:
+        return order
+    archived = ArchivedOrder.objects.filter(id=order_id, **filters).first()
+    if archived is None:
+        raise Http404('No order matches the given query.')
+    return from_archive(archived)
+
+
+def user_orders(user):
+    """All of a user's orders, live and archived, newest first"""
+    live = list(Order.objects.filter(user=user).prefetch_related('items'))
+    archived = [from_archive(row) for row in ArchivedOrder.objects.filter(user=user)]
+    return sorted(live + archived, key=lambda order: order.created_at, reverse=True)
@@ -0,0 +1,186 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.urls import reverse
+
+from . import snapshot as catalog_snapshot
+
+
+# Entries examined per query before ranking; keeps one-letter prefixes cheap
+MAX_CANDIDATES = 2000
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lowercase, accent-free form used for both index terms and queries"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in text if not unicodedata.combining(char)).lower()
+
+
+def tokenize(text):
+    return _WORD.findall(normalize(text))
+
+
+class Suggestion:
+    __slots__ = ('kind', 'id', 'label', 'slug', 'price', 'score', 'words')
+
+    def __init__(self, kind, id, label, slug, price=None, score=0):
+        self.kind = kind
+        self.id = id
+        self.label = label
+        self.slug = slug
+        self.price = price
+        # Categories rank above products, then by popularity / size
+        self.score = (1 if kind == 'category' else 0, score)
+        self.words = tokenize(label)
+
+    def as_dict(self):
+        if self.kind == 'category':
+            url = f"{reverse('products')}?category={self.slug}"
+        else:
+            url = reverse('product_detail', args=[self.id, self.slug])
+        data = {'type': self.kind, 'label': self.label, 'url': url}
+        if self.price is not None:
+            data['price'] = str(self.price)
+        return data
+
+
+class PrefixIndex:
+    """
+    Sorted array of (word, kind, id) over product and category names. A prefix
+    lookup is a binary search plus a short forward scan; a single save is an
+    insort/delete on a copy of the list, so it never needs a rebuild.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self._terms = []
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        index = cls(snapshot.version)
+        suggestions = [
+            Suggestion('category', category.id, category.name, category.slug, score=category.product_count)
+            for category in snapshot.categories
+        ] + [
+            Suggestion('product', product.id, product.name, product.slug,
+                       price=product.price, score=product.popularity)
+            for product in snapshot.products.values()
+        ]
+        for suggestion in suggestions:
+            index._entries[suggestion.kind, suggestion.id] = suggestion
+        index._terms = sorted(
+            (word, suggestion.kind, suggestion.id)
+            for suggestion in suggestions
+            for word in set(suggestion.words)
+        )
+        return index
+
+    def _add(self, suggestion, terms):
+        key = (suggestion.kind, suggestion.id)
+        self._entries[key] = suggestion
+        for word in set(suggestion.words):
+            insort(terms, (word, *key))
+
+    def _remove(self, kind, id, terms):
+        suggestion = self._entries.pop((kind, id), None)
+        if suggestion is None:
+            return
+        for word in set(suggestion.words):
+            position = bisect_left(terms, (word, kind, id))
+            if position < len(terms) and terms[position] == (word, kind, id):
+                del terms[position]
+
+    def get(self, kind, id):
+        return self._entries.get((kind, id))
+
+    def update(self, suggestion):
+        # Copy-on-write so searches in other threads always see a whole list
+        with self._lock:
+            terms = list(self._terms)
+            self._remove(suggestion.kind, suggestion.id, terms)
+            self._add(suggestion, terms)
+            self._terms = terms
+
+    def remove(self, kind, id):
+        with self._lock:
+            terms = list(self._terms)
+            self._remove(kind, id, terms)
+            self._terms = terms
+
+    def search(self, query, limit=8):
+        """Best suggestions whose words start with every word of the query"""
+        words = tokenize(query)
+        if not words:
+            return []
+        # Scan on the longest word (most selective), check the others per entry
+        pivot = max(words, key=len)
+        others = [word for word in words if word is not pivot]
+
+        terms = self._terms
+        position = bisect_left(terms, (pivot,))
+        matches = {}
+        while position < len(terms) and len(matches) < MAX_CANDIDATES:
+            word, kind, id = terms[position]
+            if not word.startswith(pivot):
+                break
+            suggestion = self._entries.get((kind, id))
+            if suggestion is not None and all(
+                any(candidate.startswith(other) for candidate in suggestion.words) for other in others
+            ):
+                matches[kind, id] = suggestion
+            position += 1
+
+        ranked = sorted(matches.values(), key=lambda suggestion: suggestion.score, reverse=True)
+        return ranked[:limit]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    This worker's index. It follows whatever catalog snapshot the worker
+    already holds and never asks the database itself once one exists.
+    """
+    global _index
+    snapshot = catalog_snapshot.current_snapshot() or catalog_snapshot.get_snapshot()
+    index = _index
+    if index is None or index.version != snapshot.version:
+        with _index_lock:
+            if _index is None or _index.version != snapshot.version:
+                _index = PrefixIndex.from_snapshot(snapshot)
+            index = _index
+    return index
+
+
+def product_saved(product):
+    """Keep this worker's index in step with a saved product"""
+    if _index is None:
+        return
+    if product.available:
+        _index.update(Suggestion('product', product.id, product.name, product.slug,
+                                 price=product.price, score=product.popularity))
+    else:
+        _index.remove('product', product.id)
+
+
+def category_saved(category):
+    """Keep this worker's index in step with a saved category"""
+    if _index is None:
+        return
+    existing = _index.get('category', category.id)
+    _index.update(Suggestion('category', category.id, category.name, category.slug,
+                             score=existing.score[1] if existing else 0))
+
+
+def removed(kind, id):
+    """Drop a deleted product or category from this worker's index"""
+    if _index is not None:
+        _index.remove(kind, id)
@@ -0,0 +1,92 @@
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class BulkInsertBuffer:
+    """
+    Collects unsaved model instances in memory and writes them with one
+    bulk_create per model from a background thread, every `interval` seconds
+    or as soon as `max_size` rows are waiting. Requests only pay for a list
+    append. Rows that fail to insert are kept for the next flush, up to
+    `max_pending`.
+    """
+
+    def __init__(self, name, interval=1.0, max_size=500, max_pending=10_000, on_flush=None):
+        self.name = name
+        self.interval = interval
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake = threading.Event()
+        self._flusher_pid = None
+        atexit.register(self._safe_flush)
+
+    def add(self, *instances):
+        self._ensure_flusher()
+        with self._lock:
+            self._pending.extend(instances)
+            full = len(self._pending) >= self.max_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Insert everything buffered so far; returns the number of rows written"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        by_model = defaultdict(list)
+        for instance in pending:
+            by_model[type(instance)].append(instance)
+        try:
+            with transaction.atomic():
+                for model, instances in by_model.items():
+                    model.objects.bulk_create(instances, batch_size=self.max_size)
+        except Exception:
+            with self._lock:
+                if len(self._pending) + len(pending) <= self.max_pending:
+                    self._pending[:0] = pending
+                else:
+                    logger.error('%s buffer full, dropped %d rows', self.name, len(pending))
+            raise
+
+        if self.on_flush is not None:
+            self.on_flush(by_model)
+        return len(pending)
+
+    def _safe_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not flush the %s buffer', self.name)
+        finally:
+            # The calling thread's connection would otherwise stay open between flushes
+            connection.close()
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._safe_flush()
+
+    def _ensure_flusher(self):
+        """Start the background flush thread once per process (also after a fork)"""
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            # Rows inherited from the parent process belong to the parent
+            self._pending.clear()
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name=f'{self.name}-flusher', daemon=True).start()
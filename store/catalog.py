@@ -0,0 +1,110 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Count, Max, Subquery, Value
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .models import Category, Product, RecommendationRun
+
+
+# product_list sort options -> ordering, shared by the ORM and the in-memory snapshot
+PRODUCT_SORTS = {
+    'newest': ['-created_at'],
+    'price_low': ['price'],
+    'price_high': ['-price'],
+    'name': ['name'],
+    'discount': ['-discount_percentage', '-created_at'],
+    'popular': ['-popularity', '-created_at'],
+}
+DEFAULT_SORT = 'newest'
+
+
+def get_catalog_state():
+    """Return the catalog validators (latest change and row counts) in one query"""
+    categories = Category.objects.order_by().annotate(group=Value(1)).values('group')
+    state = Product.objects.order_by().aggregate(
+        product_updated=Max('updated_at'),
+        stock_updated=Max('stock_updated_at'),
+        product_count=Count('id'),
+        category_updated=Max(Subquery(categories.annotate(latest=Max('updated_at')).values('latest'))),
+        category_count=Max(Subquery(categories.annotate(n=Count('pk')).values('n'))),
+        # Product pages also show the stored recommendations
+        recommendations_updated=Max(Subquery(RecommendationRun.objects.values('created_at')[:1])),
+    )
+    timestamps = [
+        ts for ts in (
+            state['product_updated'], state['stock_updated'], state['category_updated'],
+            state['recommendations_updated'],
+        )
+        if ts
+    ]
+    state['last_modified'] = max(timestamps) if timestamps else None
+    return state
+
+
+def get_catalog_version(state=None):
+    """
+    Short string that changes whenever the catalog changes, stock counts
+    aside: those move with every sale and have their own version.
+    """
+    state = state or get_catalog_state()
+    raw = '|'.join(str(state[key]) for key in (
+        'product_updated', 'product_count', 'category_updated', 'category_count', 'recommendations_updated'
+    ))
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()
+
+
+def get_stock_version(state=None):
+    """Latest stock change (a datetime, or None before the first one)"""
+    state = state or get_catalog_state()
+    return state['stock_updated']
+
+
+def has_pending_messages(request):
+    """Check for queued flash messages without marking them as displayed"""
+    return len(messages.get_messages(request)) > 0
+
+
+def catalog_etag(request, version):
+    """Strong ETag for a catalog page as seen by this visitor"""
+    # The page embeds a CSRF token and the user menu, so both are part of
+    # the validator. The cart badge is loaded separately and is not.
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    raw = '|'.join([version, request.get_full_path(), str(request.user.pk), csrf_cookie])
+    return quote_etag(hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest())
+
+
+def catalog_condition(view_func):
+    """
+    Answer GET/HEAD requests for catalog pages with 304 Not Modified when the
+    catalog has not changed, without running the view or rendering templates.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or has_pending_messages(request):
+            return view_func(request, *args, **kwargs)
+
+        state = get_catalog_state()
+        # Views reuse the versions to validate the in-memory catalog snapshot
+        request.catalog_version = get_catalog_version(state)
+        request.stock_version = get_stock_version(state)
+        # The pages show stock counts, so those are part of the validator
+        etag = catalog_etag(request, f'{request.catalog_version}|{request.stock_version}')
+        last_modified = state['last_modified'].timestamp() if state['last_modified'] else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view_func(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(last_modified))
+            patch_vary_headers(response, ('Cookie',))
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return _wrapped_view
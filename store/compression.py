@@ -0,0 +1,173 @@
+import secrets
+import struct
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Bodies smaller than this go out as they are
+COMPRESS_MIN_SIZE = getattr(settings, 'COMPRESS_MIN_SIZE', 200)
+
+# Brotli quality 0-11; 4-5 is the usual choice for dynamic pages, 11 is for
+# assets compressed once ahead of time
+COMPRESS_BROTLI_QUALITY = getattr(settings, 'COMPRESS_BROTLI_QUALITY', 5)
+
+COMPRESS_GZIP_LEVEL = getattr(settings, 'COMPRESS_GZIP_LEVEL', 6)
+
+# Only these Content-Types are compressed; images, archives and fonts are
+# already compressed
+COMPRESSIBLE_TYPES = (
+    'text/', 'application/json', 'application/javascript', 'application/xml',
+    'application/rss+xml', 'application/atom+xml', 'image/svg+xml',
+)
+
+# Random gzip header padding against BREACH, as in GZipMiddleware
+MAX_RANDOM_BYTES = 100
+
+
+def accepted_encoding(header):
+    """'br', 'gzip' or None for an Accept-Encoding header, honouring q-values"""
+    weights = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().lower().partition(';')
+        weight = 1.0
+        if params.strip().startswith('q='):
+            try:
+                weight = float(params.strip()[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip()] = weight
+    candidates = ['br', 'gzip'] if brotli else ['gzip']
+    best = None
+    for coding in candidates:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = coding, weight
+    return best and best[0]
+
+
+def _gzip_header():
+    # RFC 1952 header with a random-length file name, the streaming
+    # counterpart of compress_string(max_random_bytes=...)
+    filename = b'a' * secrets.randbelow(MAX_RANDOM_BYTES)
+    return b'\x1f\x8b\x08\x08' + struct.pack('<I', 0) + b'\x00\xff' + filename + b'\x00'
+
+
+class GzipStream:
+    """
+    Incremental gzip. Every chunk is flushed, so a streamed page reaches the
+    browser as it is produced instead of waiting for zlib's buffer to fill.
+    """
+
+    def __init__(self):
+        self.compressor = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.crc = self.size = 0
+        self.started = False
+
+    def process(self, chunk):
+        header = b'' if self.started else _gzip_header()
+        self.started = True
+        self.crc = zlib.crc32(chunk, self.crc)
+        self.size += len(chunk)
+        return header + self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        header = b'' if self.started else _gzip_header()
+        return header + self.compressor.flush() + struct.pack('<II', self.crc, self.size & 0xFFFFFFFF)
+
+
+class BrotliStream:
+    def __init__(self):
+        self.compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+
+    def process(self, chunk):
+        return self.compressor.process(chunk) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+STREAMS = {'gzip': GzipStream, 'br': BrotliStream}
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+    return compress_string(body, max_random_bytes=MAX_RANDOM_BYTES)
+
+
+def compress_stream(chunks, encoding):
+    stream = STREAMS[encoding]()
+    for chunk in chunks:
+        data = stream.process(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+async def acompress_stream(chunks, encoding):
+    stream = STREAMS[encoding]()
+    async for chunk in chunks:
+        data = stream.process(chunk)
+        if data:
+            yield data
+    yield stream.finish()
+
+
+def is_compressible(response):
+    if response.has_header('Content-Encoding') or response.status_code != 200:
+        return False  # Already encoded, or a 206/304/error that must stay byte-exact or tiny
+    if response.has_header('X-Accel-Redirect') or response.has_header('X-Sendfile'):
+        return False
+    content_type = response.get('Content-Type', '').lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip, whichever the client prefers (brotli on ties, when the
+    Brotli package is installed), for text responses. Replaces Django's
+    GZipMiddleware: streaming responses, sync or async, are compressed chunk
+    by chunk and flushed as they go.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < COMPRESS_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(response.streaming_content, encoding)
+            else:
+                response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response.headers['Content-Length']
+        else:
+            body = compress(response.content, encoding)
+            if len(body) >= len(response.content):
+                return response
+            response.content = body
+            response.headers['Content-Length'] = str(len(body))
+
+        # A strong ETag names the uncompressed bytes (RFC 9110 8.8.1)
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
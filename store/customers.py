@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Lower, Trim
+
+from .archive import from_archive
+from .models import ArchivedOrder, Customer, Order
+
+# Orders read and customers upserted per transaction by sync_customers
+CUSTOMER_SYNC_BATCH_SIZE = getattr(settings, 'CUSTOMER_SYNC_BATCH_SIZE', 2000)
+
+# Copied from a customer's most recent order onto their Customer record
+CUSTOMER_FIELDS = ['full_name', 'phone', 'address', 'city', 'postal_code', 'country']
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def by_email(queryset, email):
+    """
+    Rows whose `email` matches case-insensitively, written as LOWER(email) = %s
+    so the LOWER(email) indexes on orders, archived orders and users serve it
+    (__iexact would compile to UPPER() on PostgreSQL and LIKE on SQLite).
+    """
+    return queryset.alias(email_lower=Lower('email')).filter(email_lower=normalize_email(email))
+
+
+def upsert_customers(orders):
+    """
+    Create or refresh the Customer for every order's email in one INSERT ...
+    ON CONFLICT, each from the last of its orders in `orders` (pass them
+    oldest first), and set the orders' customer_id; saving the orders is
+    left to the caller. Returns {email: customer id}.
+    """
+    latest = {}
+    for order in orders:
+        email = normalize_email(order.email)
+        if email:
+            latest[email] = order
+    if not latest:
+        return {}
+    Customer.objects.bulk_create(
+        [
+            Customer(email=email, **{field: getattr(order, field) or '' for field in CUSTOMER_FIELDS})
+            for email, order in latest.items()
+        ],
+        update_conflicts=True, unique_fields=['email'], update_fields=CUSTOMER_FIELDS + ['updated_at'],
+    )
+    ids = dict(Customer.objects.filter(email__in=latest).values_list('email', 'id'))
+    for order in orders:
+        order.customer_id = ids.get(normalize_email(order.email))
+    return ids
+
+
+def sync_customers(batch_size=CUSTOMER_SYNC_BATCH_SIZE):
+    """
+    Backfill: give every order without a Customer one, oldest orders first so
+    each Customer ends up with its latest details. Customers are never linked
+    to accounts by email alone; claim_order() does that per order. Returns how
+    many orders were read.
+    """
+    last_id = synced = 0
+    while True:
+        orders = list(
+            Order.objects.filter(customer__isnull=True, id__gt=last_id).order_by('id')
+            .only('id', 'email', *CUSTOMER_FIELDS)[:batch_size]
+        )
+        if not orders:
+            return synced
+        with transaction.atomic():
+            upsert_customers(orders)
+            # One UPDATE for the batch, each row finding its Customer through
+            # the unique email index
+            Order.objects.filter(id__in=[order.id for order in orders]).update(customer_id=Subquery(
+                Customer.objects.filter(email=Lower(Trim(OuterRef('email')))).values('id')[:1]
+            ))
+        last_id = orders[-1].id
+        synced += len(orders)
+
+
+def claim_order(user, order):
+    """
+    Attach a guest order found with find_order() to the signed-in `user`.
+    Only the order's number and email together prove ownership, and the email
+    must also be the account's own, so a registration alone never exposes
+    anyone's orders. Returns whether the order was linked.
+    """
+    email = normalize_email(order.email)
+    if order.user_id is not None or not email or email != normalize_email(user.email):
+        return False
+    model = ArchivedOrder if getattr(order, 'is_archived', False) else Order
+    with transaction.atomic():
+        linked = model.objects.filter(order_number=order.order_number, user__isnull=True).update(user=user)
+        if linked:
+            Customer.objects.filter(email=email, user__isnull=True).update(user=user)
+    order.user = user
+    return bool(linked)
+
+
+def find_order(email, order_number):
+    """
+    A guest's order, live or archived, by order number and email. Each
+    table is probed once through its unique order_number index; the email
+    is only compared on the row found.
+    """
+    order_number = (order_number or '').strip().upper()
+    email = normalize_email(email)
+    if not order_number or not email:
+        return None
+    order = by_email(Order.objects.filter(order_number=order_number), email).prefetch_related('items').first()
+    if order is not None:
+        return order
+    archived = by_email(ArchivedOrder.objects.filter(order_number=order_number), email).first()
+    return from_archive(archived) if archived else None
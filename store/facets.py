@@ -0,0 +1,190 @@
+from collections import defaultdict
+
+from django.db.models import BooleanField, Case, CharField, Count, F, Q, Value, When
+
+
+# (key, label, lower bound inclusive, upper bound exclusive) in TND
+PRICE_BUCKETS = [
+    ('0-50', 'Under 50 TND', None, 50),
+    ('50-100', '50 - 100 TND', 50, 100),
+    ('100-250', '100 - 250 TND', 100, 250),
+    ('250-500', '250 - 500 TND', 250, 500),
+    ('500-', 'Over 500 TND', 500, None),
+]
+
+# Yes/no facets, selected with ?<key>=1
+FLAG_FACETS = [
+    ('in_stock', 'In Stock'),
+    ('on_sale', 'On Sale'),
+    ('featured', 'Featured'),
+]
+
+FACET_KEYS = ['category', 'price'] + [key for key, label in FLAG_FACETS]
+
+
+def get_selected_facets(params, categories):
+    """Read the facet selection from the query string, ignoring unknown values"""
+    category_ids = {category.slug: category.id for category in categories}
+    price_keys = {key for key, label, low, high in PRICE_BUCKETS}
+
+    selected = {
+        'category': category_ids.get(params.get('category', '')),
+        'price': params.get('price') if params.get('price') in price_keys else None,
+    }
+    for key, label in FLAG_FACETS:
+        selected[key] = True if params.get(key) == '1' else None
+    return selected
+
+
+def price_bucket_filter(key):
+    """Q object for one price bucket"""
+    for bucket_key, label, low, high in PRICE_BUCKETS:
+        if bucket_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return Q()
+
+
+def filter_by_facets(queryset, selected):
+    """Apply every selected facet to a Product queryset"""
+    if selected['category']:
+        queryset = queryset.filter(category_id=selected['category'])
+    if selected['price']:
+        queryset = queryset.filter(price_bucket_filter(selected['price']))
+    if selected['in_stock']:
+        queryset = queryset.filter(stock__gt=0)
+    if selected['on_sale']:
+        queryset = queryset.filter(old_price__gt=F('price'))
+    if selected['featured']:
+        queryset = queryset.filter(featured=True)
+    return queryset
+
+
+def facet_dimensions():
+    """Per-row facet values as annotations, so one GROUP BY covers every facet"""
+    price_cases = [
+        When(price_bucket_filter(key), then=Value(key))
+        for key, label, low, high in PRICE_BUCKETS
+    ]
+    return {
+        'price_bucket': Case(*price_cases, output_field=CharField()),
+        'in_stock': Case(When(stock__gt=0, then=True), default=False, output_field=BooleanField()),
+        'on_sale': Case(When(old_price__gt=F('price'), then=True), default=False, output_field=BooleanField()),
+        'is_featured': F('featured'),
+    }
+
+
+def price_bucket_for(price):
+    """Price bucket key of a single price (Python twin of facet_dimensions)"""
+    for key, label, low, high in PRICE_BUCKETS:
+        if (low is None or price >= low) and (high is None or price < high):
+            return key
+    return None
+
+
+def facet_values(category_id, price, stock, old_price, featured):
+    """Facet values of one product, in the shape used by tally_facets"""
+    return {
+        'category': category_id,
+        'price': price_bucket_for(price),
+        'in_stock': True if stock > 0 else None,
+        'on_sale': True if old_price is not None and old_price > price else None,
+        'featured': True if featured else None,
+    }
+
+
+def _row_values(row):
+    return {
+        'category': row['category_id'],
+        'price': row['price_bucket'],
+        'in_stock': row['in_stock'] or None,
+        'on_sale': row['on_sale'] or None,
+        'featured': row['is_featured'] or None,
+    }
+
+
+def facet_mismatches(values, selected):
+    """Selected facets that a product with these facet values does not match"""
+    return [key for key in FACET_KEYS if selected[key] and values[key] != selected[key]]
+
+
+def tally_facets(groups, selected):
+    """
+    Count facet values over (values, n) groups. Each facet is counted with all
+    the *other* selected facets applied, so a value's count is the number of
+    results you get by picking it. Returns (counts, total) where counts maps
+    facet key -> {value: count}.
+    """
+    counts = {key: defaultdict(int) for key in FACET_KEYS}
+    total = 0
+    for values, n in groups:
+        mismatches = facet_mismatches(values, selected)
+        if not mismatches:
+            total += n
+        for key in FACET_KEYS:
+            # A group counts towards a facet if it only fails that facet's own filter
+            if not mismatches or mismatches == [key]:
+                counts[key][values[key]] += n
+    return counts, total
+
+
+def count_facets(queryset, selected):
+    """Count every facet value for the current result set in a single grouped query"""
+    groups = (
+        queryset.order_by()
+        .annotate(**facet_dimensions())
+        .values('category_id', 'price_bucket', 'in_stock', 'on_sale', 'is_featured')
+        .annotate(n=Count('id'))
+    )
+    return tally_facets(((_row_values(row), row['n']) for row in groups), selected)
+
+
+def _toggle_url(params, key, value):
+    params = params.copy()
+    params.pop('page', None)
+    if params.get(key) == value:
+        params.pop(key)
+    else:
+        params[key] = value
+    query = params.urlencode()
+    return f'?{query}' if query else '?'
+
+
+def build_facets(params, categories, selected, counts):
+    """Template-ready facet groups with labels, live counts and toggle links"""
+    category_facet = [
+        {
+            'label': category.name,
+            'count': counts['category'].get(category.id, 0),
+            'selected': selected['category'] == category.id,
+            'url': _toggle_url(params, 'category', category.slug),
+        }
+        for category in categories
+    ]
+    price_facet = [
+        {
+            'label': label,
+            'count': counts['price'].get(key, 0),
+            'selected': selected['price'] == key,
+            'url': _toggle_url(params, 'price', key),
+        }
+        for key, label, low, high in PRICE_BUCKETS
+    ]
+    flag_facet = [
+        {
+            'label': label,
+            'count': counts[key].get(True, 0),
+            'selected': bool(selected[key]),
+            'url': _toggle_url(params, key, '1'),
+        }
+        for key, label in FLAG_FACETS
+    ]
+    return {
+        'category': category_facet,
+        'price': price_facet,
+        'flags': flag_facet,
+    }
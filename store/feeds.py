@@ -0,0 +1,223 @@
+import gzip
+import json
+import os
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Category, Product
+from .serializers import product_url_template
+
+# Where sitemaps and feeds are written; served by views.feed_file
+FEEDS_ROOT = getattr(settings, 'FEEDS_ROOT', os.path.join(settings.MEDIA_ROOT, 'feeds'))
+
+# Products per shard. Shard n always covers the same id range, so a change
+# only ever rewrites the shard it falls in. 50,000 is the sitemap URL limit.
+FEED_SHARD_SIZE = getattr(settings, 'FEED_SHARD_SIZE', 50_000)
+
+FEED_CURRENCY = getattr(settings, 'FEED_CURRENCY', 'TND')
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+IMAGE_NS = 'http://www.google.com/schemas/sitemap-image/1.1'
+GOOGLE_NS = 'http://base.google.com/ns/1.0'
+
+MANIFEST = 'manifest.json'
+
+
+def _path(name):
+    return os.path.join(FEEDS_ROOT, name)
+
+
+def _url(path):
+    return settings.SITE_URL.rstrip('/') + path
+
+
+def sitemap_shard_name(shard):
+    return f'sitemap-products-{shard + 1}.xml.gz'
+
+
+def feed_shard_name(shard):
+    return f'merchant-feed-{shard + 1}.xml.gz'
+
+
+class AtomicFileWriter:
+    """Streams text (gzipped by default) into name.tmp and renames it into place, so readers never see half a file"""
+
+    def __init__(self, name, compress=True):
+        self.path = _path(name)
+        self.tmp_path = self.path + '.tmp'
+        self.compress = compress
+
+    def __enter__(self):
+        if self.compress:
+            # mtime=0 keeps unchanged shards byte-identical between runs
+            self.file = gzip.GzipFile(self.tmp_path, 'wb', compresslevel=6, mtime=0)
+        else:
+            self.file = open(self.tmp_path, 'wb')
+        return self
+
+    def write(self, text):
+        self.file.write(text.encode())
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def shard_products(shard):
+    """Available products of one shard, streamed from the database in id order"""
+    low = shard * FEED_SHARD_SIZE
+    return (
+        Product.objects.filter(available=True, id__gt=low, id__lte=low + FEED_SHARD_SIZE)
+        .select_related('category')
+        .only('id', 'name', 'slug', 'description', 'price', 'old_price', 'stock', 'image',
+              'updated_at', 'category__name')
+        .order_by('id')
+        .iterator(chunk_size=2000)
+    )
+
+
+def product_link(product):
+    return _url(product_url_template().format(id=product.id, slug=product.slug))
+
+
+def image_link(product):
+    return _url(product.image.url) if product.image else ''
+
+
+def write_sitemap_shard(shard):
+    with AtomicFileWriter(sitemap_shard_name(shard)) as out:
+        out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}" xmlns:image="{IMAGE_NS}">\n')
+        for product in shard_products(shard):
+            out.write(f'<url><loc>{escape(product_link(product))}</loc>'
+                      f'<lastmod>{product.updated_at.date().isoformat()}</lastmod>')
+            image = image_link(product)
+            if image:
+                out.write(f'<image:image><image:loc>{escape(image)}</image:loc></image:image>')
+            out.write('</url>\n')
+        out.write('</urlset>\n')
+
+
+def write_feed_shard(shard):
+    with AtomicFileWriter(feed_shard_name(shard)) as out:
+        out.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0" xmlns:g="{GOOGLE_NS}">\n<channel>\n'
+            f'<title>Elite Shop</title><link>{escape(_url("/"))}</link>'
+            f'<description>Elite Shop products</description>\n'
+        )
+        for product in shard_products(shard):
+            fields = [
+                ('g:id', product.id),
+                ('title', product.name),
+                ('description', product.description[:5000]),
+                ('link', product_link(product)),
+                ('g:image_link', image_link(product)),
+                ('g:availability', 'in_stock' if product.stock > 0 else 'out_of_stock'),
+                ('g:condition', 'new'),
+                ('g:product_type', product.category.name if product.category else ''),
+            ]
+            if product.old_price and product.old_price > product.price:
+                fields.append(('g:price', f'{product.old_price} {FEED_CURRENCY}'))
+                fields.append(('g:sale_price', f'{product.price} {FEED_CURRENCY}'))
+            else:
+                fields.append(('g:price', f'{product.price} {FEED_CURRENCY}'))
+            out.write('<item>' + ''.join(
+                f'<{tag}>{escape(str(value))}</{tag}>' for tag, value in fields if value != ''
+            ) + '</item>\n')
+        out.write('</channel>\n</rss>\n')
+
+
+def write_pages_sitemap():
+    urls = [reverse('home'), reverse('products'), reverse('contact')]
+    urls += [f"{reverse('products')}?category={slug}" for slug in Category.objects.values_list('slug', flat=True)]
+    with AtomicFileWriter('sitemap-pages.xml.gz') as out:
+        out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n')
+        for path in urls:
+            out.write(f'<url><loc>{escape(_url(path))}</loc></url>\n')
+        out.write('</urlset>\n')
+
+
+def write_sitemap_index(shards):
+    with AtomicFileWriter('sitemap.xml', compress=False) as out:
+        out.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n')
+        out.write(f"<sitemap><loc>{escape(_url(reverse('feed_file', args=['sitemap-pages.xml.gz'])))}</loc></sitemap>\n")
+        for shard, state in sorted(shards.items()):
+            location = _url(reverse('feed_file', args=[sitemap_shard_name(shard)]))
+            out.write(f"<sitemap><loc>{escape(location)}</loc><lastmod>{state['updated'][:10]}</lastmod></sitemap>\n")
+        out.write('</sitemapindex>\n')
+
+
+def shard_states():
+    """{shard: {'updated': iso time, 'count': products}} from one grouped query"""
+    rows = (
+        Product.objects.annotate(
+            shard=ExpressionWrapper((F('id') - 1) / FEED_SHARD_SIZE, output_field=IntegerField())
+        )
+        .values('shard')
+        .annotate(updated=Max('updated_at'), count=Count('id'))
+        .order_by('shard')
+    )
+    return {row['shard']: {'updated': row['updated'].isoformat(), 'count': row['count']} for row in rows}
+
+
+def load_manifest():
+    try:
+        with open(_path(MANIFEST)) as manifest:
+            data = json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+    data['shards'] = {int(shard): state for shard, state in data.get('shards', {}).items()}
+    return data
+
+
+def generate_feeds(full=False):
+    """
+    Rewrite the sitemap and merchant feed shards whose products changed since
+    the last run (any product saved, added or deleted in the shard's id range).
+    Returns the list of rewritten shard numbers.
+    """
+    os.makedirs(FEEDS_ROOT, exist_ok=True)
+    previous = {} if full else load_manifest()
+    categories = Category.objects.aggregate(updated=Max('updated_at'), count=Count('id'))
+    categories_updated = f"{categories['updated'].isoformat() if categories['updated'] else ''}|{categories['count']}"
+    # Category names appear in every feed item; a new site URL in every link
+    everything = (
+        previous.get('site_url') != settings.SITE_URL
+        or previous.get('categories_updated') != categories_updated
+        or previous.get('shard_size') != FEED_SHARD_SIZE
+    )
+    old_shards = previous.get('shards', {})
+    shards = shard_states()
+
+    rewritten = []
+    for shard, state in shards.items():
+        if everything or old_shards.get(shard) != state:
+            write_sitemap_shard(shard)
+            write_feed_shard(shard)
+            rewritten.append(shard)
+    for shard in set(old_shards) - set(shards):
+        for name in (sitemap_shard_name(shard), feed_shard_name(shard)):
+            if os.path.exists(_path(name)):
+                os.remove(_path(name))
+
+    if everything:
+        write_pages_sitemap()
+    if everything or rewritten or set(old_shards) != set(shards):
+        write_sitemap_index(shards)
+
+    with open(_path(MANIFEST + '.tmp'), 'w') as manifest:
+        json.dump({
+            'site_url': settings.SITE_URL,
+            'shard_size': FEED_SHARD_SIZE,
+            'categories_updated': categories_updated,
+            'generated_at': timezone.now().isoformat(),
+            'shards': {str(shard): state for shard, state in shards.items()},
+        }, manifest, indent=1)
+    os.replace(_path(MANIFEST + '.tmp'), _path(MANIFEST))
+    return rewritten
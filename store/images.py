@@ -0,0 +1,101 @@
+import hashlib
+import io
+import os
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import ExifTags, Image, ImageOps, UnidentifiedImageError
+
+from .media import content_name
+
+# Uploaded images are scaled down to fit this box
+MAX_IMAGE_SIZE = (1600, 1600)
+
+# Accepted image formats and the extension they are stored with
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif'}
+
+
+def normalize(image):
+    """The image turned upright and shrunk into MAX_IMAGE_SIZE, or None if it already is"""
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    if orientation == 1 and image.width <= MAX_IMAGE_SIZE[0] and image.height <= MAX_IMAGE_SIZE[1]:
+        return None
+    fixed = ImageOps.exif_transpose(image)
+    fixed.thumbnail(MAX_IMAGE_SIZE)
+    if image.format == 'JPEG' and fixed.mode not in ('RGB', 'L'):
+        fixed = fixed.convert('RGB')
+    return fixed
+
+
+def encode(image, image_format):
+    output = io.BytesIO()
+    image.save(output, format=image_format, optimize=True)
+    return output.getvalue()
+
+
+# Open archives of this process; reading a zip's directory for every member
+# would make ingestion quadratic
+_archives = {}
+
+
+def read_source(source):
+    """Bytes of ('path', None) or ('archive.zip', 'member name')"""
+    path, member = source
+    if member is None:
+        with open(path, 'rb') as image_file:
+            return image_file.read()
+    if path not in _archives:
+        _archives[path] = zipfile.ZipFile(path)
+    return _archives[path].read(member)
+
+
+def prepare(source, directory):
+    """
+    Validate, normalize and store one image; runs in the ingest_images
+    process pool. Returns (source, stored name, error); nothing touches the
+    database here.
+    """
+    try:
+        data = read_source(source)
+        with Image.open(io.BytesIO(data)) as image:
+            if image.format not in FORMATS:
+                return source, None, f'unsupported format {image.format}'
+            image.load()
+            fixed = normalize(image)
+            if fixed is not None:
+                data = encode(fixed, image.format)
+            extension = FORMATS[image.format]
+    except UnidentifiedImageError:
+        return source, None, 'not an image'
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError, zipfile.BadZipFile) as exc:
+        return source, None, f'unreadable image ({exc})'
+
+    # The storage names files by content; checking first skips rewriting a duplicate
+    name = content_name(f'{directory}/image{extension}', hashlib.sha256(data).hexdigest())
+    if not default_storage.exists(name):
+        name = default_storage.save(f'{directory}/image{extension}', ContentFile(data))
+    return source, name, None
+
+
+def list_sources(path):
+    """[(path, member)] of every image file in a directory tree or zip archive"""
+    extensions = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return [
+                (path, info.filename) for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(extensions)
+                and not os.path.basename(info.filename).startswith('.')
+            ]
+    return [
+        (os.path.join(directory, filename), None)
+        for directory, _, filenames in os.walk(path) for filename in sorted(filenames)
+        if filename.lower().endswith(extensions) and not filename.startswith('.')
+    ]
+
+
+def source_slug(source):
+    """The slug an image is for: its file name without the extension"""
+    path, member = source
+    return os.path.splitext(os.path.basename(member or path))[0].lower()
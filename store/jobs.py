@@ -0,0 +1,253 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Job
+from .sequences import reserve_block
+
+logger = logging.getLogger(__name__)
+
+# Maximum jobs running at once per queue, across all workers
+JOB_QUEUES = getattr(settings, 'JOB_QUEUES', {'default': 4})
+
+# Retry delay is JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1) seconds, plus jitter
+JOB_RETRY_BASE_DELAY = getattr(settings, 'JOB_RETRY_BASE_DELAY', 10)
+
+# A running job whose worker has been silent this long is handed out again.
+# Workers refresh locked_at of their running jobs every quarter of this, so
+# only jobs of a dead worker go stale, however long they take.
+JOB_LOCK_TIMEOUT = getattr(settings, 'JOB_LOCK_TIMEOUT', 600)
+JOB_HEARTBEAT_INTERVAL = JOB_LOCK_TIMEOUT / 4
+
+_tasks = {}
+
+
+def task(name=None, queue='default', max_attempts=5):
+    """
+    Register a function as a background task:
+
+        @task(queue='email')
+        def send_welcome_email(user_id): ...
+
+        send_welcome_email.enqueue(user_id=user.id)
+
+    Keyword arguments must be JSON serializable; they are stored as the payload.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        _tasks[task_name] = func
+
+        def enqueue_task(**kwargs):
+            options = {
+                key: kwargs.pop(key) for key in ('delay', 'run_at', 'idempotency_key') if key in kwargs
+            }
+            return enqueue(task_name, payload=kwargs, queue=queue, max_attempts=max_attempts, **options)
+
+        func.task_name = task_name
+        func.enqueue = enqueue_task
+        return func
+    return decorator
+
+
+def enqueue(task_name, payload=None, queue='default', delay=None, run_at=None,
+            idempotency_key=None, max_attempts=5):
+    """
+    Store a job for the worker. With an idempotency key, enqueueing the same
+    key again returns the existing job instead of creating a second one.
+    """
+    if run_at is None:
+        run_at = timezone.now() + timedelta(seconds=delay or 0)
+    job = Job(
+        task=task_name, queue=queue, payload=payload or {}, run_at=run_at,
+        idempotency_key=idempotency_key, max_attempts=max_attempts,
+    )
+    if idempotency_key is None:
+        job.save()
+        return job
+    try:
+        with transaction.atomic():
+            job.save()
+        return job
+    except IntegrityError:
+        return Job.objects.get(idempotency_key=idempotency_key)
+
+
+def enqueue_on_commit(task_name, **kwargs):
+    """Enqueue only once the surrounding transaction commits"""
+    transaction.on_commit(lambda: enqueue(task_name, **kwargs))
+
+
+def retry_delay(attempt):
+    delay = JOB_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+    return delay + random.uniform(0, delay / 4)
+
+
+def heartbeat(job_ids, worker_id):
+    """Mark jobs this worker is still running as alive"""
+    if not job_ids:
+        return 0
+    return Job.objects.filter(id__in=job_ids, status=Job.RUNNING, locked_by=worker_id).update(
+        locked_at=timezone.now()
+    )
+
+
+def requeue_stuck_jobs():
+    """Give jobs whose worker died mid-run (and stopped sending heartbeats) back to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=JOB_LOCK_TIMEOUT)
+    return Job.objects.filter(status=Job.RUNNING, locked_at__lt=cutoff).update(
+        status=Job.QUEUED, locked_by='', locked_at=None
+    )
+
+
+def claim_jobs(queue, limit, worker_id):
+    """
+    Atomically take up to `limit` due jobs from a queue. Each claim is a
+    conditional UPDATE, so two workers can never run the same job, and the
+    queue's row in the sequence table is held locked from counting the
+    running jobs to the last claim, so workers claiming at the same time
+    can't both fill the same free capacity.
+    """
+    with transaction.atomic():
+        # Taking a value is an UPDATE, which locks the row until commit
+        reserve_block(f'job_queue:{queue}', 1)
+        running = Job.objects.filter(queue=queue, status=Job.RUNNING).count()
+        free = min(limit, JOB_QUEUES.get(queue, 1) - running)
+        if free <= 0:
+            return []
+
+        candidates = list(
+            Job.objects.filter(queue=queue, status=Job.QUEUED, run_at__lte=timezone.now())
+            .order_by('run_at')
+            .values_list('id', flat=True)[:free]
+        )
+        claimed = []
+        for job_id in candidates:
+            updated = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_by=worker_id, locked_at=timezone.now()
+            )
+            if updated:
+                claimed.append(job_id)
+    return claimed
+
+
+def run_job(job_id):
+    """Run one claimed job and record the outcome"""
+    close_old_connections()
+    job = Job.objects.get(id=job_id)
+    job.attempts += 1
+    try:
+        func = _tasks[job.task]
+        func(**job.payload)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error('Job %s (%s) failed permanently', job.id, job.task)
+        else:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        job.locked_by = ''
+        job.locked_at = None
+    else:
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+        job.last_error = ''
+    job.save(update_fields=['attempts', 'status', 'run_at', 'finished_at', 'last_error', 'locked_by', 'locked_at'])
+    close_old_connections()
+    return job
+
+
+class Worker:
+    """Polls the job table and runs due jobs in one thread pool per queue"""
+
+    def __init__(self, queues=None, poll_interval=1.0):
+        self.queues = {name: limit for name, limit in JOB_QUEUES.items() if not queues or name in queues}
+        self.poll_interval = poll_interval
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.pools = {
+            name: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f'jobs-{name}')
+            for name, limit in self.queues.items()
+        }
+        self.in_flight = {name: 0 for name in self.queues}
+        self.running = set()
+        self.last_heartbeat = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _finished(self, queue, job_id, future):
+        with self._lock:
+            self.in_flight[queue] -= 1
+            self.running.discard(job_id)
+        if future.exception():
+            logger.error('Job runner crashed', exc_info=future.exception())
+
+    def heartbeat(self, force=False):
+        """Refresh the locks of this worker's running jobs, every JOB_HEARTBEAT_INTERVAL"""
+        if not force and time.monotonic() - self.last_heartbeat < JOB_HEARTBEAT_INTERVAL:
+            return
+        with self._lock:
+            job_ids = list(self.running)
+        try:
+            heartbeat(job_ids, self.worker_id)
+        except Exception:
+            logger.exception('Could not send the job heartbeat')
+        self.last_heartbeat = time.monotonic()
+
+    def run_once(self):
+        """Claim and start as many due jobs as the pools have room for"""
+        started = 0
+        for queue, limit in self.queues.items():
+            with self._lock:
+                room = limit - self.in_flight[queue]
+            if room <= 0:
+                continue
+            for job_id in claim_jobs(queue, room, self.worker_id):
+                with self._lock:
+                    self.in_flight[queue] += 1
+                    self.running.add(job_id)
+                future = self.pools[queue].submit(run_job, job_id)
+                future.add_done_callback(
+                    lambda future, queue=queue, job_id=job_id: self._finished(queue, job_id, future)
+                )
+                started += 1
+        return started
+
+    def run(self, once=False):
+        last_requeue = 0
+        while not self._stopping.is_set():
+            self.heartbeat()
+            if time.monotonic() - last_requeue > JOB_LOCK_TIMEOUT / 4:
+                requeue_stuck_jobs()
+                last_requeue = time.monotonic()
+            started = self.run_once()
+            if once:
+                break
+            if not started:
+                close_old_connections()
+                self._stopping.wait(self.poll_interval)
+        self.shutdown()
+
+    def stop(self):
+        self._stopping.set()
+
+    def shutdown(self):
+        # Keep the heartbeat going while the running jobs finish
+        while True:
+            with self._lock:
+                if not self.running:
+                    break
+            self.heartbeat()
+            time.sleep(min(self.poll_interval, JOB_HEARTBEAT_INTERVAL))
+        for pool in self.pools.values():
+            pool.shutdown(wait=True)
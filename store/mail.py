@@ -0,0 +1,138 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .buffers import BulkInsertBuffer
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+# Seconds between spool runs; emails queued in the same window share one SMTP connection
+MAIL_SPOOL_INTERVAL = getattr(settings, 'MAIL_SPOOL_INTERVAL', 5)
+
+# Emails sent per SMTP connection
+MAIL_SPOOL_BATCH_SIZE = getattr(settings, 'MAIL_SPOOL_BATCH_SIZE', 100)
+
+# Delivery attempts before an email is marked failed
+MAIL_MAX_ATTEMPTS = getattr(settings, 'MAIL_MAX_ATTEMPTS', 5)
+
+# An email stuck in "sending" this long (worker died mid-batch) is queued again
+MAIL_SENDING_TIMEOUT = 15 * 60
+
+
+def _buffer_flushed(by_model):
+    if OutboundEmail in by_model:
+        schedule_spool()
+
+
+# Contact form submissions and their emails, bulk-inserted off the request path
+outbox = BulkInsertBuffer(
+    'outbox',
+    interval=getattr(settings, 'WRITE_BUFFER_FLUSH_INTERVAL', 1),
+    on_flush=_buffer_flushed,
+)
+
+
+def compose(to_email, subject, body, reply_to=''):
+    """An unsaved spool entry; save it, bulk_create it or hand it to `outbox`"""
+    return OutboundEmail(to_email=to_email, subject=subject, body=body, reply_to=reply_to or '')
+
+
+def spool(to_email, subject, body, reply_to=''):
+    """Queue one email for the next spool run"""
+    email = compose(to_email, subject, body, reply_to)
+    email.save()
+    schedule_spool()
+    return email
+
+
+def schedule_spool(delay=None):
+    """Make sure a spool run is due within MAIL_SPOOL_INTERVAL (one job per window)"""
+    from .tasks import send_mail_spool
+
+    interval = MAIL_SPOOL_INTERVAL if delay is None else delay
+    slot = int(time.time() // interval) + 1
+    send_mail_spool.enqueue(delay=slot * interval - time.time(), idempotency_key=f'mail-spool:{interval}:{slot}')
+
+
+def claim_batch(batch_size, after_id=0):
+    """Take up to `batch_size` queued emails; the conditional UPDATE keeps concurrent runs apart"""
+    ids = list(
+        OutboundEmail.objects.filter(status=OutboundEmail.QUEUED, id__gt=after_id)
+        .order_by('id').values_list('id', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    claimed_at = timezone.now()
+    OutboundEmail.objects.filter(id__in=ids, status=OutboundEmail.QUEUED).update(
+        status=OutboundEmail.SENDING, claimed_at=claimed_at
+    )
+    return list(OutboundEmail.objects.filter(id__in=ids, status=OutboundEmail.SENDING, claimed_at=claimed_at))
+
+
+def send_batch(emails):
+    """Send a batch over one SMTP connection; returns (sent ids, {id: error})"""
+    sent, failed = [], {}
+    connection = get_connection()
+    connection.open()
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to_email],
+                reply_to=[email.reply_to] if email.reply_to else None, connection=connection,
+            )
+            try:
+                message.send()
+                sent.append(email.id)
+            except Exception as exc:
+                failed[email.id] = str(exc) or exc.__class__.__name__
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def send_spool(batch_size=MAIL_SPOOL_BATCH_SIZE):
+    """Deliver everything queued, one connection per batch. Returns (sent, failed) counts."""
+    OutboundEmail.objects.filter(
+        status=OutboundEmail.SENDING, claimed_at__lt=timezone.now() - timedelta(seconds=MAIL_SENDING_TIMEOUT)
+    ).update(status=OutboundEmail.QUEUED)
+
+    total_sent = total_failed = 0
+    last_id = 0
+    while True:
+        # Emails that fail in this run wait for the next one instead of being retried at once
+        emails = claim_batch(batch_size, after_id=last_id)
+        if not emails:
+            break
+        last_id = max(email.id for email in emails)
+        try:
+            sent, failed = send_batch(emails)
+        except Exception as exc:
+            # Could not even connect: the whole batch goes back to the queue
+            logger.warning('Mail spool could not reach the mail server: %s', exc)
+            sent, failed = [], {email.id: str(exc) for email in emails}
+
+        OutboundEmail.objects.filter(id__in=sent).update(status=OutboundEmail.SENT, sent_at=timezone.now())
+        for email_id, error in failed.items():
+            OutboundEmail.objects.filter(id=email_id).update(attempts=F('attempts') + 1, last_error=error)
+        if failed:
+            OutboundEmail.objects.filter(id__in=list(failed), attempts__gte=MAIL_MAX_ATTEMPTS).update(
+                status=OutboundEmail.FAILED
+            )
+            OutboundEmail.objects.filter(id__in=list(failed), status=OutboundEmail.SENDING).update(
+                status=OutboundEmail.QUEUED
+            )
+        total_sent += len(sent)
+        total_failed += len(failed)
+        if failed and not sent:
+            # The server is refusing everything; try again later rather than spin
+            break
+
+    if total_failed:
+        schedule_spool(delay=60)
+    return total_sent, total_failed
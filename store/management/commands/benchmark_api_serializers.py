@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from store.models import Category, Product
+from store.serializers import ProductSerializer
+
+
+class Command(BaseCommand):
+    help = 'Measure product list serialization throughput (rows/second) on unsaved in-memory rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        now = datetime.now(timezone.utc)
+        categories = [Category(id=i, name=f'Category {i}', slug=f'category-{i}') for i in range(1, 21)]
+        products = [
+            Product(
+                id=i, name=f'Product {i}', slug=f'product-{i}', category=categories[i % 20],
+                description='A short product description.', price=Decimal('49.90'),
+                old_price=Decimal('59.90') if i % 3 == 0 else None, discount_percentage=16 if i % 3 == 0 else 0,
+                stock=i % 40, available=True, featured=i % 10 == 0, image=f'products/{i}.jpg',
+                created_at=now, updated_at=now,
+            )
+            for i in range(1, options['products'] + 1)
+        ]
+
+        factory = APIRequestFactory()
+        cases = [
+            ('all fields', '/api/products/'),
+            ('?fields=id,name,price', '/api/products/?fields=id,name,price'),
+            ('?fields=id,name,price,category,url', '/api/products/?fields=id,name,price,category,url'),
+        ]
+        for label, path in cases:
+            request = Request(factory.get(path))
+            started = time.perf_counter()
+            ProductSerializer(products, many=True, context={'request': request}).data
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{label:<38} {len(products) / elapsed:>10,.0f} rows/s ({elapsed * 1000:.0f} ms for {len(products):,})'
+            )
@@ -0,0 +1,73 @@
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from store.snapshot import CatalogSnapshot, CategoryRecord, ImageRef, ProductRecord
+
+
+class Command(BaseCommand):
+    help = 'Measure memory and listing speed of the in-memory catalog snapshot on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        now = datetime.now(timezone.utc)
+
+        tracemalloc.start()
+        categories = [
+            CategoryRecord(i, f'Category {i}', f'category-{i}', '', ImageRef('', ''))
+            for i in range(1, options['categories'] + 1)
+        ]
+        products = []
+        for i in range(1, options['products'] + 1):
+            price = Decimal(rng.randint(500, 100000)) / 100
+            old_price = price * Decimal('1.25') if rng.random() < 0.3 else None
+            products.append(ProductRecord(
+                i, f'Product {i}', f'product-{i}', 'A short product description. ' * 4,
+                price, old_price, 20 if old_price else 0,
+                ImageRef(f'products/{i}.jpg', f'/media/products/{i}.jpg'),
+                rng.randint(0, 50), rng.random() < 0.1, rng.random() * 1000,
+                now - timedelta(minutes=i), rng.choice(categories),
+            ))
+
+        started = time.perf_counter()
+        snapshot = CatalogSnapshot('benchmark', categories, products, {})
+        build_seconds = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        per_product = current / len(products)
+        self.stdout.write(f'Products:          {len(products):,}')
+        self.stdout.write(f'Snapshot memory:   {current / 2**20:.1f} MiB ({per_product:.0f} bytes/product)')
+        self.stdout.write(f'Peak while built:  {peak / 2**20:.1f} MiB')
+        self.stdout.write(f'Build time:        {build_seconds * 1000:.0f} ms (excluding the database query)')
+
+        selected = {'category': None, 'price': None, 'in_stock': None, 'on_sale': None, 'featured': None}
+        cases = [
+            ('all, newest', 'newest', {}),
+            ('category, price_low', 'price_low', {'category': categories[0].id}),
+            ('category + on sale', 'discount', {'category': categories[0].id, 'on_sale': True}),
+        ]
+        for label, sort, extra in cases:
+            selection = dict(selected, **extra)
+
+            started = time.perf_counter()
+            snapshot.listing(sort, selection)
+            first = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                ids, facet_counts, total = snapshot.listing(sort, selection)
+                snapshot.get_products(ids[:24])
+            repeated = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(
+                f'{label:<22} first {first * 1e6:>8.0f} us, then {repeated * 1e6:>6.1f} us/listing'
+            )
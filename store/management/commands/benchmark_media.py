@@ -0,0 +1,74 @@
+import os
+import shutil
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.views.static import serve
+
+from store import media
+from store.views import media_file
+
+BENCHMARK_DIR = 'benchmark-media'
+
+
+class Command(BaseCommand):
+    help = 'Compare media serving through store.views.media_file with django.views.static.serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1024, help='Test file size in KiB')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+
+    def measure(self, view, requests, **headers):
+        path = f'{BENCHMARK_DIR}/image.jpg'
+        sent = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            request = self.factory.get(f'/media/{path}', **headers)
+            if view is serve:
+                response = serve(request, path, document_root=settings.MEDIA_ROOT)
+            else:
+                response = media_file(request, path)
+            if response.streaming:
+                sent += sum(len(chunk) for chunk in response.streaming_content)
+            else:
+                sent += len(response.content)
+            response.close()
+        seconds = time.perf_counter() - started
+        return requests / seconds, sent / seconds / 2**20, response.status_code
+
+    def handle(self, *args, **options):
+        directory = os.path.join(settings.MEDIA_ROOT, BENCHMARK_DIR)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'image.jpg'), 'wb') as output:
+            output.write(os.urandom(options['size'] * 1024))
+        self.factory = RequestFactory()
+        requests = options['requests']
+
+        try:
+            probe = media_file(self.factory.get('/'), f'{BENCHMARK_DIR}/image.jpg')
+            probe.close()
+            etag, last_modified = probe['ETag'], probe['Last-Modified']
+            scenarios = [
+                ('full file', {}),
+                ('revalidate (If-None-Match)', {'HTTP_IF_NONE_MATCH': etag}),
+                ('revalidate (If-Modified-Since)', {'HTTP_IF_MODIFIED_SINCE': last_modified}),
+                ('range 64 KiB', {'HTTP_RANGE': 'bytes=0-65535'}),
+            ]
+            self.stdout.write(f"{options['size']} KiB file, {requests} requests per scenario\n")
+            self.stdout.write(f"{'scenario':<32}{'path':<12}{'status':>7}{'req/s':>10}{'MiB/s':>10}")
+            for label, headers in scenarios:
+                for name, view in (('static', serve), ('media', media_file)):
+                    rate, throughput, status = self.measure(view, requests, **headers)
+                    self.stdout.write(f'{label:<32}{name:<12}{status:>7}{rate:>10.0f}{throughput:>10.1f}')
+
+            media.MEDIA_OFFLOAD = 'x-accel-redirect'
+            rate, throughput, status = self.measure(media_file, requests)
+            self.stdout.write(f"{'full file, X-Accel-Redirect':<32}{'media':<12}{status:>7}{rate:>10.0f}{throughput:>10.1f}")
+            self.stdout.write(
+                '\nIn-process numbers: under gunicorn, whole files and ranges from media_file '
+                'are sent with sendfile() and never pass through Python.'
+            )
+        finally:
+            shutil.rmtree(directory)
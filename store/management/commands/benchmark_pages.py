@@ -0,0 +1,92 @@
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.test import Client
+from django.urls import reverse
+
+from store import compression, minify
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Bytes on the wire and render time per page, with and without HTML minification and compression'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', help='Pages to request (default: the main storefront pages)')
+        parser.add_argument('--repeat', type=int, default=30, help='Requests per page and configuration')
+
+    def default_paths(self):
+        paths = ['/', '/products/', '/cart/', '/login/', '/register/', '/contact/']
+        product = Product.objects.filter(available=True).order_by('id').values_list('id', 'slug').first()
+        if product:
+            paths.insert(2, reverse('product_detail', args=product))
+        return paths
+
+    def set_minify(self, enabled):
+        minify.HTML_MINIFY = enabled
+        for engine in engines.all():
+            for loader in engine.engine.template_loaders:
+                if hasattr(loader, 'reset'):
+                    loader.reset()
+
+    def measure(self, path, repeat, encoding='identity'):
+        """(median ms, body bytes) over `repeat` requests after one untimed request"""
+        self.client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = self.client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            times.append(time.perf_counter() - started)
+        return statistics.median(times) * 1000, len(body), response
+
+    def handle(self, *args, **options):
+        host = urlsplit(settings.SITE_URL).netloc or 'localhost'
+        self.client = Client(HTTP_HOST=host, secure=settings.SITE_URL.startswith('https'))
+        repeat = options['repeat']
+        encodings = ['gzip'] + (['br'] if compression.brotli else [])
+        if not compression.brotli:
+            self.stdout.write('Brotli is not installed; measuring gzip only.\n')
+
+        rows = []
+        configured = minify.HTML_MINIFY
+        try:
+            for path in options['paths'] or self.default_paths():
+                self.set_minify(False)
+                before_ms, before_bytes, response = self.measure(path, repeat)
+                if response.status_code != 200:
+                    self.stdout.write(f'{path}: status {response.status_code}, skipped')
+                    continue
+                _, before_gzip, _ = self.measure(path, 1, 'gzip')
+                self.set_minify(True)
+                after_ms, after_bytes, _ = self.measure(path, repeat)
+                compressed = {}
+                for encoding in encodings:
+                    ms, size, response = self.measure(path, repeat, encoding)
+                    compressed[encoding] = (ms, size, response.get('Content-Encoding'))
+                rows.append((path, before_ms, before_bytes, before_gzip, after_ms, after_bytes, compressed))
+        finally:
+            self.set_minify(configured)
+
+        self.stdout.write(
+            f"{'page':<40}{'before':>10}{'gzip':>9}{'minified':>10}"
+            + ''.join(f'{encoding:>9}' for encoding in encodings)
+            + f"{'render ms':>11}{'minified':>10}"
+            + ''.join(f'{"+" + encoding:>9}' for encoding in encodings)
+        )
+        for path, before_ms, before_bytes, before_gzip, after_ms, after_bytes, compressed in rows:
+            self.stdout.write(
+                f'{path[:39]:<40}{before_bytes:>10}{before_gzip:>9}{after_bytes:>10}'
+                + ''.join(f'{compressed[encoding][1]:>9}' for encoding in encodings)
+                + f'{before_ms:>11.2f}{after_ms:>10.2f}'
+                + ''.join(f'{compressed[encoding][0]:>9.2f}' for encoding in encodings)
+            )
+        self.stdout.write(
+            '\nSizes are bytes on the wire: "before" is the page as rendered today, '
+            '"gzip" that page gzipped, the rest the minified page. Times are median '
+            'milliseconds per request through the full middleware stack.'
+        )
@@ -0,0 +1,75 @@
+import json
+import random
+import secrets
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from store.models import Order, PaymentEvent
+from store.payments import sign_payload
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure webhook throughput with redelivered events; all rows are rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--duplicates', type=int, default=3, help='Deliveries of each event')
+
+    def handle(self, *args, **options):
+        client = Client()
+        url = reverse('payment_webhook')
+        try:
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    Order(
+                        order_number=f'BENCH-{secrets.token_hex(6)}', full_name='Benchmark', email='bench@example.com',
+                        phone='0', address='-', city='-', postal_code='0', total_amount=100,
+                        payment_method='stripe', payment_status=Order.PAYMENT_AWAITING,
+                        stripe_payment_intent=f'pi_{secrets.token_hex(12)}',
+                    )
+                    for _ in range(options['orders'])
+                ])
+                events = []
+                for order in orders:
+                    event = {
+                        'id': f'evt_{secrets.token_hex(12)}',
+                        'type': 'payment_intent.succeeded',
+                        'data': {'object': {
+                            'id': order.stripe_payment_intent, 'status': 'succeeded',
+                            'metadata': {'order_id': str(order.id)},
+                        }},
+                    }
+                    events.extend([json.dumps(event).encode()] * options['duplicates'])
+                random.shuffle(events)
+
+                results = {}
+                started = time.perf_counter()
+                for body in events:
+                    response = client.post(
+                        url, body, content_type='application/json',
+                        HTTP_GATEWAY_SIGNATURE=sign_payload(body, settings.PAYMENT_WEBHOOK_SECRET),
+                    )
+                    result = response.json()['result']
+                    results[result] = results.get(result, 0) + 1
+                elapsed = time.perf_counter() - started
+
+                order_ids = [order.id for order in orders]
+                paid = Order.objects.filter(id__in=order_ids, payment_status=Order.PAYMENT_PAID).count()
+                recorded = PaymentEvent.objects.filter(order_id__in=order_ids).count()
+                self.stdout.write(
+                    f'{len(events):,} deliveries in {elapsed:.2f}s ({len(events) / elapsed:,.0f} events/s)\n'
+                    f'results: {results}\n'
+                    f'orders paid: {paid:,} of {len(orders):,}, events recorded: {recorded:,}'
+                )
+                raise Rollback
+        except Rollback:
+            pass
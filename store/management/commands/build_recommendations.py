@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import rebuild_recommendations, refresh_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" recommendations from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rebuild every product instead of only those bought since the last run',
+        )
+
+    def handle(self, *args, **options):
+        if options['full']:
+            run = rebuild_recommendations()
+        else:
+            run = refresh_recommendations()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recommendations up to date through order {run.last_order_id} '
+            f'({run.products_updated} products updated)'
+        ))
@@ -0,0 +1,64 @@
+import multiprocessing
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from store.models import Sequence
+from store.sequences import BlockAllocator
+
+
+def allocate(sequence_name, block_size, count, queue):
+    connections.close_all()  # never share the parent's database connection
+    allocator = BlockAllocator(sequence_name, block_size)
+    queue.put([allocator.next() for _ in range(count)])
+
+
+class Command(BaseCommand):
+    help = 'Allocate numbers from many processes at once and check that none repeats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--numbers', type=int, default=1_000_000, help='Total numbers to allocate')
+        parser.add_argument('--block-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        sequence_name = f'check-{uuid.uuid4().hex[:12]}'
+        processes = options['processes']
+        per_process = options['numbers'] // processes
+        connections.close_all()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=allocate, args=(sequence_name, options['block_size'], per_process, queue))
+            for _ in range(processes)
+        ]
+        started = time.perf_counter()
+        try:
+            for worker in workers:
+                worker.start()
+            results = [queue.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+            seen = set()
+            total = 0
+            for values in results:
+                if any(later <= earlier for earlier, later in zip(values, values[1:])):
+                    raise CommandError('A process received numbers that are not increasing')
+                seen.update(values)
+                total += len(values)
+        finally:
+            Sequence.objects.filter(name=sequence_name).delete()
+
+        duplicates = total - len(seen)
+        self.stdout.write(
+            f'{total:,} numbers from {processes} processes in {elapsed:.2f}s '
+            f'({total / elapsed:,.0f}/s), {total // options["block_size"]:,} block reservations'
+        )
+        if duplicates:
+            raise CommandError(f'{duplicates:,} duplicate numbers')
+        self.stdout.write(self.style.SUCCESS('No duplicates'))
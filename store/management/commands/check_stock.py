@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.stock import find_drift, rebuild_balances
+
+
+class Command(BaseCommand):
+    help = 'Compare every product stock with the total of its stock ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Reset drifted stock to the ledger total (or open a ledger where there is none)')
+
+    def handle(self, *args, **options):
+        drift = find_drift()
+        for product_id, stock, total in drift[:50]:
+            self.stdout.write(f'Product #{product_id}: stock {stock}, ledger {total}')
+        if len(drift) > 50:
+            self.stdout.write(f'... and {len(drift) - 50} more')
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Every product stock matches its ledger'))
+        elif options['fix']:
+            rebuild_balances(drift)
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(drift)} products'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} products drifted; run with --fix to repair'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from store.sessions import SESSION_CLEANUP_BATCH_SIZE, clear_expired_sessions, uses_database
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions and their anonymous carts in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SESSION_CLEANUP_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        if not uses_database():
+            self.stdout.write('The session engine does not store sessions in the database; nothing to do')
+            return
+        deleted = clear_expired_sessions(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired sessions'))
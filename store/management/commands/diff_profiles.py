@@ -0,0 +1,69 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.profiling import read_collapsed
+
+
+def frame_totals(samples):
+    """(inclusive, self) sample counts per frame; a recursive frame counts once per stack"""
+    inclusive, own = Counter(), Counter()
+    for stack, count in samples.items():
+        for frame in set(stack):
+            inclusive[frame] += count
+        if stack:
+            own[stack[-1]] += count
+    return inclusive, own
+
+
+class Command(BaseCommand):
+    help = 'Compare two collapsed-stack profiles (files, or PROFILE_ROOT-style directories) frame by frame'
+
+    def add_arguments(self, parser):
+        parser.add_argument('before', help='Collapsed-stack file or directory')
+        parser.add_argument('after', help='Collapsed-stack file or directory')
+        parser.add_argument('--view', help='URL name to read from directories, e.g. products')
+        parser.add_argument('--top', type=int, default=25, help='Frames to list')
+        parser.add_argument(
+            '--output', help='Write a differential profile (`stack before after`) for `flamegraph.pl`',
+        )
+
+    def handle(self, *args, **options):
+        before = read_collapsed(options['before'], options['view'])
+        after = read_collapsed(options['after'], options['view'])
+        before_total, after_total = sum(before.values()), sum(after.values())
+        if not before_total or not after_total:
+            raise CommandError('Both profiles need samples')
+
+        before_inclusive, before_own = frame_totals(before)
+        after_inclusive, after_own = frame_totals(after)
+
+        def share(counter, frame, total):
+            return counter[frame] * 100 / total
+
+        rows = []
+        for frame in set(before_inclusive) | set(after_inclusive):
+            inclusive = (share(before_inclusive, frame, before_total), share(after_inclusive, frame, after_total))
+            own = (share(before_own, frame, before_total), share(after_own, frame, after_total))
+            rows.append((frame, inclusive, own))
+        rows.sort(key=lambda row: (-abs(row[1][1] - row[1][0]), -abs(row[2][1] - row[2][0]), row[0]))
+
+        self.stdout.write(f'{before_total} samples before, {after_total} after; shares of all samples in %\n')
+        self.stdout.write(f"{'total':>7}{'':>7}{'':>8}{'self':>8}{'':>7}{'':>8}")
+        self.stdout.write(f"{'before':>7}{'after':>7}{'change':>8}{'before':>8}{'after':>7}{'change':>8}  frame")
+        for frame, (inclusive_before, inclusive_after), (own_before, own_after) in rows[:options['top']]:
+            self.stdout.write(
+                f'{inclusive_before:7.1f}{inclusive_after:7.1f}{inclusive_after - inclusive_before:+8.1f}'
+                f'{own_before:8.1f}{own_after:7.1f}{own_after - own_before:+8.1f}  {frame}'
+            )
+
+        if options['output']:
+            # Before is scaled to the after sample count, like difffolded.pl -n,
+            # so colours show changes in share rather than in traffic
+            scale = after_total / before_total
+            with open(options['output'], 'w') as output:
+                for stack in sorted(set(before) | set(after)):
+                    output.write(f"{';'.join(stack)} {round(before[stack] * scale)} {after[stack]}\n")
+            self.stdout.write(
+                f"\nWrote {options['output']}; render it with `flamegraph.pl {options['output']} > diff.svg`"
+            )
@@ -0,0 +1,194 @@
+import json
+import secrets
+import threading
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.payments import MINOR_UNITS, sign_payload
+
+
+class Gateway:
+    """In-memory payment intents with Stripe-style ids, statuses and events"""
+
+    def __init__(self, public_url, webhook_url, webhook_secret, duplicates=1):
+        self.public_url = public_url.rstrip('/')
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.duplicates = duplicates
+        self.intents = {}
+        self.idempotency = {}
+        self.lock = threading.Lock()
+
+    def create(self, body, idempotency_key):
+        with self.lock:
+            if idempotency_key and idempotency_key in self.idempotency:
+                return self.intents[self.idempotency[idempotency_key]]
+            intent_id = f'pi_{secrets.token_hex(12)}'
+            intent = {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': body['amount'],
+                'currency': body['currency'],
+                'metadata': body.get('metadata', {}),
+                'return_url': body.get('return_url', ''),
+                'status': 'requires_action',
+                'created': int(time.time()),
+                'next_action': {'redirect_to_url': {'url': f'{self.public_url}/pay/{intent_id}'}},
+            }
+            self.intents[intent_id] = intent
+            if idempotency_key:
+                self.idempotency[idempotency_key] = intent_id
+            return intent
+
+    def settle(self, intent_id, outcome):
+        """Apply the customer's choice on the payment page and notify the shop"""
+        event_types = {
+            'succeed': ('succeeded', 'payment_intent.succeeded'),
+            'fail': ('requires_payment_method', 'payment_intent.payment_failed'),
+            'cancel': ('canceled', 'payment_intent.canceled'),
+        }
+        status, event_type = event_types[outcome]
+        with self.lock:
+            intent = self.intents[intent_id]
+            if intent['status'] in ('succeeded', 'canceled'):
+                return intent
+            intent['status'] = status
+            if status != 'requires_payment_method':
+                intent['next_action'] = None
+            snapshot = dict(intent)
+        self.send_event(event_type, snapshot)
+        return intent
+
+    def send_event(self, event_type, intent):
+        event = {
+            'id': f'evt_{secrets.token_hex(12)}',
+            'type': event_type,
+            'created': int(time.time()),
+            'data': {'object': intent},
+        }
+        threading.Thread(target=self.deliver, args=(event,), daemon=True).start()
+
+    def deliver(self, event):
+        """POST the event, retrying with backoff; sends it `duplicates` times like a real at-least-once provider"""
+        body = json.dumps(event).encode()
+        for copy in range(self.duplicates):
+            for attempt in range(5):
+                headers = {
+                    'Content-Type': 'application/json',
+                    'Gateway-Signature': sign_payload(body, self.webhook_secret),
+                }
+                try:
+                    response = requests.post(self.webhook_url, data=body, headers=headers, timeout=10)
+                    if response.status_code < 500:
+                        break
+                except requests.RequestException:
+                    pass
+                time.sleep(2 ** attempt)
+
+
+def make_handler(gateway):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, data, status=200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_body(self):
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        def intent_or_404(self, intent_id):
+            intent = gateway.intents.get(intent_id)
+            if intent is None:
+                self.send_json({'error': {'message': 'No such payment_intent'}}, status=404)
+            return intent
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip('/').split('/')
+            if parts == ['v1', 'payment_intents']:
+                ids = parse_qs(url.query).get('ids', [''])[0].split(',')
+                self.send_json({'data': [gateway.intents[i] for i in ids if i in gateway.intents]})
+            elif len(parts) == 3 and parts[:2] == ['v1', 'payment_intents']:
+                intent = self.intent_or_404(parts[2])
+                if intent:
+                    self.send_json(intent)
+            elif len(parts) == 2 and parts[0] == 'pay':
+                intent = gateway.intents.get(parts[1])
+                if intent is None:
+                    self.send_error(404)
+                    return
+                amount = intent['amount'] / MINOR_UNITS.get(intent['currency'], 100)
+                page = (
+                    '<!doctype html><title>Fake payment gateway</title>'
+                    f'<h1>Pay {amount:.3f} {escape(intent["currency"].upper())}</h1>'
+                    f'<p>Order {escape(intent["metadata"].get("order_number", ""))} - status {intent["status"]}</p>'
+                    f'<form method="post"><button name="outcome" value="succeed">Pay</button> '
+                    '<button name="outcome" value="fail">Decline card</button> '
+                    '<button name="outcome" value="cancel">Cancel</button></form>'
+                ).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            parts = urlsplit(self.path).path.strip('/').split('/')
+            body = self.read_body()
+            if parts == ['v1', 'payment_intents']:
+                self.send_json(gateway.create(json.loads(body), self.headers.get('Idempotency-Key')))
+            elif len(parts) == 4 and parts[:2] == ['v1', 'payment_intents'] and parts[3] == 'cancel':
+                if self.intent_or_404(parts[2]):
+                    self.send_json(gateway.settle(parts[2], 'cancel'))
+            elif len(parts) == 2 and parts[0] == 'pay' and parts[1] in gateway.intents:
+                outcome = parse_qs(body.decode()).get('outcome', ['succeed'])[0]
+                intent = gateway.settle(parts[1], outcome if outcome in ('succeed', 'fail', 'cancel') else 'succeed')
+                self.send_response(303)
+                self.send_header('Location', intent['return_url'] or '/')
+                self.end_headers()
+            else:
+                self.send_error(404)
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'Run a local stand-in for the payment gateway (development and testing only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--webhook-url', default='http://127.0.0.1:8000/payments/webhook/',
+            help='Where payment events are POSTed',
+        )
+        parser.add_argument(
+            '--duplicates', type=int, default=1,
+            help='Deliver every event this many times, to exercise webhook idempotency',
+        )
+
+    def handle(self, *args, **options):
+        public_url = f"http://{options['host']}:{options['port']}"
+        gateway = Gateway(public_url, options['webhook_url'], settings.PAYMENT_WEBHOOK_SECRET, options['duplicates'])
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(gateway))
+        self.stdout.write(self.style.SUCCESS(f'Fake payment gateway on {public_url}, events to {options["webhook_url"]}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.feeds import FEEDS_ROOT, generate_feeds
+
+
+class Command(BaseCommand):
+    help = 'Write the sitemaps and merchant feed, rewriting only shards whose products changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rewrite every shard')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rewritten = generate_feeds(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Rewrote {len(rewritten)} shard(s) in {FEEDS_ROOT} in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,90 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from store.images import list_sources, prepare, source_slug
+from store.models import Category, Product
+from store.signals import catalog_changed
+
+MODELS = {'product': (Product, 'products'), 'category': (Category, 'categories')}
+
+
+class Command(BaseCommand):
+    help = (
+        'Attach images named <slug>.<ext> from a directory or zip archive to products (or categories), '
+        'validating, resizing and storing them in a process pool'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help='Directory or .zip of images named after the product slugs')
+        parser.add_argument('--model', choices=MODELS, default='product')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes (default: one per core)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows updated per statement')
+        parser.add_argument('--replace', action='store_true', help='Also replace images already set')
+
+    def handle(self, *args, **options):
+        model, directory = MODELS[options['model']]
+        if not os.path.exists(options['source']):
+            raise CommandError(f"{options['source']} does not exist")
+        sources = list_sources(options['source'])
+        if not sources:
+            raise CommandError('No images found')
+
+        # Only images for rows that exist (and have no image, unless --replace)
+        # are decoded at all
+        rows = model.objects.order_by()
+        if not options['replace']:
+            rows = rows.filter(Q(image='') | Q(image__isnull=True))
+        ids = dict(rows.values_list('slug', 'id').iterator(chunk_size=10000))
+        unknown = [source for source in sources if source_slug(source) not in ids]
+        sources = [source for source in sources if source_slug(source) in ids]
+        self.stdout.write(
+            f'{len(sources)} images to ingest with {options["workers"]} workers; '
+            f'{len(unknown)} skipped (no matching {options["model"]}'
+            f'{"" if options["replace"] else " without an image"})'
+        )
+
+        started = time.perf_counter()
+        stored, failed, pending, names = 0, [], {}, set()
+        # Forked workers must not inherit this process's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(options['workers'], initializer=django.setup) as pool:
+            # Large chunks keep inter-process traffic to a few messages per
+            # worker; results stream back in order while the pool keeps going
+            chunksize = max(1, min(256, len(sources) // (options['workers'] * 8)))
+            for source, name, error in pool.map(partial(prepare, directory=directory), sources, chunksize=chunksize):
+                if error:
+                    failed.append((source, error))
+                    continue
+                pending[ids[source_slug(source)]] = name
+                names.add(name)
+                if len(pending) >= options['batch_size']:
+                    stored += self.attach(model, pending)
+                    pending = {}
+            stored += self.attach(model, pending)
+
+        seconds = time.perf_counter() - started
+        for (path, member), error in failed[:20]:
+            self.stderr.write(f'{member or path}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Attached {stored} images ({len(names)} distinct files) in {seconds:.1f}s, '
+            f'{len(sources) / seconds if seconds else 0:.0f} images/s; {len(failed)} rejected'
+        ))
+
+    def attach(self, model, images):
+        """Point a batch of rows at their stored images in one UPDATE"""
+        if not images:
+            return 0
+        now = timezone.now()
+        objects = [model(id=row_id, image=name, updated_at=now) for row_id, name in images.items()]
+        with transaction.atomic():
+            model.objects.bulk_update(objects, ['image', 'updated_at'])
+            catalog_changed()
+        return len(objects)
@@ -0,0 +1,145 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so nothing is imported or cached yet. Times
+# django.setup() per app (module import, models import, ready()), then the
+# first and subsequent requests to each path, with or without warm-up.
+CHILD = r'''
+import json, os, sys, time
+
+started = time.perf_counter()
+from django.apps import AppConfig
+
+apps = {}
+
+def timed(label, key, func):
+    def wrapper(*args, **kwargs):
+        begin = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            apps.setdefault(label, {}).setdefault(key, 0)
+            apps[label][key] += time.perf_counter() - begin
+    return wrapper
+
+original_create = AppConfig.create.__func__
+
+def create(cls, entry):
+    begin = time.perf_counter()
+    config = original_create(cls, entry)
+    apps.setdefault(config.label, {})['import'] = time.perf_counter() - begin
+    config.import_models = timed(config.label, 'models', config.import_models)
+    config.ready = timed(config.label, 'ready', config.ready)
+    return config
+
+AppConfig.create = classmethod(create)
+
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+settings_seconds = time.perf_counter() - started
+django.setup()
+setup_seconds = time.perf_counter() - started
+
+from store import warmup
+warmup_steps = [(name, seconds, repr(result)) for name, seconds, result in warmup.warm_up()] if os.environ['WARM'] == '1' else []
+warmup_seconds = time.perf_counter() - started - setup_seconds
+
+from django.test import Client
+from urllib.parse import urlsplit
+client = Client(HTTP_HOST=urlsplit(settings.SITE_URL).netloc or 'localhost', secure=settings.SITE_URL.startswith('https'))
+requests = {}
+for path in json.loads(os.environ['PATHS']):
+    times = []
+    for _ in range(int(os.environ['REPEAT']) + 1):
+        begin = time.perf_counter()
+        client.get(path)
+        times.append(time.perf_counter() - begin)
+    requests[path] = times
+
+print(json.dumps({
+    'settings': settings_seconds, 'setup': setup_seconds, 'apps': apps,
+    'warmup': warmup_seconds, 'warmup_steps': warmup_steps, 'requests': requests,
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """{module: (self us, cumulative us)} from python -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+class Command(BaseCommand):
+    help = 'Profile a cold worker start: import and setup time per app and module, and first-request latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--paths', nargs='+', default=['/', '/products/'])
+        parser.add_argument('--repeat', type=int, default=20, help='Warm requests per path after the first')
+        parser.add_argument('--top', type=int, default=15, help='Slowest modules to list')
+        parser.add_argument('--no-compare', action='store_true', help='Skip the run without warm-up')
+
+    def run_child(self, paths, repeat, warm):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),
+            'PATHS': json.dumps(paths), 'REPEAT': str(repeat), 'WARM': '1' if warm else '0',
+        }
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise RuntimeError(result.stderr[-2000:])
+        return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+    def handle(self, *args, **options):
+        paths, repeat = options['paths'], options['repeat']
+        report, modules = self.run_child(paths, repeat, warm=True)
+
+        self.stdout.write(f"Settings loaded:  {report['settings'] * 1000:7.0f} ms")
+        self.stdout.write(f"django.setup():   {report['setup'] * 1000:7.0f} ms")
+        self.stdout.write(f"Warm-up:          {report['warmup'] * 1000:7.0f} ms")
+        for name, seconds, result in report['warmup_steps']:
+            self.stdout.write(f'  {name:<14} {seconds * 1000:7.0f} ms  {result}')
+
+        self.stdout.write('\nPer app (ms)          import   models    ready')
+        for label, phases in sorted(report['apps'].items(), key=lambda item: -sum(item[1].values())):
+            self.stdout.write(
+                f"  {label:<18} {phases.get('import', 0) * 1000:8.1f} {phases.get('models', 0) * 1000:8.1f} "
+                f"{phases.get('ready', 0) * 1000:8.1f}"
+            )
+
+        packages = defaultdict(int)
+        for name, (self_us, cumulative_us) in modules.items():
+            packages[name.split('.')[0]] += self_us
+        self.stdout.write('\nImport time by top-level package (self, ms)')
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write(f'  {package:<30} {self_us / 1000:8.1f}')
+        self.stdout.write('\nSlowest modules (cumulative, ms)')
+        for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: -item[1][1])[:options['top']]:
+            self.stdout.write(f'  {name:<50} {cumulative_us / 1000:8.1f}')
+
+        runs = [('with warm-up', report)]
+        if not options['no_compare']:
+            runs.insert(0, ('cold', self.run_child(paths, repeat, warm=False)[0]))
+        self.stdout.write('\nRequest latency (ms)        first   warm p50   warm max')
+        for label, run in runs:
+            for path, times in run['requests'].items():
+                warm = times[1:] or times
+                self.stdout.write(
+                    f'  {label:<12} {path:<12} {times[0] * 1000:7.1f} {statistics.median(warm) * 1000:10.1f} '
+                    f'{max(warm) * 1000:10.1f}'
+                )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.payments import reconcile_payments
+
+
+class Command(BaseCommand):
+    help = 'Settle online payments stuck waiting for the provider (run from cron every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Orders per provider lookup')
+
+    def handle(self, *args, **options):
+        stats = reconcile_payments(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Checked {checked} orders: {started} started, {settled} settled, '
+            '{expired} expired, {errors} errors'.format(**stats)
+        ))
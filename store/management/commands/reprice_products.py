@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.promotions import reprice_catalog
+
+
+class Command(BaseCommand):
+    help = 'Recompute every product price against the live promotions now'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        changed = reprice_catalog()
+        self.stdout.write(self.style.SUCCESS(
+            f'Repriced {changed} products in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from store.jobs import JOB_QUEUES, Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue',
+            action='append',
+            dest='queues',
+            choices=sorted(JOB_QUEUES),
+            help='Only run jobs from this queue (can be repeated). Defaults to all queues.',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when idle')
+        parser.add_argument('--once', action='store_true', help='Start the jobs that are due, wait for them and exit')
+
+    def handle(self, *args, **options):
+        worker = Worker(queues=options['queues'], poll_interval=options['poll_interval'])
+
+        # Finish running jobs on Ctrl+C / SIGTERM instead of abandoning them
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Worker {worker.worker_id} running queues: {', '.join(worker.queues)}"
+        ))
+        worker.run(once=options['once'])
+        self.stdout.write('Worker stopped')
@@ -0,0 +1,82 @@
+import socketserver
+import threading
+from email import message_from_bytes
+
+from django.core.management.base import BaseCommand
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP to accept mail from Django's SMTP backend and print it"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            connection_number = server.connections
+        sent_here = 0
+        recipients = []
+
+        self.reply('220 localhost Elite Shop SMTP debugging server')
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip(' <>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                message = message_from_bytes(b''.join(lines))
+                sent_here += 1
+                with server.lock:
+                    server.messages += 1
+                server.command.stdout.write(
+                    f"[connection {connection_number}] {', '.join(recipients)}: {message['Subject']}"
+                )
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+
+        server.command.stdout.write(f'[connection {connection_number}] closed after {sent_here} messages')
+
+
+class Command(BaseCommand):
+    help = 'Run a local SMTP server that prints the emails it receives (development and testing only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+
+    def handle(self, *args, **options):
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        server = socketserver.ThreadingTCPServer((options['host'], options['port']), SMTPHandler)
+        server.daemon_threads = True
+        server.command = self
+        server.lock = threading.Lock()
+        server.connections = 0
+        server.messages = 0
+        self.stdout.write(self.style.SUCCESS(f"SMTP debugging server on {options['host']}:{options['port']}"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f'{server.messages} messages over {server.connections} connections')
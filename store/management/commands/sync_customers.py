@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.customers import CUSTOMER_SYNC_BATCH_SIZE, sync_customers
+from store.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Create or refresh a Customer for every order that has none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=CUSTOMER_SYNC_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        synced = sync_customers(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Synced {synced} orders in {time.perf_counter() - started:.2f}s; '
+            f'{Customer.objects.count()} customers'
+        ))
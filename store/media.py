@@ -0,0 +1,158 @@
+import hashlib
+import mimetypes
+import os
+import re
+import secrets
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.utils._os import safe_join
+
+# Plain /media/ URLs are cached this long, then revalidated with ETag/Last-Modified
+MEDIA_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+# Hand the file transfer to the front server instead of streaming it from
+# Python: None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+MEDIA_OFFLOAD = getattr(settings, 'MEDIA_OFFLOAD', None)
+
+# nginx `internal` location aliased to MEDIA_ROOT, for X-Accel-Redirect
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def fingerprint(stat):
+    """Short version token that changes whenever the file is rewritten"""
+    raw = f'{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()[:12]
+
+
+class VersionedMediaStorage(FileSystemStorage):
+    """
+    Media storage whose URLs carry the file's version, /media/v/<version>/<name>,
+    so they can be cached forever: a rewritten file gets a new URL.
+    """
+
+    def url(self, name):
+        url = super().url(name)
+        try:
+            stat = os.stat(self.path(name))
+        except (OSError, ValueError):
+            return url
+        return f'{self.base_url}v/{fingerprint(stat)}/{url[len(self.base_url):]}'
+
+
+def content_name(name, digest):
+    """Where content with this SHA-256 lives: products/photo.JPG -> products/3f/3fa9...c2.jpg"""
+    directory, basename = os.path.split(name)
+    stem, extension = os.path.splitext(basename)
+    if len(stem) == 64 and os.path.basename(directory) == stem[:2]:
+        directory = os.path.dirname(directory)  # Re-saving a stored file, e.g. after resizing
+    return os.path.join(directory, digest[:2], digest + extension.lower())
+
+
+class ContentAddressedStorage(VersionedMediaStorage):
+    """
+    Stores each file under the SHA-256 of its contents, so an image uploaded
+    for many products (the same supplier photo) is kept once, and a stored
+    file never changes. Saving content that is already there writes nothing.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if name.endswith('.tmp'):
+            return super().get_available_name(name, max_length)
+        return name  # _save picks the real name from the content
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        target = content_name(name, digest.hexdigest())
+        if self.exists(target):
+            return target
+        # Written under a private name, then renamed: readers never see a
+        # partial file, and concurrent saves of the same content both succeed
+        temporary = super()._save(f'{target}.{secrets.token_hex(4)}.tmp', content)
+        os.replace(self.path(temporary), self.path(target))
+        return target
+
+
+def media_path(name):
+    """Absolute path of a media file, or None if it is outside MEDIA_ROOT or missing"""
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def content_type(path):
+    guessed, encoding = mimetypes.guess_type(path)
+    return guessed or 'application/octet-stream'
+
+
+def parse_range(header, size):
+    """
+    (start, end) inclusive for a single-range `Range: bytes=...` header; None
+    to send the whole file (no header, or one we don't handle such as several
+    ranges); False if the range can't be satisfied.
+    """
+    match = _RANGE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class FileRange:
+    """
+    A file object limited to `length` bytes from its current position. It
+    keeps fileno() and tell(), so servers with a sendfile file_wrapper
+    (gunicorn) still send the range zero-copy, bounded by Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def seekable(self):
+        return False
+
+    def close(self):
+        self.file.close()
+
+
+def offload_headers(path, name):
+    """Response headers telling the front server to send the file itself"""
+    if MEDIA_OFFLOAD == 'x-accel-redirect':
+        return {'X-Accel-Redirect': MEDIA_ACCEL_PREFIX + name}
+    if MEDIA_OFFLOAD == 'x-sendfile':
+        return {'X-Sendfile': path}
+    return None
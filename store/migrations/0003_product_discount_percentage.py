@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:19
+
+from django.db import migrations, models
+
+
+def backfill_discount_percentage(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    batch = []
+    on_sale = Product.objects.filter(old_price__gt=models.F('price')).only('price', 'old_price')
+    for product in on_sale.iterator(chunk_size=1000):
+        product.discount_percentage = int(((product.old_price - product.price) / product.old_price) * 100)
+        batch.append(product)
+        if len(batch) >= 1000:
+            Product.objects.bulk_update(batch, ['discount_percentage'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['discount_percentage'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='discount_percentage',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_discount_percentage, migrations.RunPython.noop),
+    ]
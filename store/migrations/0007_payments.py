@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_payment_status(apps, schema_editor):
+    Order = apps.get_model('store', 'Order')
+    Order.objects.filter(payment_completed=True).update(payment_status='paid')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_job_queue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50)),
+                ('event_id', models.CharField(max_length=200)),
+                ('type', models.CharField(max_length=100)),
+                ('intent_id', models.CharField(blank=True, max_length=200)),
+                ('payload', models.JSONField(default=dict)),
+                ('applied', models.BooleanField(default=False)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-received_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(choices=[('not_required', 'Not required'), ('pending', 'Pending'), ('awaiting', 'Awaiting customer'), ('paid', 'Paid'), ('failed', 'Failed'), ('refunded', 'Refunded')], default='not_required', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_url',
+            field=models.URLField(blank=True, max_length=500),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_payment_intent',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'payment_updated_at'], name='order_payment_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_events', to='store.order'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentevent',
+            constraint=models.UniqueConstraint(fields=('provider', 'event_id'), name='unique_payment_event'),
+        ),
+        migrations.RunPython(backfill_payment_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_prices(apps, schema_editor):
+    # Until a promotion applies, the effective prices are the merchant's own
+    Product = apps.get_model('store', 'Product')
+    Product.objects.update(regular_price=F('price'), compare_at_price=F('old_price'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_admin_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='compare_at_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='regular_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_prices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='old_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('kind', models.CharField(choices=[('percentage', 'Percentage off'), ('fixed', 'Fixed amount off')], default='percentage', max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('published', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('categories', models.ManyToManyField(blank=True, related_name='promotions', to='store.category')),
+                ('products', models.ManyToManyField(blank=True, related_name='promotions', to='store.product')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='promotion',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='priced_products', to='store.promotion'),
+        ),
+    ]
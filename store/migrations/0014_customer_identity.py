@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:20
+
+import django.db.models.functions.text
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def lowercase_customer_emails(apps, schema_editor):
+    # Customer emails are stored lowercased from now on; fold existing
+    # case-variant duplicates into the oldest record
+    Customer = apps.get_model('store', 'Customer')
+    Order = apps.get_model('store', 'Order')
+    kept = {}
+    for customer in Customer.objects.order_by('id').iterator():
+        email = customer.email.strip().lower()
+        if email in kept:
+            Order.objects.filter(customer_id=customer.id).update(customer_id=kept[email])
+            customer.delete()
+            continue
+        kept[email] = customer.id
+        if customer.email != email:
+            Customer.objects.filter(id=customer.id).update(email=email)
+
+
+# auth_user belongs to django.contrib.auth, so its case-insensitive email
+# index (see store/customers.py) is created here rather than in a model Meta
+def create_user_email_index(apps, schema_editor):
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS auth_user_email_lower_idx ON auth_user (LOWER(email))')
+
+
+def drop_user_email_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS auth_user_email_lower_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('store', '0013_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='full_name',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='archived_email_lower_idx'),
+        ),
+        migrations.RunPython(lowercase_customer_emails, migrations.RunPython.noop),
+        migrations.RunPython(create_user_email_index, drop_user_email_index),
+    ]
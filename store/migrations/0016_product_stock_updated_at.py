@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_stock_release'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_updated_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
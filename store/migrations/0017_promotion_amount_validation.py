@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:31
+
+import django.core.validators
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_product_stock_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='promotion',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))]),
+        ),
+    ]
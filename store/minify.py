@@ -0,0 +1,63 @@
+import re
+
+from django.conf import settings
+from django.template.loaders import app_directories
+
+# Minify the project's HTML templates as they are loaded. Off in DEBUG so
+# template error pages keep the original layout.
+HTML_MINIFY = getattr(settings, 'HTML_MINIFY', not settings.DEBUG)
+
+# Segments the minifier must not rewrite as ordinary markup: whitespace-
+# sensitive elements, inline code, and template tags and variables (whose
+# string arguments may contain meaningful spaces)
+_SEGMENT = re.compile(
+    r'(?P<verbatim><(?P<pre>pre|textarea)\b.*?</(?P=pre)\s*>'
+    r'|\{%.*?%\}|\{\{.*?\}\}|\{#.*?#\})'
+    r'|(?P<code><(?P<code_tag>script|style)\b.*?</(?P=code_tag)\s*>)'
+    # Comments holding template syntax are kept: dropping them could drop a {% block %}
+    r'|(?P<comment><!--(?!\[if)(?:(?!\{%|\{\{|-->).)*-->)',
+    re.IGNORECASE | re.DOTALL,
+)
+_WHITESPACE = re.compile(r'\s+')
+_CODE_INDENT = re.compile(r'\n\s+')
+
+
+def _collapse(match):
+    # Browsers render any run of whitespace outside <pre> as one space, so
+    # this is safe even between inline elements. Keeping a newline where
+    # there was one keeps the output diffable.
+    return '\n' if '\n' in match.group() else ' '
+
+
+def minify_html(source):
+    """
+    Collapse whitespace runs in template markup and drop HTML comments.
+    Inline <script> and <style> only lose their indentation and blank lines;
+    <pre>, <textarea> and template tags are left exactly as written.
+    """
+    parts = []
+    position = 0
+    for match in _SEGMENT.finditer(source):
+        parts.append(_WHITESPACE.sub(_collapse, source[position:match.start()]))
+        if match.group('verbatim'):
+            parts.append(match.group())
+        elif match.group('code'):
+            parts.append(_CODE_INDENT.sub('\n', match.group()))
+        position = match.end()
+    parts.append(_WHITESPACE.sub(_collapse, source[position:]))
+    return ''.join(parts).strip() + '\n'
+
+
+class Loader(app_directories.Loader):
+    """
+    app_directories loader returning minified source for the project's own
+    .html templates. Wrapped in the cached loader (config/settings.py), so
+    each template is minified once per process, when it is first compiled,
+    and rendering pays nothing.
+    """
+
+    def get_contents(self, origin):
+        contents = super().get_contents(origin)
+        if HTML_MINIFY and origin.name.endswith('.html') and origin.name.startswith(str(settings.BASE_DIR)):
+            return minify_html(contents)
+        return contents
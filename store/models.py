@@ -1,4 +1,10 @@
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -9,6 +15,7 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -22,28 +29,125 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
-    old_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # What the merchant edits: the regular price and an optional "was" price
+    regular_price = models.DecimalField(max_digits=10, decimal_places=2)
+    compare_at_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Effective prices after promotions, precomputed by store.promotions; read these everywhere
+    price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
+    old_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    promotion = models.ForeignKey('Promotion', on_delete=models.SET_NULL, null=True, blank=True,
+                                  related_name='priced_products', editable=False)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='products/', blank=True)
+    # Current balance of the StockMovement ledger; changed only through store.stock
     stock = models.PositiveIntegerField(default=0)
+    # Bumped by store.stock instead of updated_at, so a sale patches the
+    # catalog snapshot's stock counts rather than rebuilding it
+    stock_updated_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
     available = models.BooleanField(default=True)
+    # Set when store.stock hid the product for running out, so a restock shows it again
+    hidden_out_of_stock = models.BooleanField(default=False, editable=False)
     featured = models.BooleanField(default=False)
+    # Stored copy of get_discount_percentage() so listings can filter and sort on it
+    discount_percentage = models.PositiveSmallIntegerField(default=0, db_index=True, editable=False)
+    # Maintained in batches by store.popularity, never by Product.save()
+    view_count = models.PositiveIntegerField(default=0, editable=False)
+    popularity = models.FloatField(default=0, db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at'], name='product_created_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    # Counters written by batched UPDATEs; a stale instance must not overwrite them
+    COUNTER_FIELDS = {'view_count', 'popularity', 'stock', 'stock_updated_at', 'hidden_out_of_stock'}
+
+    # Changing any of these can change which promotions apply
+    PRICING_FIELDS = {'regular_price', 'compare_at_price', 'category'}
+
+    def save(self, *args, **kwargs):
+        from .promotions import apply_promotions
+
+        if self.regular_price is None:
+            # Created the old way, with price/old_price only
+            self.regular_price = self.price
+            self.compare_at_price = self.old_price
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or self.PRICING_FIELDS & set(update_fields):
+            apply_promotions(self)
+            self.discount_percentage = self.get_discount_percentage()
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        if update_fields is not None:
+            # updated_at drives the catalog page validators, so always bump it
+            update_fields = set(update_fields) | {'updated_at'}
+            if self.PRICING_FIELDS & update_fields:
+                update_fields |= {'price', 'old_price', 'promotion', 'discount_percentage'}
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+
     def get_discount_percentage(self):
-        if self.old_price and self.old_price > self.price:
-            return int(((self.old_price - self.price) / self.old_price) * 100)
+        return self.discount_for(self.price, self.old_price)
+
+    @staticmethod
+    def discount_for(price, old_price):
+        if old_price and old_price > price:
+            return int(((old_price - price) / old_price) * 100)
         return 0
 
 
+class Promotion(models.Model):
+    """
+    A discount rule. It applies to the listed categories and products (the
+    whole catalog when both are empty) while published and inside its time
+    window. Product prices are recomputed in a batch whenever rules change.
+    """
+    PERCENTAGE = 'percentage'
+    FIXED = 'fixed'
+    KIND_CHOICES = [
+        (PERCENTAGE, 'Percentage off'),
+        (FIXED, 'Fixed amount off'),
+    ]
+
+    name = models.CharField(max_length=200)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=PERCENTAGE)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    categories = models.ManyToManyField(Category, blank=True, related_name='promotions')
+    products = models.ManyToManyField(Product, blank=True, related_name='promotions')
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    published = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        # Anything over 100% would reprice the targeted products to zero
+        if self.kind == self.PERCENTAGE and self.amount is not None and self.amount > 100:
+            raise ValidationError({'amount': 'A percentage discount cannot be more than 100.'})
+
+    def is_live(self, now):
+        return (
+            self.published
+            and (self.starts_at is None or self.starts_at <= now)
+            and (self.ends_at is None or now < self.ends_at)
+        )
+
+
 class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
@@ -59,18 +163,26 @@ class CartItem(models.Model):
 
 
 class Customer(models.Model):
+    """One per email address that has ordered; kept up to date by store.customers"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
+    # Stored lowercased, so the unique index also serves case-insensitive lookups
     email = models.EmailField(unique=True)
+    full_name = models.CharField(max_length=200, blank=True)
     phone = models.CharField(max_length=20, blank=True)
     address = models.TextField(blank=True)
     city = models.CharField(max_length=100, blank=True)
     postal_code = models.CharField(max_length=20, blank=True)
     country = models.CharField(max_length=100, default='Tunisia')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.email
 
+    def save(self, *args, **kwargs):
+        self.email = self.email.strip().lower()
+        super().save(*args, **kwargs)
+
 
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -87,6 +199,23 @@ class Order(models.Model):
         ('cod', 'Cash on Delivery'),
     ]
 
+    # Online payment lifecycle, driven by store/payments.py
+    PAYMENT_NOT_REQUIRED = 'not_required'
+    PAYMENT_PENDING = 'pending'
+    PAYMENT_AWAITING = 'awaiting'
+    PAYMENT_PAID = 'paid'
+    PAYMENT_FAILED = 'failed'
+    PAYMENT_REFUNDED = 'refunded'
+
+    PAYMENT_STATUS_CHOICES = [
+        (PAYMENT_NOT_REQUIRED, 'Not required'),
+        (PAYMENT_PENDING, 'Pending'),
+        (PAYMENT_AWAITING, 'Awaiting customer'),
+        (PAYMENT_PAID, 'Paid'),
+        (PAYMENT_FAILED, 'Failed'),
+        (PAYMENT_REFUNDED, 'Refunded'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     order_number = models.CharField(max_length=50, unique=True)
@@ -106,9 +235,12 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS, default='cod')
     payment_completed = models.BooleanField(default=False)
+    payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default=PAYMENT_NOT_REQUIRED)
+    payment_updated_at = models.DateTimeField(null=True, blank=True)
     
     # Stripe payment details
-    stripe_payment_intent = models.CharField(max_length=200, blank=True, null=True)
+    stripe_payment_intent = models.CharField(max_length=200, blank=True, null=True, db_index=True)
+    payment_url = models.URLField(max_length=500, blank=True)
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -116,6 +248,14 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['payment_status', 'payment_updated_at'], name='order_payment_idx'),
+            models.Index(fields=['status', 'updated_at'], name='order_status_updated_idx'),
+            # Admin changelist ordering and search (see OrderAdmin.get_search_results)
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+            models.Index(Lower('email'), name='order_email_lower_idx'),
+            models.Index(fields=['phone'], name='order_phone_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
@@ -140,4 +280,213 @@ class OrderItem(models.Model):
         if self.product_price is None:
             return 0
         return self.product_price * self.quantity
-  
\ No newline at end of file
+  
+
+class ProductRecommendation(models.Model):
+    """Top-K "bought together" neighbours of a product, built offline from orders"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='unique_recommendation_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class RecommendationRun(models.Model):
+    """One build of the recommendation table; the latest run is the incremental watermark"""
+    last_order_id = models.BigIntegerField(default=0)
+    full_rebuild = models.BooleanField(default=False)
+    products_updated = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Recommendation run up to order {self.last_order_id}"
+
+
+class Job(models.Model):
+    """A unit of background work, run by the run_jobs worker (see store/jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=200)
+    queue = models.CharField(max_length=50, default='default')
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            models.Index(fields=['status', 'queue', 'run_at'], name='job_ready_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} [{self.status}]"
+
+
+class PaymentEvent(models.Model):
+    """A webhook event from the payment provider; the unique event id makes redelivery a no-op"""
+    provider = models.CharField(max_length=50)
+    event_id = models.CharField(max_length=200)
+    type = models.CharField(max_length=100)
+    intent_id = models.CharField(max_length=200, blank=True)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_events')
+    payload = models.JSONField(default=dict)
+    applied = models.BooleanField(default=False)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-received_at']
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_id'], name='unique_payment_event'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
+
+
+class ContactMessage(models.Model):
+    """A message sent through the contact form"""
+    name = models.CharField(max_length=200)
+    email = models.EmailField()
+    phone = models.CharField(max_length=20, blank=True)
+    subject = models.CharField(max_length=200)
+    message = models.TextField()
+    handled = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.subject} - {self.name}"
+
+
+class OutboundEmail(models.Model):
+    """An email waiting in the outbound spool (see store/mail.py)"""
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    reply_to = models.EmailField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='outbound_email_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to_email}"
+
+
+class StockMovement(models.Model):
+    """One append-only ledger entry; a product's movements sum to its stock"""
+    SALE = 'sale'
+    RESTOCK = 'restock'
+    ADJUSTMENT = 'adjustment'
+    RESERVATION = 'reservation'
+    RELEASE = 'release'
+    KIND_CHOICES = [
+        (SALE, 'Sale'),
+        (RESTOCK, 'Restock'),
+        (ADJUSTMENT, 'Adjustment'),
+        (RESERVATION, 'Reserved for an unpaid order'),
+        (RELEASE, 'Reservation released'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField()  # signed: negative takes stock out
+    balance = models.IntegerField()  # product stock right after this movement
+    order = models.ForeignKey('Order', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    note = models.CharField(max_length=200, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['product', 'id'], name='stock_movement_product_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.kind} {self.quantity:+d}"
+
+
+class Sequence(models.Model):
+    """A named counter handed out in blocks (see store/sequences.py)"""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name} @ {self.next_value}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    A finished order moved out of the Order/OrderItem tables (see store/archive.py).
+    The indexed columns serve lists and lookups; `data` holds the full order
+    and its items.
+    """
+    id = models.BigIntegerField(primary_key=True)  # the original Order id
+    order_number = models.CharField(max_length=50, unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    email = models.EmailField(db_index=True)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(Lower('email'), name='archived_email_lower_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.order_number} (archived)"
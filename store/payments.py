@@ -0,0 +1,364 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+import requests
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Order, PaymentEvent
+from . import mail, stock
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_PROVIDER = getattr(settings, 'PAYMENT_PROVIDER', 'store.payments.GatewayProvider')
+PAYMENT_CURRENCY = getattr(settings, 'PAYMENT_CURRENCY', 'tnd')
+
+# Orders still waiting for the provider this long are checked by reconcile_payments()
+PAYMENT_RECONCILE_AFTER = getattr(settings, 'PAYMENT_RECONCILE_AFTER', 15 * 60)
+
+# Unpaid intents older than this are cancelled and the payment marked failed
+PAYMENT_EXPIRES_AFTER = getattr(settings, 'PAYMENT_EXPIRES_AFTER', 24 * 3600)
+
+# Webhook signatures older than this are rejected (replay protection)
+WEBHOOK_TOLERANCE = 300
+
+# Minor units per major unit; the millime is 1/1000 dinar
+MINOR_UNITS = {'tnd': 1000}
+
+# Payment status an order may move to -> statuses it may move from.
+# Every transition is a conditional UPDATE on this table, so a duplicate or
+# late event can never apply twice or move an order backwards.
+ALLOWED_TRANSITIONS = {
+    Order.PAYMENT_AWAITING: {Order.PAYMENT_PENDING},
+    # A customer may retry after a declined card on the same intent
+    Order.PAYMENT_PAID: {Order.PAYMENT_PENDING, Order.PAYMENT_AWAITING, Order.PAYMENT_FAILED},
+    Order.PAYMENT_FAILED: {Order.PAYMENT_PENDING, Order.PAYMENT_AWAITING},
+    Order.PAYMENT_REFUNDED: {Order.PAYMENT_PAID},
+}
+
+EVENT_TRANSITIONS = {
+    'payment_intent.succeeded': Order.PAYMENT_PAID,
+    'payment_intent.payment_failed': Order.PAYMENT_FAILED,
+    'payment_intent.canceled': Order.PAYMENT_FAILED,
+    'charge.refunded': Order.PAYMENT_REFUNDED,
+}
+
+INTENT_TRANSITIONS = {
+    'succeeded': Order.PAYMENT_PAID,
+    'canceled': Order.PAYMENT_FAILED,
+}
+
+
+class PaymentError(Exception):
+    """The provider could not be reached or refused the request"""
+
+
+class InvalidWebhook(Exception):
+    """Webhook body or signature did not check out"""
+
+
+class PaymentIntent:
+    __slots__ = ('id', 'status', 'amount', 'redirect_url', 'order_id')
+
+    def __init__(self, id, status, amount=None, redirect_url='', order_id=None):
+        self.id = id
+        self.status = status
+        self.amount = amount
+        self.redirect_url = redirect_url
+        self.order_id = order_id
+
+
+class WebhookEvent:
+    __slots__ = ('id', 'type', 'intent', 'payload')
+
+    def __init__(self, id, type, intent, payload):
+        self.id = id
+        self.type = type
+        self.intent = intent
+        self.payload = payload
+
+
+def to_minor_units(amount, currency=PAYMENT_CURRENCY):
+    return int((Decimal(amount) * MINOR_UNITS.get(currency, 100)).to_integral_value())
+
+
+def sign_payload(body, secret, timestamp=None):
+    """Signature header value for a webhook body, in the `t=...,v1=...` format"""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f'{timestamp}.'.encode() + body
+    digest = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={digest}'
+
+
+def verify_signature(body, header, secret, tolerance=WEBHOOK_TOLERANCE):
+    try:
+        parts = dict(item.split('=', 1) for item in header.split(','))
+        timestamp = int(parts['t'])
+        signature = parts['v1']
+    except (KeyError, ValueError):
+        raise InvalidWebhook('Malformed signature header')
+    if abs(time.time() - timestamp) > tolerance:
+        raise InvalidWebhook('Signature timestamp outside tolerance')
+    expected = sign_payload(body, secret, timestamp).split('v1=', 1)[1]
+    if not hmac.compare_digest(expected, signature):
+        raise InvalidWebhook('Signature mismatch')
+
+
+class PaymentProvider:
+    """Interface for payment providers. Implementations must be safe to share between threads."""
+    name = None
+
+    def create_intent(self, order, return_url):
+        """Create (or, for the same order, return the existing) intent"""
+        raise NotImplementedError
+
+    def retrieve_intent(self, intent_id):
+        raise NotImplementedError
+
+    def retrieve_intents(self, intent_ids):
+        """Map of intent id -> PaymentIntent; override when the provider has a batch lookup"""
+        return {intent_id: self.retrieve_intent(intent_id) for intent_id in intent_ids}
+
+    def cancel_intent(self, intent_id):
+        raise NotImplementedError
+
+    def parse_webhook(self, body, headers):
+        """Verify and decode a webhook request into a WebhookEvent, or raise InvalidWebhook"""
+        raise NotImplementedError
+
+
+class GatewayProvider(PaymentProvider):
+    """
+    Client for a Stripe-style REST payment gateway. In development and tests
+    it talks to `manage.py fake_payment_gateway`.
+    """
+    name = 'gateway'
+    timeout = (3.05, 10)  # connect, read
+    batch_size = 100
+    signature_header = 'Gateway-Signature'
+
+    def __init__(self, base_url=None, api_key=None, webhook_secret=None):
+        self.base_url = (base_url or settings.PAYMENT_GATEWAY_URL).rstrip('/')
+        self.webhook_secret = webhook_secret or settings.PAYMENT_WEBHOOK_SECRET
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = f'Bearer {api_key or settings.STRIPE_SECRET_KEY}'
+
+    def _request(self, method, path, **kwargs):
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+        except requests.RequestException as exc:
+            raise PaymentError(f'Payment gateway unreachable: {exc}') from exc
+        if response.status_code >= 400:
+            raise PaymentError(f'Payment gateway error {response.status_code}: {response.text[:200]}')
+        return response.json()
+
+    @staticmethod
+    def _intent(data):
+        redirect = (data.get('next_action') or {}).get('redirect_to_url') or {}
+        order_id = (data.get('metadata') or {}).get('order_id')
+        return PaymentIntent(
+            data['id'], data['status'], amount=data.get('amount'),
+            redirect_url=redirect.get('url', ''),
+            order_id=int(order_id) if order_id else None,
+        )
+
+    def create_intent(self, order, return_url):
+        data = self._request(
+            'POST', '/v1/payment_intents',
+            json={
+                'amount': to_minor_units(order.get_total()),
+                'currency': PAYMENT_CURRENCY,
+                'return_url': return_url,
+                'metadata': {'order_id': str(order.id), 'order_number': order.order_number},
+            },
+            # Retried jobs get the same intent back instead of a second charge
+            headers={'Idempotency-Key': f'order-{order.id}'},
+        )
+        return self._intent(data)
+
+    def retrieve_intent(self, intent_id):
+        return self._intent(self._request('GET', f'/v1/payment_intents/{intent_id}'))
+
+    def retrieve_intents(self, intent_ids):
+        intents = {}
+        intent_ids = list(intent_ids)
+        for start in range(0, len(intent_ids), self.batch_size):
+            chunk = intent_ids[start:start + self.batch_size]
+            data = self._request('GET', '/v1/payment_intents', params={'ids': ','.join(chunk)})
+            for item in data['data']:
+                intents[item['id']] = self._intent(item)
+        return intents
+
+    def cancel_intent(self, intent_id):
+        return self._intent(self._request('POST', f'/v1/payment_intents/{intent_id}/cancel'))
+
+    def parse_webhook(self, body, headers):
+        verify_signature(body, headers.get(self.signature_header, ''), self.webhook_secret)
+        try:
+            data = json.loads(body)
+            return WebhookEvent(data['id'], data['type'], self._intent(data['data']['object']), data)
+        except (ValueError, KeyError, TypeError):
+            raise InvalidWebhook('Malformed event body')
+
+
+@lru_cache(maxsize=None)
+def get_provider():
+    return import_string(PAYMENT_PROVIDER)()
+
+
+def transition(order_id, to_status, **fields):
+    """
+    Move an order's payment to `to_status` if ALLOWED_TRANSITIONS permits it
+    from the current status. Returns True only for the caller that made the move.
+    """
+    now = timezone.now()
+    updates = {'payment_status': to_status, 'payment_updated_at': now, 'updated_at': now, **fields}
+    if to_status == Order.PAYMENT_PAID:
+        updates['payment_completed'] = True
+        updates['status'] = Case(When(status='pending', then=Value('processing')), default=F('status'))
+    elif to_status == Order.PAYMENT_REFUNDED:
+        updates['payment_completed'] = False
+
+    with transaction.atomic():
+        moved = Order.objects.filter(
+            id=order_id, payment_status__in=ALLOWED_TRANSITIONS[to_status]
+        ).update(**updates)
+        if moved:
+            settle_stock(order_id, to_status)
+    if moved and to_status == Order.PAYMENT_PAID:
+        transaction.on_commit(lambda: send_payment_confirmation(order_id))
+    return bool(moved)
+
+
+def settle_stock(order_id, to_status):
+    """
+    Keep the stock ledger in step with the payment: a paid order's reservation
+    becomes a sale, a failed or expired one goes back on sale, and a refund
+    puts the items back unless they have already left the warehouse.
+    """
+    if to_status == Order.PAYMENT_PAID:
+        if Order.objects.filter(id=order_id, status='cancelled').exists():
+            stock.return_order_stock(order_id, note='Paid after cancellation')
+        else:
+            stock.confirm_reservation(order_id)
+    elif to_status == Order.PAYMENT_FAILED:
+        stock.release_reservation(order_id, note='Payment failed')
+    elif to_status == Order.PAYMENT_REFUNDED:
+        if not Order.objects.filter(id=order_id, status__in=['shipped', 'delivered']).exists():
+            stock.return_order_stock(order_id, note='Refunded')
+
+
+def send_payment_confirmation(order_id):
+    order = Order.objects.only('order_number', 'full_name', 'email').get(id=order_id)
+    mail.spool(
+        order.email,
+        f'Payment received for order {order.order_number}',
+        f'Hello {order.full_name},\n\nWe received your payment for order '
+        f'{order.order_number}. We are now preparing your items.\n\nElite Shop',
+    )
+
+
+def start_payment(order_id, return_url):
+    """Create the provider intent for a pending order and hand the customer its payment page"""
+    order = Order.objects.filter(id=order_id, payment_status=Order.PAYMENT_PENDING).first()
+    if order is None:
+        return None
+    intent = get_provider().create_intent(order, return_url)
+    if not transition(order.id, Order.PAYMENT_AWAITING, stripe_payment_intent=intent.id,
+                      payment_url=intent.redirect_url):
+        # A webhook already settled the payment; just remember the intent
+        Order.objects.filter(id=order.id, stripe_payment_intent__isnull=True).update(stripe_payment_intent=intent.id)
+    return intent
+
+
+def handle_event(event, provider_name):
+    """
+    Apply one webhook event. The transition and the event row commit
+    together; a redelivered event hits the unique constraint and rolls back.
+    Returns 'applied', 'ignored' or 'duplicate'.
+    """
+    order_id = event.intent.order_id
+    if order_id is None and event.intent.id:
+        order_id = Order.objects.filter(stripe_payment_intent=event.intent.id).values_list('id', flat=True).first()
+
+    to_status = EVENT_TRANSITIONS.get(event.type)
+    try:
+        with transaction.atomic():
+            applied = bool(to_status and order_id) and transition(
+                order_id, to_status, stripe_payment_intent=event.intent.id
+            )
+            PaymentEvent.objects.create(
+                provider=provider_name, event_id=event.id, type=event.type, intent_id=event.intent.id,
+                order_id=order_id, payload=event.payload, applied=applied,
+            )
+    except IntegrityError:
+        return 'duplicate'
+    return 'applied' if applied else 'ignored'
+
+
+def reconcile_payments(batch_size=100):
+    """
+    Settle online payments that are stuck waiting: start the ones whose intent
+    was never created, ask the provider for the rest in one lookup per batch,
+    and cancel intents nobody paid in time.
+    """
+    provider = get_provider()
+    now = timezone.now()
+    stale = Order.objects.filter(
+        payment_status__in=[Order.PAYMENT_PENDING, Order.PAYMENT_AWAITING],
+        payment_updated_at__lt=now - timedelta(seconds=PAYMENT_RECONCILE_AFTER),
+    ).order_by('id')
+    expires_before = now - timedelta(seconds=PAYMENT_EXPIRES_AFTER)
+    stats = {'checked': 0, 'started': 0, 'settled': 0, 'expired': 0, 'errors': 0}
+
+    last_id = 0
+    while True:
+        batch = list(stale.filter(id__gt=last_id).values(
+            'id', 'payment_status', 'stripe_payment_intent', 'payment_updated_at'
+        )[:batch_size])
+        if not batch:
+            return stats
+        last_id = batch[-1]['id']
+        stats['checked'] += len(batch)
+
+        with_intent = {row['stripe_payment_intent']: row for row in batch if row['stripe_payment_intent']}
+        for row in batch:
+            if not row['stripe_payment_intent']:
+                try:
+                    start_payment(row['id'], settings.SITE_URL + reverse('order_confirmation', args=[row['id']]))
+                    stats['started'] += 1
+                except PaymentError:
+                    logger.warning('Could not start payment for order %s', row['id'], exc_info=True)
+                    stats['errors'] += 1
+
+        if not with_intent:
+            continue
+        try:
+            intents = provider.retrieve_intents(with_intent)
+        except PaymentError:
+            logger.warning('Payment reconciliation lookup failed', exc_info=True)
+            stats['errors'] += 1
+            continue
+
+        for intent_id, row in with_intent.items():
+            intent = intents.get(intent_id)
+            to_status = INTENT_TRANSITIONS.get(intent.status) if intent else None
+            if to_status:
+                stats['settled'] += transition(row['id'], to_status)
+            elif row['payment_updated_at'] < expires_before:
+                try:
+                    provider.cancel_intent(intent_id)
+                except PaymentError:
+                    stats['errors'] += 1
+                    continue
+                stats['expired'] += transition(row['id'], Order.PAYMENT_FAILED)
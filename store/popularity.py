@@ -0,0 +1,98 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background flushes of the buffered view counts
+FLUSH_INTERVAL = getattr(settings, 'PRODUCT_VIEWS_FLUSH_INTERVAL', 30)
+
+# A view from POPULARITY_HALF_LIFE ago weighs half as much as one from now
+POPULARITY_HALF_LIFE = getattr(settings, 'POPULARITY_HALF_LIFE', 7 * 24 * 3600)
+
+# Forward decay: instead of periodically shrinking every score, each view adds
+# 2 ** ((now - epoch) / half_life). Ordering by the stored sum is the same as
+# ordering by the decayed score, and no decay job ever has to touch the table.
+# Weights reach the float limit after 1024 half-lives (about 20 years with the
+# default); before that, scale every score down and move the epoch forward.
+POPULARITY_EPOCH = getattr(settings, 'POPULARITY_EPOCH', 1735689600)  # 2025-01-01 UTC
+
+_lock = threading.Lock()
+_pending = Counter()
+_flusher_pid = None
+
+
+def view_weight(timestamp=None):
+    """Popularity added by one view at the given time"""
+    timestamp = time.time() if timestamp is None else timestamp
+    return 2 ** ((timestamp - POPULARITY_EPOCH) / POPULARITY_HALF_LIFE)
+
+
+def record_view(product_id):
+    """Count a product view in memory; the database is updated later in a batch"""
+    _ensure_flusher()
+    with _lock:
+        _pending[product_id] += 1
+
+
+def flush_views():
+    """Write all buffered views with one UPDATE per distinct increment"""
+    with _lock:
+        pending = _pending.copy()
+        _pending.clear()
+    if not pending:
+        return 0
+
+    by_increment = defaultdict(list)
+    for product_id, views in pending.items():
+        by_increment[views].append(product_id)
+
+    weight = view_weight()
+    for views, product_ids in by_increment.items():
+        Product.objects.filter(id__in=product_ids).update(
+            view_count=F('view_count') + views,
+            popularity=F('popularity') + views * weight,
+        )
+    return sum(pending.values())
+
+
+def _safe_flush():
+    try:
+        flush_views()
+    except Exception:
+        logger.exception('Could not flush product view counts')
+    finally:
+        # The calling thread's connection would otherwise stay open between flushes
+        connection.close()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        _safe_flush()
+
+
+def _ensure_flusher():
+    """Start the background flush thread once per process (also after a fork)"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        # Counts inherited from the parent process belong to the parent
+        _pending.clear()
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='product-views-flusher', daemon=True).start()
+
+
+atexit.register(_safe_flush)
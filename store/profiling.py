@@ -0,0 +1,236 @@
+import atexit
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests profiled, 0 to 1. Off by default; e.g. 0.01 in
+# production while chasing a regression.
+PROFILE_SAMPLE_RATE = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+
+# Staff can profile a single request by sending `X-Profile: 1`
+PROFILE_HEADER = getattr(settings, 'PROFILE_HEADER', 'HTTP_X_PROFILE')
+
+# Seconds between stack samples of a profiled request
+PROFILE_INTERVAL = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+
+# Finer sampling for a header-triggered request, whose flame graph stands alone
+PROFILE_REQUEST_INTERVAL = getattr(settings, 'PROFILE_REQUEST_INTERVAL', 0.001)
+
+# Collapsed-stack files are written here: <view>.<pid>.collapsed per URL
+# name, plus requests/ for header-triggered requests
+PROFILE_ROOT = getattr(settings, 'PROFILE_ROOT', os.path.join(settings.BASE_DIR, 'profiles'))
+
+# Seconds between rewrites of a worker's per-URL aggregate files
+PROFILE_FLUSH_INTERVAL = getattr(settings, 'PROFILE_FLUSH_INTERVAL', 60)
+
+
+def frame_label(code):
+    """Flame graph frame name: `module.path:function`, with no ';' so it is a valid collapsed-stack frame"""
+    filename = code.co_filename
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base):
+        filename = os.path.relpath(filename, base)
+    else:
+        for path in sorted(sys.path, key=len, reverse=True):
+            if path and filename.startswith(path):
+                filename = os.path.relpath(filename, path)
+                break
+    module = filename.removesuffix('.py').replace(os.sep, '.')
+    return f'{module}:{code.co_qualname}'.replace(';', ',').replace(' ', '_')
+
+
+class Sampler:
+    """
+    One daemon thread per process that periodically reads the current frame
+    of each thread being profiled (sys._current_frames) and counts its stack.
+    It only runs while a profiled request is in flight, and the profiled
+    thread itself does no extra work.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.active = {}  # thread id -> (root code object, interval, Counter of stacks)
+        self.labels = {}  # code object -> frame label
+        self.thread = None
+        self.pid = None
+
+    def start(self, root, interval):
+        """Start sampling the calling thread every `interval`; frames from `root` down are left out"""
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                # Lazily, and again in a forked worker, which has no threads
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+                self.thread.start()
+            self.active[threading.get_ident()] = (root, interval, Counter())
+            self.wake.set()
+
+    def stop(self):
+        """Stop sampling the calling thread; returns {stack tuple: samples}"""
+        with self.lock:
+            root, interval, samples = self.active.pop(threading.get_ident(), (None, None, Counter()))
+            if not self.active:
+                self.wake.clear()
+        return samples
+
+    def stack(self, frame, root):
+        codes = []
+        while frame is not None and frame.f_code is not root:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        labels = self.labels
+        stack = []
+        for code in reversed(codes):
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = frame_label(code)
+            stack.append(label)
+        return tuple(stack)
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                interval = min((entry[1] for entry in self.active.values()), default=PROFILE_INTERVAL)
+            # Jittered so requests shorter than the interval are still
+            # sampled in proportion to their duration
+            time.sleep(random.uniform(0, 2 * interval))
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, (root, interval, samples) in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[self.stack(frame, root)] += 1
+            del frames
+
+
+sampler = Sampler()
+
+
+def safe_name(view_name):
+    return ''.join(char if char.isalnum() or char in '-_' else '.' for char in view_name) or 'unknown'
+
+
+def write_collapsed(path, samples):
+    """Write {stack: count} in the collapsed format of flamegraph.pl, speedscope and inferno"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as output:
+        for stack, count in sorted(samples.items()):
+            if stack:
+                output.write(f"{';'.join(stack)} {count}\n")
+    os.replace(temporary, path)
+
+
+def read_collapsed(path, view_name=None):
+    """
+    {stack tuple: count} from a collapsed-stack file, or summed over a
+    directory's *.collapsed files (only `view_name`'s, if given: one per worker)
+    """
+    samples = Counter()
+    if os.path.isdir(path):
+        suffix = '.collapsed'
+        prefix = f'{safe_name(view_name)}.' if view_name else ''
+        paths = [
+            os.path.join(path, name) for name in sorted(os.listdir(path))
+            if name.endswith(suffix) and name.startswith(prefix)
+            and (not view_name or name[len(prefix):-len(suffix)].isdigit())
+        ]
+    else:
+        paths = [path]
+    for filename in paths:
+        with open(filename) as lines:
+            for line in lines:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    samples[tuple(stack.split(';'))] += int(count)
+    return samples
+
+
+class Aggregate:
+    """This worker's samples per URL name, rewritten to PROFILE_ROOT every PROFILE_FLUSH_INTERVAL"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(Counter)
+        self.flushed = time.monotonic()
+
+    def add(self, view_name, samples):
+        with self.lock:
+            self.samples[view_name].update(samples)
+            due = time.monotonic() - self.flushed >= PROFILE_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.flushed = time.monotonic()
+            snapshot = {view_name: Counter(samples) for view_name, samples in self.samples.items()}
+        for view_name, samples in snapshot.items():
+            try:
+                write_collapsed(os.path.join(PROFILE_ROOT, f'{safe_name(view_name)}.{os.getpid()}.collapsed'), samples)
+            except OSError:
+                logger.exception('Could not write the profile of %s', view_name)
+
+
+aggregate = Aggregate()
+atexit.register(aggregate.flush)
+
+
+class ProfilingMiddleware:
+    """
+    Samples the stacks of a fraction of requests (PROFILE_SAMPLE_RATE), and
+    of staff requests sending the X-Profile header, from the view through the
+    ORM and template rendering. Samples are aggregated per URL name into
+    collapsed-stack files; a header-triggered request gets its own file
+    instead, named in the X-Profile-File response header. Compare two profiles with
+    `manage.py diff_profiles`.
+
+    Goes after AuthenticationMiddleware, which the staff check needs.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profiled = False
+        try:
+            response = self.get_response(request)
+        finally:
+            samples = sampler.stop() if request.profiled else None
+        if samples is not None:
+            self.record(request, response, samples)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        requested = request.META.get(PROFILE_HEADER) and request.user.is_staff
+        if requested or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            request.profiled = 'request' if requested else 'sampled'
+            interval = PROFILE_REQUEST_INTERVAL if requested else PROFILE_INTERVAL
+            sampler.start(ProfilingMiddleware.__call__.__code__, interval)
+        return None
+
+    def record(self, request, response, samples):
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unknown'
+        if request.profiled == 'sampled':
+            aggregate.add(view_name, samples)
+        else:
+            # Sampled more finely, so kept out of the per-URL aggregate
+            filename = f"{safe_name(view_name)}-{timezone.now():%Y%m%d-%H%M%S%f}.collapsed"
+            try:
+                write_collapsed(os.path.join(PROFILE_ROOT, 'requests', filename), samples)
+            except OSError:
+                logger.exception('Could not write the profile of %s', view_name)
+                return
+            response['X-Profile-File'] = filename
+            response['X-Profile-Samples'] = sum(samples.values())
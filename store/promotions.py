@@ -0,0 +1,174 @@
+import time
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Product, Promotion
+
+# Changed prices written per statement
+PROMOTION_WRITE_BATCH_SIZE = getattr(settings, 'PROMOTION_WRITE_BATCH_SIZE', 1000)
+
+# Seconds between the first rule change and the repricing run, so that
+# editing several rules in a row reprices the catalog once
+PROMOTION_REPRICE_DELAY = getattr(settings, 'PROMOTION_REPRICE_DELAY', 5)
+
+CENT = Decimal('0.01')
+
+
+class RuleSet:
+    """The live promotions, indexed by what they apply to"""
+
+    def __init__(self, promotions, category_links, product_links):
+        by_id = {promotion.id: promotion for promotion in promotions}
+        scoped = set()
+        self.by_category = defaultdict(list)
+        self.by_product = defaultdict(list)
+        for promotion_id, category_id in category_links:
+            self.by_category[category_id].append(by_id[promotion_id])
+            scoped.add(promotion_id)
+        for promotion_id, product_id in product_links:
+            self.by_product[product_id].append(by_id[promotion_id])
+            scoped.add(promotion_id)
+        self.everywhere = [promotion for promotion in promotions if promotion.id not in scoped]
+
+    @classmethod
+    def live(cls, now=None, product_ids=None):
+        """Rules in effect at `now`; pass product_ids to load only their product links"""
+        now = now or timezone.now()
+        promotions = [promotion for promotion in Promotion.objects.filter(published=True) if promotion.is_live(now)]
+        ids = [promotion.id for promotion in promotions]
+        if not ids:
+            return cls([], [], [])
+        category_links = Promotion.categories.through.objects.filter(promotion_id__in=ids)
+        product_links = Promotion.products.through.objects.filter(promotion_id__in=ids)
+        if product_ids is not None:
+            product_links = product_links.filter(product_id__in=product_ids)
+        return cls(
+            promotions,
+            category_links.values_list('promotion_id', 'category_id'),
+            product_links.values_list('promotion_id', 'product_id'),
+        )
+
+    def __bool__(self):
+        return bool(self.everywhere or self.by_category or self.by_product)
+
+    def rules_for(self, product_id, category_id):
+        return self.everywhere + self.by_category.get(category_id, []) + self.by_product.get(product_id, [])
+
+
+def discounted(promotion, price):
+    if promotion.kind == Promotion.PERCENTAGE:
+        value = price * (100 - promotion.amount) / 100
+    else:
+        value = price - promotion.amount
+    return max(value, Decimal(0)).quantize(CENT, ROUND_HALF_UP)
+
+
+def effective_prices(rules, product_id, category_id, regular_price, compare_at_price):
+    """
+    (price, old_price, promotion_id) for one product. The rule giving the
+    lowest price wins, the oldest rule on a tie; the struck-through price is
+    the regular price unless the merchant set a higher one.
+    """
+    best = None
+    for promotion in rules.rules_for(product_id, category_id):
+        candidate = (discounted(promotion, regular_price), promotion.id)
+        if candidate[0] < regular_price and (best is None or candidate < best):
+            best = candidate
+    if best is None:
+        return regular_price, compare_at_price, None
+    if compare_at_price and compare_at_price > regular_price:
+        return best[0], compare_at_price, best[1]
+    return best[0], regular_price, best[1]
+
+
+def apply_promotions(product, rules=None):
+    """Set a single product's effective prices (Product.save calls this)"""
+    if rules is None:
+        rules = RuleSet.live(product_ids=[product.pk] if product.pk else [])
+    product.price, product.old_price, product.promotion_id = effective_prices(
+        rules, product.pk, product.category_id, product.regular_price, product.compare_at_price
+    )
+
+
+def _write_prices(rows, updated_at):
+    """rows of (id, price, old_price, promotion_id, discount_percentage), one statement per batch"""
+    table = connection.ops.quote_name(Product._meta.db_table)
+    updated_at = connection.ops.adapt_datetimefield_value(updated_at)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), PROMOTION_WRITE_BATCH_SIZE):
+            batch = rows[start:start + PROMOTION_WRITE_BATCH_SIZE]
+            if connection.vendor == 'postgresql':
+                # executemany is a round trip per row on psycopg2; join against VALUES instead
+                values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(batch))
+                cursor.execute(
+                    f'UPDATE {table} AS p SET price = v.price::numeric, old_price = v.old_price::numeric, '
+                    f'promotion_id = v.promotion_id::bigint, discount_percentage = v.discount::smallint, '
+                    f'updated_at = %s '
+                    f'FROM (VALUES {values}) AS v(id, price, old_price, promotion_id, discount) '
+                    f'WHERE p.id = v.id::bigint',
+                    [updated_at] + [value for row in batch for value in row],
+                )
+            else:
+                cursor.executemany(
+                    f'UPDATE {table} SET price = %s, old_price = %s, promotion_id = %s, '
+                    f'discount_percentage = %s, updated_at = %s WHERE id = %s',
+                    [(price, old_price, promotion_id, discount, updated_at, product_id)
+                     for product_id, price, old_price, promotion_id, discount in batch],
+                )
+
+
+def reprice_catalog(now=None):
+    """
+    Evaluate the live promotions against every product in one pass and write
+    back only the prices that changed, all in one transaction so a sale starts
+    (or ends) for the whole catalog at once. Returns the number of products
+    repriced.
+    """
+    from .signals import catalog_changed
+
+    now = now or timezone.now()
+    rules = RuleSet.live(now)
+    rows = (
+        Product.objects.order_by()
+        .values_list('id', 'category_id', 'regular_price', 'compare_at_price', 'price', 'old_price', 'promotion_id')
+        .iterator(chunk_size=5000)
+    )
+    changed = []
+    for product_id, category_id, regular_price, compare_at_price, price, old_price, promotion_id in rows:
+        target = effective_prices(rules, product_id, category_id, regular_price, compare_at_price)
+        if target != (price, old_price, promotion_id):
+            changed.append((product_id, *target, Product.discount_for(target[0], target[1])))
+
+    if changed:
+        with transaction.atomic():
+            _write_prices(changed, now)
+            catalog_changed()
+    schedule_next_reprice(now)
+    return len(changed)
+
+
+def schedule_reprice():
+    """Reprice soon after promotions change (one run per PROMOTION_REPRICE_DELAY window)"""
+    from .tasks import reprice_products
+
+    slot = int(time.time() // PROMOTION_REPRICE_DELAY) + 1
+    reprice_products.enqueue(
+        delay=slot * PROMOTION_REPRICE_DELAY - time.time(),
+        idempotency_key=f'reprice:{PROMOTION_REPRICE_DELAY}:{slot}',
+    )
+
+
+def schedule_next_reprice(now):
+    """Queue a run for the next time a published promotion starts or ends"""
+    from .tasks import reprice_products
+
+    boundaries = []
+    for starts_at, ends_at in Promotion.objects.filter(published=True).values_list('starts_at', 'ends_at'):
+        boundaries += [moment for moment in (starts_at, ends_at) if moment and moment > now]
+    if boundaries:
+        run_at = min(boundaries)
+        reprice_products.enqueue(run_at=run_at, idempotency_key=f'reprice-at:{run_at.isoformat()}')
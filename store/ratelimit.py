@@ -0,0 +1,180 @@
+import logging
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+# Turn admission control off entirely (e.g. for load tests)
+RATELIMIT_ENABLED = getattr(settings, 'RATELIMIT_ENABLED', True)
+
+# Counters live here; it must be shared between workers (Redis, Memcached)
+# for limits to be site-wide rather than per process
+RATELIMIT_CACHE = getattr(settings, 'RATELIMIT_CACHE', 'default')
+
+# request.META key holding the client IP; set to e.g. 'HTTP_X_REAL_IP' behind a proxy
+RATELIMIT_IP_META = getattr(settings, 'RATELIMIT_IP_META', 'REMOTE_ADDR')
+
+# A concurrency slot whose request never released it (worker killed) is freed
+# after this long; keep it above the request timeout (config/gunicorn.conf.py)
+GATE_TIMEOUT = 60
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class Policy:
+    """
+    Admission rules for one URL name, declared in store/urls.py.
+
+    rate: '10/m' style budget per client, `key` picking the client: 'user'
+        (user, else session, else IP) or 'ip'.
+    concurrency: requests to this route allowed in flight at once across
+        the site; extra requests wait up to `queue` seconds for a slot,
+        then get a 503.
+    methods: only these methods are counted; GETs of forms stay free.
+    """
+
+    def __init__(self, rate=None, key='user', concurrency=None, queue=0, methods=('POST',)):
+        self.limit = self.period = None
+        if rate:
+            count, period = rate.split('/')
+            self.limit = int(count)
+            self.period = PERIODS[period[0]]
+        self.key = key
+        self.concurrency = concurrency
+        self.queue = queue
+        self.methods = methods
+
+
+def client_key(request, kind):
+    ip = request.META.get(RATELIMIT_IP_META) or request.META.get('REMOTE_ADDR', '')
+    if kind == 'ip':
+        return f'ip:{ip}'
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if request.session.session_key:
+        return f'session:{request.session.session_key}'
+    return f'ip:{ip}'
+
+
+def _incr(cache, key, timeout):
+    """Increment a counter, creating it with `timeout` on first use; one round trip in the common case"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+def take_token(cache, name, policy, request):
+    """
+    Count one request against the client's budget for the current window.
+    Returns 0 if allowed, else the seconds until the window resets.
+
+    Django's cache API has no atomic read-modify-write beyond incr(), so this
+    is a windowed counter rather than a token bucket: a single incr() per
+    request, at the cost of allowing up to twice the rate across a window
+    boundary.
+    """
+    now = time.time()
+    window = int(now // policy.period)
+    key = f'ratelimit:{name}:{client_key(request, policy.key)}:{window}'
+    if _incr(cache, key, policy.period + 1) <= policy.limit:
+        return 0
+    return max(1, math.ceil((window + 1) * policy.period - now))
+
+
+def acquire_slot(cache, name, policy):
+    """
+    Take one of the route's concurrency slots, waiting up to policy.queue
+    seconds. Each slot is its own key, claimed with an atomic add() and
+    expiring on its own, so a lost release frees exactly one slot after
+    GATE_TIMEOUT and can never push a shared counter out of step. Below
+    capacity the first, randomly picked, slot is usually free, so admission
+    is one round trip. Returns the slot to pass to release_slot(), or None.
+    """
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + policy.queue
+    delay = 0.02
+    while True:
+        # Probing from a random slot spreads concurrent requests over the keys
+        start = random.randrange(policy.concurrency)
+        for offset in range(policy.concurrency):
+            key = f'ratelimit:gate:{name}:{(start + offset) % policy.concurrency}'
+            if cache.add(key, token, GATE_TIMEOUT):
+                return key, token, time.monotonic()
+        if time.monotonic() + delay > deadline:
+            return None
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+
+
+def release_slot(cache, slot):
+    key, token, acquired_at = slot
+    try:
+        # A slot released well within GATE_TIMEOUT can't have expired, so it is
+        # still ours and one delete() frees it. Only a request that ran longer
+        # checks first: after an expiry the key may be someone else's claim.
+        if time.monotonic() - acquired_at < GATE_TIMEOUT - 1 or cache.get(key) == token:
+            cache.delete(key)
+    except Exception:
+        logger.exception('Could not release the %s concurrency slot', key)
+
+
+def too_busy(status, retry_after, message):
+    response = HttpResponse(message, status=status, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Applies the Policy registered for the resolved URL name. Routes without a
+    policy cost nothing; a rate check is one cache round trip, and a
+    concurrency slot usually one to take and one to release. If the cache is
+    down, requests are let through rather than failing.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.policies = None
+
+    def __call__(self, request):
+        request.admission_slot = None
+        try:
+            return self.get_response(request)
+        finally:
+            if request.admission_slot:
+                release_slot(caches[RATELIMIT_CACHE], request.admission_slot)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not RATELIMIT_ENABLED or request.resolver_match is None:
+            return None
+        if self.policies is None:
+            from .urls import rate_limits
+            self.policies = rate_limits
+        name = request.resolver_match.url_name
+        policy = self.policies.get(name)
+        if policy is None or request.method not in policy.methods:
+            return None
+
+        cache = caches[RATELIMIT_CACHE]
+        try:
+            if policy.limit:
+                retry_after = take_token(cache, name, policy, request)
+                if retry_after:
+                    return too_busy(429, retry_after, 'Too many requests, please try again shortly.')
+            if policy.concurrency:
+                request.admission_slot = acquire_slot(cache, name, policy)
+                if request.admission_slot is None:
+                    return too_busy(503, 1, 'We are very busy right now, please try again in a moment.')
+        except Exception:
+            logger.exception('Admission control unavailable for %s; letting the request through', name)
+        return None
@@ -0,0 +1,146 @@
+import math
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import OrderItem, ProductRecommendation, RecommendationRun
+
+
+# Neighbours stored per product
+TOP_K = 8
+
+# Baskets larger than this are mostly bulk/B2B orders and add noise (and
+# quadratic work) without saying much about what goes together
+MAX_BASKET_SIZE = 50
+
+BATCH_SIZE = 5000
+
+
+def _order_lines(order_ids=None):
+    """(order_id, product_id) pairs from non-cancelled orders, grouped by order"""
+    lines = OrderItem.objects.filter(product__isnull=False).exclude(order__status='cancelled')
+    if order_ids is not None:
+        lines = lines.filter(order_id__in=order_ids)
+    return lines.order_by('order_id').values_list('order_id', 'product_id').iterator(chunk_size=BATCH_SIZE)
+
+
+def _baskets(lines):
+    """Turn ordered (order_id, product_id) pairs into sets of product ids"""
+    current_order, basket = None, set()
+    for order_id, product_id in lines:
+        if order_id != current_order:
+            if basket:
+                yield basket
+            current_order, basket = order_id, set()
+        basket.add(product_id)
+    if basket:
+        yield basket
+
+
+def _counted(baskets, frequencies):
+    """Pass baskets through while counting how many orders contain each product"""
+    for basket in baskets:
+        frequencies.update(basket)
+        yield basket
+
+
+def count_cooccurrences(baskets, only_products=None):
+    """
+    Sparse item-item co-occurrence counts: {product_id: Counter(other_id: orders)}.
+    When only_products is given, rows are kept for those products only.
+    """
+    matrix = defaultdict(Counter)
+    for basket in baskets:
+        if len(basket) < 2 or len(basket) > MAX_BASKET_SIZE:
+            continue
+        for a, b in combinations(sorted(basket), 2):
+            if only_products is None or a in only_products:
+                matrix[a][b] += 1
+            if only_products is None or b in only_products:
+                matrix[b][a] += 1
+    return matrix
+
+
+def _order_frequencies(product_ids):
+    """Number of (non-cancelled) orders each product appears in"""
+    rows = (
+        OrderItem.objects.filter(product_id__in=product_ids)
+        .exclude(order__status='cancelled')
+        .values('product_id')
+        .annotate(n=Count('order_id', distinct=True))
+        .values_list('product_id', 'n')
+    )
+    return dict(rows)
+
+
+def top_neighbours(matrix, frequencies, k=TOP_K):
+    """Rank each row by cosine similarity, keeping the k best neighbours"""
+    ranked = {}
+    for product_id, row in matrix.items():
+        n_product = frequencies.get(product_id, 1)
+        scored = [
+            (count / math.sqrt(n_product * frequencies.get(other_id, 1)), other_id)
+            for other_id, count in row.items()
+        ]
+        scored.sort(reverse=True)
+        ranked[product_id] = scored[:k]
+    return ranked
+
+
+def _write_recommendations(ranked, product_ids, replace_all=False):
+    """Replace the stored neighbours of product_ids with the ranked lists"""
+    rows = [
+        ProductRecommendation(product_id=product_id, recommended_id=other_id, rank=rank, score=score)
+        for product_id in product_ids
+        for rank, (score, other_id) in enumerate(ranked.get(product_id, []), start=1)
+    ]
+    with transaction.atomic():
+        if replace_all:
+            ProductRecommendation.objects.all().delete()
+        else:
+            ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+
+
+def rebuild_recommendations():
+    """Recompute the whole recommendation table from every order"""
+    last_order_id = OrderItem.objects.aggregate(last=Max('order_id'))['last'] or 0
+    frequencies = Counter()
+    baskets = _baskets(_order_lines())
+    matrix = count_cooccurrences(_counted(baskets, frequencies))
+    ranked = top_neighbours(matrix, frequencies)
+    _write_recommendations(ranked, list(ranked), replace_all=True)
+    return RecommendationRun.objects.create(
+        last_order_id=last_order_id, full_rebuild=True, products_updated=len(ranked)
+    )
+
+
+def refresh_recommendations():
+    """
+    Incremental refresh from the orders placed since the last run. A new order
+    changes how many orders its products appear in, and so the score of every
+    pair they are part of: the products bought in it, and every product ever
+    bought together with those, get their neighbour lists recomputed from the
+    baskets they appear in. Orders cancelled after a run are only dropped by
+    a full rebuild.
+    """
+    last_run = RecommendationRun.objects.first()
+    if last_run is None:
+        return rebuild_recommendations()
+
+    new_lines = OrderItem.objects.filter(order_id__gt=last_run.last_order_id, product__isnull=False)
+    last_order_id = new_lines.aggregate(last=Max('order_id'))['last']
+    if last_order_id is None:
+        return last_run
+
+    touched = set(new_lines.values_list('product_id', flat=True))
+    touched_orders = OrderItem.objects.filter(product_id__in=touched).values('order_id')
+    affected = touched | {product_id for order_id, product_id in _order_lines(touched_orders)}
+    order_ids = OrderItem.objects.filter(product_id__in=affected).values('order_id')
+    matrix = count_cooccurrences(_baskets(_order_lines(order_ids)), only_products=affected)
+    neighbours = set().union(affected, *matrix.values())
+    ranked = top_neighbours(matrix, _order_frequencies(neighbours))
+    _write_recommendations(ranked, affected)
+    return RecommendationRun.objects.create(last_order_id=last_order_id, products_updated=len(affected))
@@ -0,0 +1,117 @@
+import os
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+
+from .models import Sequence
+
+# Order numbers reserved per database round trip. Numbers left in a block
+# when a worker stops are skipped, so bigger blocks mean bigger gaps.
+ORDER_NUMBER_BLOCK_SIZE = getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 50)
+
+ORDER_NUMBER_START = getattr(settings, 'ORDER_NUMBER_START', 100001)
+
+ORDER_NUMBER_FORMAT = getattr(settings, 'ORDER_NUMBER_FORMAT', 'ES-{number}')
+
+
+def _supports_update_returning():
+    if connection.vendor == 'postgresql':
+        return True
+    # SQLite added RETURNING in 3.35, the same release as for INSERT
+    return connection.vendor == 'sqlite' and connection.features.can_return_columns_from_insert
+
+
+def reserve_block(name, size, start=1):
+    """
+    Atomically take the next `size` values of a sequence and return the first.
+    One UPDATE ... RETURNING where the database supports it; every caller, in
+    any process on any host, gets a disjoint range.
+    """
+    table = connection.ops.quote_name(Sequence._meta.db_table)
+    for _ in range(2):
+        with transaction.atomic():
+            if _supports_update_returning():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'UPDATE {table} SET next_value = next_value + %s WHERE name = %s RETURNING next_value',
+                        [size, name],
+                    )
+                    row = cursor.fetchone()
+                end = row[0] if row else None
+            else:
+                sequence = Sequence.objects.select_for_update().filter(name=name).first()
+                end = None
+                if sequence is not None:
+                    sequence.next_value += size
+                    sequence.save(update_fields=['next_value'])
+                    end = sequence.next_value
+        if end is not None:
+            return end - size
+        try:
+            with transaction.atomic():
+                Sequence.objects.create(name=name, next_value=start)
+        except IntegrityError:
+            pass  # Another worker created it first
+    raise RuntimeError(f'Could not reserve a block of sequence {name!r}')
+
+
+class BlockAllocator:
+    """
+    Hands out unique, increasing integers from blocks reserved with
+    reserve_block(). Values are unique across all workers and strictly
+    increasing within one worker; across workers they interleave by block.
+    """
+
+    def __init__(self, name, block_size, start=1):
+        self.name = name
+        self.block_size = block_size
+        self.start = start
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def _reserve(self):
+        # The reservation must commit even if the caller's transaction rolls
+        # back, or another worker would be handed the same block. Inside an
+        # atomic block, reserve on a separate thread (and so a separate
+        # connection) instead.
+        if not connection.in_atomic_block:
+            return reserve_block(self.name, self.block_size, self.start)
+        result = {}
+
+        def reserve():
+            try:
+                result['first'] = reserve_block(self.name, self.block_size, self.start)
+            except Exception as exc:
+                result['error'] = exc
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=reserve)
+        thread.start()
+        thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['first']
+
+    def next(self):
+        with self._lock:
+            # A forked worker must not reuse the block it inherited from its parent
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            if self._next >= self._end:
+                self._next = self._reserve()
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+            return value
+
+
+order_numbers = BlockAllocator('order_number', ORDER_NUMBER_BLOCK_SIZE, ORDER_NUMBER_START)
+
+
+def next_order_number():
+    """A new human-friendly order number such as ES-100245"""
+    return ORDER_NUMBER_FORMAT.format(number=order_numbers.next())
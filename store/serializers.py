@@ -0,0 +1,84 @@
+from functools import lru_cache
+
+from django.urls import reverse
+from rest_framework import serializers
+
+from .models import Category, Order, OrderItem, Product
+
+
+@lru_cache(maxsize=None)
+def product_url_template():
+    """product_detail URL as a format string; reverse() per row dominates list serialization"""
+    url = reverse('product_detail', args=[123456789, 'slug-placeholder'])
+    return url.replace('123456789', '{id}').replace('slug-placeholder', '{slug}')
+
+
+class SparseFieldsMixin:
+    """Serialize only the fields listed in ?fields=a,b,c (unknown names are ignored)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = request.query_params.get('fields') if request is not None else None
+        if requested:
+            wanted = {name.strip() for name in requested.split(',')}
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+
+class CategorySummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug']
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'slug', 'description', 'image', 'updated_at']
+
+    def get_image(self, category):
+        return category.image.url if category.image else None
+
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Needs select_related('category') on the queryset
+    category = CategorySummarySerializer(read_only=True)
+    image = serializers.SerializerMethodField()
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = [
+            'id', 'name', 'slug', 'category', 'description', 'price', 'old_price',
+            'discount_percentage', 'stock', 'available', 'featured', 'image', 'url',
+            'created_at', 'updated_at',
+        ]
+
+    def get_image(self, product):
+        return product.image.url if product.image else None
+
+    def get_url(self, product):
+        return product_url_template().format(id=product.id, slug=product.slug)
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['product', 'product_name', 'product_price', 'quantity']
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Needs prefetch_related('items') on the queryset
+    items = OrderItemSerializer(many=True, read_only=True)
+    total = serializers.DecimalField(source='get_total', max_digits=10, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_number', 'status', 'payment_method', 'payment_completed',
+            'total_amount', 'shipping_cost', 'total', 'full_name', 'email', 'phone',
+            'address', 'city', 'postal_code', 'country', 'items', 'created_at', 'updated_at',
+        ]
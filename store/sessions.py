@@ -0,0 +1,84 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core import checks
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem
+
+# Expired sessions deleted per transaction
+SESSION_CLEANUP_BATCH_SIZE = getattr(settings, 'SESSION_CLEANUP_BATCH_SIZE', 1000)
+
+
+def uses_database():
+    """Whether the session engine keeps sessions in django_session"""
+    return settings.SESSION_ENGINE in (
+        'django.contrib.sessions.backends.db',
+        'django.contrib.sessions.backends.cached_db',
+    )
+
+
+# Cache backends private to each process: a session cached in one is not
+# evicted from the others when it is logged out or flushed
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_session_cache(app_configs, **kwargs):
+    """A cache-backed session engine needs a cache shared by every worker"""
+    if settings.SESSION_ENGINE not in (
+        'django.contrib.sessions.backends.cache',
+        'django.contrib.sessions.backends.cached_db',
+    ):
+        return []
+    alias = getattr(settings, 'SESSION_CACHE_ALIAS', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        f'SESSION_ENGINE {settings.SESSION_ENGINE!r} is backed by the per-process cache {alias!r} ({backend}).',
+        hint=(
+            'A logged-out session stays valid in every other worker until its cache entry expires. '
+            "Use 'django.contrib.sessions.backends.db' or point the cache at a shared backend such as Redis."
+        ),
+        id='store.E001',
+    )]
+
+
+def clear_expired_batch(batch_size=SESSION_CLEANUP_BATCH_SIZE):
+    """Delete one batch of expired sessions and their anonymous carts; returns how many sessions went"""
+    keys = list(
+        Session.objects.filter(expire_date__lt=timezone.now())
+        .order_by('expire_date').values_list('session_key', flat=True)[:batch_size]
+    )
+    if not keys:
+        return 0
+    with transaction.atomic():
+        CartItem.objects.filter(user__isnull=True, session_key__in=keys).delete()
+        Session.objects.filter(session_key__in=keys).delete()
+    return len(keys)
+
+
+def clear_expired_sessions(batch_size=SESSION_CLEANUP_BATCH_SIZE, max_batches=None, pause=0):
+    """
+    Like `manage.py clearsessions`, but in small batches so the delete never
+    holds long locks on a big django_session table. Cache-only engines expire
+    sessions themselves and are left alone.
+    """
+    if not uses_database():
+        return 0
+    deleted = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = clear_expired_batch(batch_size)
+        if not count:
+            break
+        deleted += count
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return deleted
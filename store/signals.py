@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import autocomplete, stock
+from .models import Category, Product
+from .tasks import schedule_api_cache_warming
+
+
+def catalog_changed():
+    transaction.on_commit(schedule_api_cache_warming)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    if created:
+        stock.record_opening_balance(instance)
+    autocomplete.product_saved(instance)
+    catalog_changed()
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    autocomplete.removed('product', instance.id)
+    catalog_changed()
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    autocomplete.category_saved(instance)
+    catalog_changed()
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    autocomplete.removed('category', instance.id)
+    catalog_changed()
@@ -0,0 +1,322 @@
+import copy
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Max
+
+from .catalog import DEFAULT_SORT, PRODUCT_SORTS, get_catalog_state, get_catalog_version, get_stock_version
+from .facets import FACET_KEYS, facet_values, tally_facets
+from .models import Category, Product, ProductRecommendation
+
+
+# Seconds a worker trusts its snapshot before asking the database for the
+# catalog version again (requests that already know the version skip this)
+SNAPSHOT_CHECK_INTERVAL = getattr(settings, 'CATALOG_SNAPSHOT_CHECK_INTERVAL', 1)
+
+# Popularity changes do not bump the catalog version, so rebuild at least this often
+SNAPSHOT_MAX_AGE = getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 300)
+
+# Product ids held by the listings memoized per snapshot (8 bytes each);
+# listings without facet filters share the presorted arrays and cost nothing
+LISTING_CACHE_IDS = getattr(settings, 'CATALOG_LISTING_CACHE_IDS', 1_000_000)
+
+
+class ImageRef:
+    """Just enough of a FieldFile for templates: truthiness and .url"""
+    __slots__ = ('name', 'url')
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+    def __bool__(self):
+        return bool(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+class CategoryRecord:
+    __slots__ = ('id', 'name', 'slug', 'description', 'image', 'product_count')
+
+    def __init__(self, id, name, slug, description, image):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.description = description
+        self.image = image
+        self.product_count = 0
+
+    def __str__(self):
+        return self.name
+
+
+class ProductRecord:
+    """Read-only stand-in for a Product, carrying the fields the catalog pages use"""
+    __slots__ = (
+        'id', 'name', 'slug', 'description', 'price', 'old_price', 'discount_percentage',
+        'image', 'stock', 'featured', 'popularity', 'created_at', 'category', 'category_id',
+        'facets',
+    )
+
+    def __init__(self, id, name, slug, description, price, old_price, discount_percentage,
+                 image, stock, featured, popularity, created_at, category):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.description = description
+        self.price = price
+        self.old_price = old_price
+        self.discount_percentage = discount_percentage
+        self.image = image
+        self.stock = stock
+        self.featured = featured
+        self.popularity = popularity
+        self.created_at = created_at
+        self.category = category
+        self.category_id = category.id if category else None
+        self.facets = self.get_facets()
+
+    def get_facets(self):
+        values = facet_values(self.category_id, self.price, self.stock, self.old_price, self.featured)
+        return tuple(values[key] for key in FACET_KEYS)
+
+    def __str__(self):
+        return self.name
+
+    def get_discount_percentage(self):
+        return self.discount_percentage
+
+
+def _sorted_ids(records, ordering):
+    """Ids of records ordered like QuerySet.order_by(*ordering)"""
+    records = list(records)
+    # Stable sorts from the last key to the first give a multi-key order
+    for field in reversed(ordering):
+        name = field.lstrip('-')
+        records.sort(key=lambda record: getattr(record, name), reverse=field.startswith('-'))
+    return array('q', (record.id for record in records))
+
+
+class CatalogSnapshot:
+    """
+    Immutable in-memory copy of the available catalog for one catalog version.
+    Sorted id arrays exist for every product_list sort, for the whole catalog
+    and for each category, plus the featured products newest first, so listing
+    is slicing plus dict lookups. Stock
+    changes give a patched copy (with_stock) instead of a rebuild.
+    """
+
+    def __init__(self, version, categories, products, recommendations, stock_version=None):
+        self.version = version
+        self.stock_version = stock_version
+        self.built_at = time.monotonic()
+        self.categories = categories
+        self.categories_by_slug = {category.slug: category for category in categories}
+        self.products = {product.id: product for product in products}
+        self.recommendations = recommendations
+
+        self.orderings = {}
+        by_category = {}
+        for product in products:
+            by_category.setdefault(product.category_id, []).append(product)
+        for sort, ordering in PRODUCT_SORTS.items():
+            self.orderings[sort, None] = _sorted_ids(products, ordering)
+            for category_id, members in by_category.items():
+                if category_id is not None:
+                    self.orderings[sort, category_id] = _sorted_ids(members, ordering)
+
+        self.featured_ids = array('q', (
+            product_id for product_id in self.orderings[DEFAULT_SORT, None] if self.products[product_id].featured
+        ))
+
+        for category in categories:
+            category.product_count = len(by_category.get(category.id, ()))
+
+        self.facet_counts = Counter(product.facets for product in products)
+        self.facet_groups = [(dict(zip(FACET_KEYS, key)), n) for key, n in self.facet_counts.items()]
+        self._listings = {}
+        self._listed_ids = 0
+
+    @classmethod
+    def from_database(cls, version):
+        # Read before the rows, so a sale committed meanwhile is patched in later
+        stock_version = Product.objects.aggregate(latest=Max('stock_updated_at'))['latest']
+        image_field = Product._meta.get_field('image')
+        category_image_field = Category._meta.get_field('image')
+
+        categories = [
+            CategoryRecord(id, name, slug, description,
+                           ImageRef(image, category_image_field.storage.url(image) if image else ''))
+            for id, name, slug, description, image in Category.objects.values_list(
+                'id', 'name', 'slug', 'description', 'image'
+            )
+        ]
+        categories_by_id = {category.id: category for category in categories}
+
+        rows = Product.objects.filter(available=True).order_by().values_list(
+            'id', 'name', 'slug', 'description', 'price', 'old_price', 'discount_percentage',
+            'image', 'stock', 'featured', 'popularity', 'created_at', 'category_id',
+        )
+        products = []
+        for row in rows.iterator(chunk_size=2000):
+            *fields, image, stock, featured, popularity, created_at, category_id = row
+            products.append(ProductRecord(
+                *fields,
+                ImageRef(image, image_field.storage.url(image) if image else ''),
+                stock, featured, popularity, created_at,
+                categories_by_id.get(category_id),
+            ))
+
+        recommendations = {}
+        pairs = ProductRecommendation.objects.order_by('product_id', 'rank').values_list('product_id', 'recommended_id')
+        for product_id, recommended_id in pairs.iterator(chunk_size=2000):
+            recommendations.setdefault(product_id, array('q')).append(recommended_id)
+
+        return cls(version, categories, products, recommendations, stock_version)
+
+    def with_stock(self, stock_version):
+        """
+        A copy with the stock counts changed since this snapshot's
+        stock_version. Sort orders and membership don't depend on stock (a
+        product selling out or coming back bumps the catalog version), so only
+        the changed records and the facet counts are replaced.
+        """
+        changed = Product.objects.filter(available=True).values_list('id', 'stock', 'stock_updated_at')
+        if self.stock_version is not None:
+            changed = changed.filter(stock_updated_at__gt=self.stock_version)
+        else:
+            changed = changed.filter(stock_updated_at__isnull=False)
+
+        snapshot = copy.copy(self)
+        snapshot.products = dict(self.products)
+        snapshot.facet_counts = Counter(self.facet_counts)
+        for product_id, stock, stock_updated_at in changed:
+            stock_version = max(stock_version, stock_updated_at) if stock_version else stock_updated_at
+            record = snapshot.products.get(product_id)
+            if record is None or record.stock == stock:
+                continue
+            record = copy.copy(record)
+            record.stock = stock
+            snapshot.facet_counts[record.facets] -= 1
+            record.facets = record.get_facets()
+            snapshot.facet_counts[record.facets] += 1
+            snapshot.products[product_id] = record
+        snapshot.facet_groups = [
+            (dict(zip(FACET_KEYS, key)), n) for key, n in snapshot.facet_counts.items() if n
+        ]
+        snapshot.stock_version = stock_version
+        snapshot._listings = {}
+        snapshot._listed_ids = 0
+        return snapshot
+
+    def get_product(self, product_id):
+        return self.products.get(product_id)
+
+    def get_category(self, slug):
+        return self.categories_by_slug.get(slug)
+
+    def product_ids(self, sort=None, category_id=None):
+        """Sorted ids of available products, optionally within one category"""
+        sort = sort if sort in PRODUCT_SORTS else DEFAULT_SORT
+        return self.orderings.get((sort, category_id), array('q'))
+
+    def filter_ids(self, ids, selected):
+        """Keep the ids whose products match every selected facet"""
+        wanted = [(index, selected[key]) for index, key in enumerate(FACET_KEYS) if selected[key]]
+        if not wanted:
+            return ids
+        products = self.products
+        return array('q', (
+            product_id for product_id in ids
+            if all(products[product_id].facets[index] == value for index, value in wanted)
+        ))
+
+    def listing(self, sort, selected):
+        """
+        (ids, facet_counts, total) for one sort and facet selection. The snapshot
+        never changes, so results are memoized until it is replaced, or until
+        the filtered id arrays held reach LISTING_CACHE_IDS.
+        """
+        key = (sort, tuple(selected[facet] for facet in FACET_KEYS))
+        result = self._listings.get(key)
+        if result is None:
+            facet_counts, total = tally_facets(self.facet_groups, selected)
+            presorted = self.product_ids(sort, selected['category'])
+            ids = self.filter_ids(presorted, selected)
+            size = 0 if ids is presorted else len(ids)
+            if self._listed_ids + size > LISTING_CACHE_IDS:
+                self._listings.clear()
+                self._listed_ids = 0
+            self._listed_ids += size
+            result = self._listings[key] = (ids, facet_counts, total)
+        return result
+
+    def get_products(self, ids):
+        return [self.products[product_id] for product_id in ids]
+
+    def related_products(self, product, limit=4):
+        """Stored co-purchase neighbours, falling back to the same category"""
+        ids = [
+            product_id for product_id in self.recommendations.get(product.id, ())
+            if product_id in self.products
+        ]
+        if not ids:
+            ids = [
+                product_id for product_id in self.product_ids(DEFAULT_SORT, product.category_id)[:limit + 1]
+                if product_id != product.id
+            ]
+        return self.get_products(ids[:limit])
+
+
+_snapshot = None
+_checked_at = 0.0
+_build_lock = threading.Lock()
+
+
+def current_snapshot():
+    """The snapshot this worker already holds, without checking its version"""
+    return _snapshot
+
+
+def get_snapshot(version=None, stock_version=None):
+    """
+    The current worker's catalog snapshot. A new one is built, and swapped in
+    as a whole, when the catalog version changes or the snapshot gets too old;
+    when only stock changed, a copy with the new counts is swapped in.
+    """
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    snapshot = _snapshot
+    fresh = snapshot is not None and now - snapshot.built_at < SNAPSHOT_MAX_AGE
+
+    if version is None:
+        if fresh and now - _checked_at < SNAPSHOT_CHECK_INTERVAL:
+            return snapshot
+        state = get_catalog_state()
+        version, stock_version = get_catalog_version(state), get_stock_version(state)
+        _checked_at = now
+
+    if fresh and snapshot.version == version and not is_newer(stock_version, snapshot.stock_version):
+        return snapshot
+
+    with _build_lock:
+        # Another thread may have rebuilt or patched it while we waited
+        if _snapshot is not snapshot:
+            snapshot = _snapshot
+            fresh = now - snapshot.built_at < SNAPSHOT_MAX_AGE
+            if fresh and snapshot.version == version and not is_newer(stock_version, snapshot.stock_version):
+                return snapshot
+        if fresh and snapshot.version == version:
+            _snapshot = snapshot.with_stock(stock_version)
+        else:
+            _snapshot = CatalogSnapshot.from_database(version)
+        return _snapshot
+
+
+def is_newer(stock_version, held):
+    """Whether a stock version (None when unknown) is past the one a snapshot holds"""
+    return stock_version is not None and (held is None or stock_version > held)
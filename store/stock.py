@@ -0,0 +1,246 @@
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import mail
+from .models import OrderItem, Product, StockMovement
+
+logger = logging.getLogger(__name__)
+
+# A product dropping to this many units or fewer triggers a low-stock alert
+LOW_STOCK_THRESHOLD = getattr(settings, 'LOW_STOCK_THRESHOLD', 5)
+
+# Who receives low-stock and out-of-stock alerts
+STOCK_ALERT_EMAIL = getattr(settings, 'STOCK_ALERT_EMAIL', settings.CONTACT_EMAIL)
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        super().__init__(f'Only {available} of {product.name!r} in stock')
+        self.product = product
+        self.available = available
+
+
+def availability_updates(product, balance, now):
+    """
+    Field updates for a product whose stock becomes `balance`: selling out hides
+    it and restocking shows it again (unless staff hid it). Only these flips
+    change the catalog itself, so only they bump updated_at.
+    """
+    if balance == 0 and product.available:
+        return {'available': False, 'hidden_out_of_stock': True, 'updated_at': now}
+    if balance > 0 and product.hidden_out_of_stock:
+        return {'available': True, 'hidden_out_of_stock': False, 'updated_at': now}
+    return {}
+
+
+def move(changes, kind, order=None, note='', order_id=None):
+    """
+    Apply signed quantity changes ({product_id: delta}) as one ledger write.
+    The products are locked, their balances updated and the movements bulk
+    inserted in one transaction; only these products are then checked against
+    the alert thresholds. Raises InsufficientStock, changing nothing, if a
+    balance would go negative. Returns the movements.
+    """
+    changes = {product_id: delta for product_id, delta in changes.items() if delta}
+    if not changes:
+        return []
+    now = timezone.now()
+    with transaction.atomic():
+        # Lock in id order so concurrent checkouts can't deadlock each other
+        products = {
+            product.id: product for product in
+            Product.objects.select_for_update().filter(id__in=changes).order_by('id')
+            .only('id', 'name', 'stock', 'available', 'hidden_out_of_stock')
+        }
+        for product_id, delta in changes.items():
+            if products[product_id].stock + delta < 0:
+                raise InsufficientStock(products[product_id], products[product_id].stock)
+
+        movements, alerts = [], []
+        flipped = False
+        for product_id in sorted(changes):
+            product = products[product_id]
+            before, after = product.stock, product.stock + changes[product_id]
+            # Other counts are patched into the snapshots by stock version
+            flips = availability_updates(product, after, now)
+            flipped = flipped or bool(flips)
+            Product.objects.filter(id=product_id).update(stock=after, stock_updated_at=now, **flips)
+            movements.append(StockMovement(
+                product_id=product_id, kind=kind, quantity=changes[product_id], balance=after,
+                order_id=order.id if order else order_id, note=note,
+            ))
+            if before > 0 and after == 0:
+                alerts.append((product.name, product_id, after, 'out of stock'))
+            elif before > LOW_STOCK_THRESHOLD >= after > 0:
+                alerts.append((product.name, product_id, after, 'low stock'))
+        StockMovement.objects.bulk_create(movements)
+
+        if flipped:
+            from .signals import catalog_changed
+            catalog_changed()
+        if alerts:
+            transaction.on_commit(lambda: send_stock_alert(alerts))
+    return movements
+
+
+def set_stock(product_id, quantity, note=''):
+    """Bring a product to an absolute count, recording the difference as a restock or adjustment"""
+    with transaction.atomic():
+        current = Product.objects.select_for_update().values_list('stock', flat=True).get(id=product_id)
+        delta = quantity - current
+        kind = StockMovement.RESTOCK if delta > 0 else StockMovement.ADJUSTMENT
+        return move({product_id: delta}, kind, note=note)
+
+
+def record_opening_balance(product):
+    """First ledger entry of a newly created product"""
+    if product.stock:
+        StockMovement.objects.create(
+            product=product, kind=StockMovement.RESTOCK, quantity=product.stock,
+            balance=product.stock, note='Opening balance',
+        )
+
+
+def order_holdings(order_id):
+    """
+    {product_id: (reserved, sold)}: the units an order still keeps out of
+    stock, read from its own ledger entries
+    """
+    reserved, sold = defaultdict(int), defaultdict(int)
+    totals = (
+        StockMovement.objects.filter(order_id=order_id).order_by()
+        .values_list('product_id', 'kind').annotate(total=Sum('quantity'))
+    )
+    for product_id, kind, total in totals:
+        if kind in (StockMovement.RESERVATION, StockMovement.RELEASE):
+            reserved[product_id] -= total
+        else:
+            sold[product_id] -= total
+    return {
+        product_id: (reserved[product_id], sold[product_id])
+        for product_id in reserved.keys() | sold.keys()
+        if reserved[product_id] or sold[product_id]
+    }
+
+
+def release_reservation(order_id, note=''):
+    """Put back what an unpaid order reserved (failed or expired payment)"""
+    held = {product_id: reserved for product_id, (reserved, sold) in order_holdings(order_id).items() if reserved > 0}
+    return move(held, StockMovement.RELEASE, order_id=order_id, note=note)
+
+
+def return_order_stock(order_id, note=''):
+    """Put back everything an order keeps out of stock: reservations are released, sales restocked"""
+    with transaction.atomic():
+        holdings = order_holdings(order_id)
+        movements = move(
+            {product_id: reserved for product_id, (reserved, sold) in holdings.items() if reserved > 0},
+            StockMovement.RELEASE, order_id=order_id, note=note,
+        )
+        movements += move(
+            {product_id: sold for product_id, (reserved, sold) in holdings.items() if sold > 0},
+            StockMovement.RESTOCK, order_id=order_id, note=note,
+        )
+    return movements
+
+
+def confirm_reservation(order_id):
+    """
+    Turn a paid order's reservation into a sale: a release and a sale of the
+    same units, so the balance (and the catalog) do not change. An order whose
+    reservation was already released, when a declined card is retried
+    successfully, takes its items out of stock again.
+    """
+    with transaction.atomic():
+        holdings = order_holdings(order_id)
+        held = {product_id: reserved for product_id, (reserved, sold) in holdings.items() if reserved > 0}
+        if not held:
+            if holdings:
+                return []
+            wanted = defaultdict(int)
+            items = OrderItem.objects.filter(order_id=order_id, product__isnull=False)
+            for product_id, quantity in items.values_list('product_id', 'quantity'):
+                wanted[product_id] -= quantity
+            try:
+                return move(wanted, StockMovement.SALE, order_id=order_id, note='Paid after its reservation was released')
+            except InsufficientStock as exc:
+                # The money is in; the shortfall is for staff to resolve
+                logger.error('Order %s was paid but %s', order_id, exc)
+                return []
+
+        balances = dict(
+            Product.objects.select_for_update().filter(id__in=held).order_by('id').values_list('id', 'stock')
+        )
+        movements = []
+        for product_id in sorted(held):
+            movements += [
+                StockMovement(
+                    product_id=product_id, kind=StockMovement.RELEASE, quantity=held[product_id],
+                    balance=balances[product_id] + held[product_id], order_id=order_id, note='Paid',
+                ),
+                StockMovement(
+                    product_id=product_id, kind=StockMovement.SALE, quantity=-held[product_id],
+                    balance=balances[product_id], order_id=order_id, note='Paid',
+                ),
+            ]
+        StockMovement.objects.bulk_create(movements)
+    return movements
+
+
+def send_stock_alert(alerts):
+    """One email for every product a stock change pushed past a threshold"""
+    lines = [f'- {name} (#{product_id}): {balance} left, {level}' for name, product_id, balance, level in alerts]
+    mail.spool(
+        STOCK_ALERT_EMAIL,
+        f'Stock alert: {len(alerts)} product{"s" if len(alerts) != 1 else ""}',
+        'These products just ran low or out of stock:\n\n' + '\n'.join(lines) + '\n',
+    )
+
+
+def find_drift():
+    """[(product_id, stock, ledger total)] for every product whose stock disagrees with its ledger"""
+    totals = dict(
+        StockMovement.objects.order_by().values('product_id').annotate(total=Sum('quantity'))
+        .values_list('product_id', 'total')
+    )
+    return [
+        (product_id, stock, totals.get(product_id, 0))
+        for product_id, stock in Product.objects.order_by('id').values_list('id', 'stock').iterator(chunk_size=5000)
+        if stock != totals.get(product_id, 0)
+    ]
+
+
+def rebuild_balances(drift):
+    """
+    Reset stock to the ledger total for the drifted products, hiding or showing
+    them as move() would. A product with no ledger at all (bulk-loaded) keeps
+    its stock and gets an opening movement.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        openings = []
+        flipped = False
+        for product_id, stock, total in drift:
+            has_ledger = StockMovement.objects.filter(product_id=product_id).exists()
+            if has_ledger:
+                product = (
+                    Product.objects.select_for_update().only('available', 'hidden_out_of_stock').get(id=product_id)
+                )
+                flips = availability_updates(product, max(total, 0), now)
+                flipped = flipped or bool(flips)
+                Product.objects.filter(id=product_id).update(stock=max(total, 0), stock_updated_at=now, **flips)
+            elif stock:
+                openings.append(StockMovement(
+                    product_id=product_id, kind=StockMovement.RESTOCK, quantity=stock, balance=stock,
+                    note='Opening balance',
+                ))
+        StockMovement.objects.bulk_create(openings, batch_size=1000)
+
+        if flipped:
+            from .signals import catalog_changed
+            catalog_changed()
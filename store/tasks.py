@@ -0,0 +1,83 @@
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image
+
+from .images import encode, normalize
+from .jobs import task
+from .mail import send_spool
+from .models import Category, Product
+
+
+@task(queue='email')
+def send_mail_spool():
+    """Deliver the queued outbound emails, one SMTP connection per batch"""
+    send_spool()
+
+
+@task(queue='media', max_attempts=3)
+def process_image(model, pk):
+    """
+    Fix EXIF orientation and shrink an uploaded product/category image. The
+    result is stored as a new file (stored files are content-addressed and
+    may be shared), and the instance is pointed at it.
+    """
+    from .signals import catalog_changed
+
+    model_class = {'product': Product, 'category': Category}[model]
+    instance = model_class.objects.filter(pk=pk).first()
+    if instance is None or not instance.image:
+        return
+
+    with instance.image.open('rb') as image_file:
+        image = Image.open(image_file)
+        image.load()
+
+    fixed = normalize(image)
+    if fixed is None:
+        return
+
+    original = instance.image.name
+    name = instance.image.storage.save(original, ContentFile(encode(fixed, image.format)))
+    # Only if the image wasn't replaced again in the meantime
+    if model_class.objects.filter(pk=pk, image=original).update(image=name, updated_at=timezone.now()):
+        catalog_changed()
+
+
+@task(queue='payments', max_attempts=8)
+def create_payment_intent(order_id, return_url):
+    """Create the provider intent for an order placed with online payment"""
+    from .payments import start_payment
+
+    start_payment(order_id, return_url)
+
+
+@task(queue='default', max_attempts=3)
+def reprice_products():
+    """Recompute effective prices after promotions change, start or end"""
+    from .promotions import reprice_catalog
+
+    reprice_catalog()
+
+
+@task(queue='default', max_attempts=2)
+def warm_api_cache():
+    """Render the first pages of the catalog API so the next visitors hit the cache"""
+    from rest_framework.test import APIRequestFactory
+
+    from .api import CategoryViewSet, ProductViewSet
+
+    site = urlsplit(settings.SITE_URL)
+    factory = APIRequestFactory()
+    request_options = {'secure': site.scheme == 'https', 'HTTP_HOST': site.netloc}
+    ProductViewSet.as_view({'get': 'list'})(factory.get('/api/products/', **request_options))
+    CategoryViewSet.as_view({'get': 'list'})(factory.get('/api/categories/', **request_options))
+
+
+def schedule_api_cache_warming(delay=60):
+    """Warm the API cache at most once per `delay` seconds, after catalog edits settle"""
+    slot = int(time.time() // delay) + 1
+    return warm_api_cache.enqueue(delay=slot * delay - time.time(), idempotency_key=f'warm-api-cache:{slot}')
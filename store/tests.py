@@ -1,3 +1,974 @@
-from django.test import TestCase
+import io
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.http import Http404
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, customers, jobs, mail, media, payments, popularity, promotions, ratelimit, recommendations, stock
+from .admin import OrderItemInline
+from .buffers import BulkInsertBuffer
+from .management.commands.check_order_numbers import allocate
+from .management.commands.fake_payment_gateway import Gateway, make_handler
+from .management.commands.smtp_debug_server import Command as SMTPDebugCommand, SMTPHandler
+from .models import (
+    ArchivedOrder, Category, ContactMessage, Customer, Job, Order, OrderItem, OutboundEmail, PaymentEvent,
+    Product, ProductRecommendation, Promotion, Sequence, StockMovement,
+)
+from .payments import WEBHOOK_TOLERANCE, GatewayProvider, sign_payload
+from .sequences import BlockAllocator, reserve_block
+
+
+class BlockAllocatorTests(TransactionTestCase):
+    """Order number blocks (store/sequences.py)"""
+
+    def test_reserve_block_creates_the_sequence_at_start(self):
+        self.assertEqual(reserve_block('test', 10, start=500), 500)
+        self.assertEqual(reserve_block('test', 10, start=500), 510)
+        self.assertEqual(Sequence.objects.get(name='test').next_value, 520)
+
+    def test_values_are_consecutive_within_a_block(self):
+        allocator = BlockAllocator('test', 5, start=1)
+        self.assertEqual([allocator.next() for _ in range(12)], list(range(1, 13)))
+        self.assertEqual(Sequence.objects.get(name='test').next_value, 16)
+
+    def test_allocators_get_disjoint_blocks(self):
+        first, second = BlockAllocator('test', 3), BlockAllocator('test', 3)
+        values = [allocator.next() for _ in range(4) for allocator in (first, second)]
+        self.assertEqual(len(set(values)), len(values))
+        self.assertEqual(values[:2], [1, 4])
+
+    def test_reservation_survives_a_rolled_back_transaction(self):
+        allocator = BlockAllocator('test', 10)
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                allocator.next()
+                1 / 0
+        # Rolled back orders leave a gap, never a reused number
+        self.assertEqual(Sequence.objects.get(name='test').next_value, 11)
+        self.assertEqual(BlockAllocator('test', 10).next(), 11)
+
+    def test_numbers_from_concurrent_processes_are_unique_and_gap_bounded(self):
+        processes, per_process, block_size = 6, 250, 20
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=allocate, args=('concurrent', block_size, per_process, queue))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [queue.get(timeout=60) for _ in workers]
+        for worker in workers:
+            worker.join()
+
+        values = [value for result in results for value in result]
+        self.assertEqual(len(set(values)), processes * per_process)
+        for result in results:
+            self.assertEqual(result, sorted(result))
+        # Each process leaves at most the unused tail of its last block
+        blocks_per_process = -(-per_process // block_size)
+        self.assertGreaterEqual(min(values), 1)
+        self.assertLess(max(values), 1 + processes * blocks_per_process * block_size)
+
+
+def make_product(stock=10, **fields):
+    category, _ = Category.objects.get_or_create(slug='tests', defaults={'name': 'Tests'})
+    number = Product.objects.count() + 1
+    return Product.objects.create(
+        category=category, name=f'Product {number}', slug=f'product-{number}',
+        regular_price=Decimal('100.00'), stock=stock, **fields,
+    )
+
+
+def make_order(items, payment_method='stripe'):
+    """An order for {product: quantity} with its stock taken the way checkout does"""
+    order = Order.objects.create(
+        order_number=f'TEST-{Order.objects.count() + 1}', full_name='Test Customer', email='customer@example.com',
+        phone='12345678', address='1 Test Street', city='Tunis', postal_code='1000',
+        total_amount=sum(product.price * quantity for product, quantity in items.items()),
+        payment_method=payment_method,
+        payment_status=Order.PAYMENT_PENDING if payment_method == 'stripe' else Order.PAYMENT_NOT_REQUIRED,
+        payment_updated_at=timezone.now(),
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, product_name=product.name, product_price=product.price,
+                  quantity=quantity)
+        for product, quantity in items.items()
+    ])
+    kind = StockMovement.RESERVATION if payment_method == 'stripe' else StockMovement.SALE
+    stock.move({product.id: -quantity for product, quantity in items.items()}, kind, order=order)
+    return order
+
+
+def start_gateway(webhook_url, duplicates=1):
+    """The fake_payment_gateway command's gateway, on a free local port"""
+    gateway = Gateway('http://127.0.0.1', webhook_url, settings.PAYMENT_WEBHOOK_SECRET, duplicates)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(gateway))
+    gateway.public_url = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return gateway, server
+
+
+class PaymentWebhookTests(TestCase):
+    """Webhook verification and payment transitions (store/payments.py)"""
+
+    def setUp(self):
+        self.product = make_product(stock=10)
+        self.order = make_order({self.product: 2})
+        Order.objects.filter(id=self.order.id).update(
+            payment_status=Order.PAYMENT_AWAITING, stripe_payment_intent='pi_test'
+        )
+
+    def event(self, event_type, event_id='evt_1', status='succeeded'):
+        return {
+            'id': event_id,
+            'type': event_type,
+            'data': {'object': {
+                'id': 'pi_test', 'status': status, 'amount': 200000,
+                'metadata': {'order_id': str(self.order.id)},
+            }},
+        }
+
+    def post(self, event, secret=None, timestamp=None, body=None):
+        body = body if body is not None else json.dumps(event).encode()
+        signature = sign_payload(body, secret or settings.PAYMENT_WEBHOOK_SECRET, timestamp)
+        return self.client.post(
+            reverse('payment_webhook'), body, content_type='application/json', HTTP_GATEWAY_SIGNATURE=signature,
+        )
+
+    def payment_status(self):
+        return Order.objects.values_list('payment_status', flat=True).get(id=self.order.id)
+
+    def test_rejects_bad_signatures(self):
+        event = self.event('payment_intent.succeeded')
+        body = json.dumps(event).encode()
+        signed = sign_payload(body, settings.PAYMENT_WEBHOOK_SECRET)
+        tampered = body.replace(b'200000', b'1')
+        attempts = [
+            self.post(event, secret='whsec_wrong'),
+            self.post(event, timestamp=int(time.time()) - WEBHOOK_TOLERANCE - 60),
+            self.client.post(reverse('payment_webhook'), tampered, content_type='application/json',
+                             HTTP_GATEWAY_SIGNATURE=signed),
+            self.client.post(reverse('payment_webhook'), body, content_type='application/json'),
+        ]
+        self.assertEqual([response.status_code for response in attempts], [400] * 4)
+        self.assertFalse(PaymentEvent.objects.exists())
+        self.assertEqual(self.payment_status(), Order.PAYMENT_AWAITING)
+
+    def test_replayed_event_applies_once(self):
+        event = self.event('payment_intent.succeeded')
+        results = [self.post(event).json()['result'] for _ in range(3)]
+        self.assertEqual(results, ['applied', 'duplicate', 'duplicate'])
+        self.assertEqual(PaymentEvent.objects.filter(event_id='evt_1').count(), 1)
+        self.assertEqual(self.payment_status(), Order.PAYMENT_PAID)
+        # The reservation became a sale exactly once
+        self.assertEqual(stock.order_holdings(self.order.id), {self.product.id: (0, 2)})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+    def test_illegal_transitions_are_ignored(self):
+        self.assertEqual(self.post(self.event('payment_intent.succeeded')).json()['result'], 'applied')
+        # A late failure must not move a paid order backwards
+        late = self.event('payment_intent.payment_failed', event_id='evt_2', status='requires_payment_method')
+        self.assertEqual(self.post(late).json()['result'], 'ignored')
+        self.assertEqual(self.payment_status(), Order.PAYMENT_PAID)
+        self.assertFalse(payments.transition(self.order.id, Order.PAYMENT_AWAITING))
+        self.assertTrue(PaymentEvent.objects.filter(event_id='evt_2', applied=False).exists())
+        self.assertEqual(stock.order_holdings(self.order.id), {self.product.id: (0, 2)})
+
+    def test_failed_payment_releases_the_reservation(self):
+        event = self.event('payment_intent.payment_failed', status='requires_payment_method')
+        self.assertEqual(self.post(event).json()['result'], 'applied')
+        self.assertEqual(stock.order_holdings(self.order.id), {})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+
+    def test_refund_before_shipping_restocks(self):
+        self.post(self.event('payment_intent.succeeded'))
+        self.post(self.event('charge.refunded', event_id='evt_2'))
+        self.assertEqual(self.payment_status(), Order.PAYMENT_REFUNDED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 10)
+        self.assertEqual(stock.find_drift(), [])
+
+
+class FakeGatewayTests(LiveServerTestCase):
+    """End to end against the fake gateway, which delivers every event twice"""
+
+    def setUp(self):
+        self.gateway, self.server = start_gateway(self.live_server_url + reverse('payment_webhook'), duplicates=2)
+        self.provider = GatewayProvider(base_url=self.gateway.public_url)
+        patcher = mock.patch('store.payments.get_provider', return_value=self.provider)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.product = make_product(stock=5)
+
+    def wait_for_events(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        while PaymentEvent.objects.count() < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        # Let any further (duplicate) deliveries land too
+        time.sleep(0.3)
+
+    def test_paid_order_through_the_gateway(self):
+        order = make_order({self.product: 3})
+        intent = payments.start_payment(order.id, self.live_server_url)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, Order.PAYMENT_AWAITING)
+        self.assertEqual(order.payment_url, f'{self.gateway.public_url}/pay/{intent.id}')
+        # Retried jobs get the same intent back
+        self.assertEqual(self.provider.create_intent(order, self.live_server_url).id, intent.id)
+
+        self.gateway.settle(intent.id, 'succeed')
+        self.wait_for_events(1)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, Order.PAYMENT_PAID)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        self.assertEqual(
+            list(StockMovement.objects.filter(order=order).order_by('id').values_list('kind', 'quantity')),
+            [(StockMovement.RESERVATION, -3), (StockMovement.RELEASE, 3), (StockMovement.SALE, -3)],
+        )
+
+    def test_reconcile_expires_unpaid_intents(self):
+        order = make_order({self.product: 2})
+        intent = payments.start_payment(order.id, self.live_server_url)
+        Order.objects.filter(id=order.id).update(
+            payment_updated_at=timezone.now() - timedelta(seconds=payments.PAYMENT_EXPIRES_AFTER + 1)
+        )
+        stats = payments.reconcile_payments()
+        self.assertEqual((stats['checked'], stats['expired']), (1, 1))
+        self.assertEqual(self.gateway.intents[intent.id]['status'], 'canceled')
+        self.wait_for_events(1)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, Order.PAYMENT_FAILED)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 5)
+
+
+class StockLedgerTests(TestCase):
+    """The append-only stock ledger (store/stock.py)"""
+
+    def test_movements_keep_stock_and_ledger_in_step(self):
+        product = make_product(stock=10)
+        stock.move({product.id: -3}, StockMovement.SALE)
+        stock.set_stock(product.id, 12, note='Counted')
+        stock.set_stock(product.id, 9)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 9)
+        self.assertEqual(
+            list(product.stock_movements.order_by('id').values_list('kind', 'quantity', 'balance')),
+            [('restock', 10, 10), ('sale', -3, 7), ('restock', 5, 12), ('adjustment', -3, 9)],
+        )
+        self.assertEqual(stock.find_drift(), [])
+
+    def test_insufficient_stock_changes_nothing(self):
+        first, second = make_product(stock=5), make_product(stock=1)
+        with self.assertRaises(stock.InsufficientStock) as caught:
+            stock.move({first.id: -2, second.id: -2}, StockMovement.SALE)
+        self.assertEqual(caught.exception.available, 1)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), [5, 1])
+        self.assertEqual(StockMovement.objects.filter(kind=StockMovement.SALE).count(), 0)
+
+    def test_selling_out_hides_and_restocking_shows_the_product(self):
+        product = make_product(stock=2)
+        stock.move({product.id: -2}, StockMovement.SALE)
+        product.refresh_from_db()
+        self.assertEqual((product.available, product.hidden_out_of_stock), (False, True))
+        stock.set_stock(product.id, 4)
+        product.refresh_from_db()
+        self.assertEqual((product.available, product.hidden_out_of_stock), (True, False))
+
+    def test_only_availability_flips_change_the_catalog(self):
+        product = make_product(stock=3)
+        with mock.patch('store.signals.schedule_api_cache_warming') as warm:
+            with self.captureOnCommitCallbacks(execute=True):
+                stock.move({product.id: -1}, StockMovement.SALE)
+            warm.assert_not_called()
+            with self.captureOnCommitCallbacks(execute=True):
+                stock.move({product.id: -2}, StockMovement.SALE)
+            warm.assert_called_once()
+
+    def test_rebuilt_balances_hide_and_show_products(self):
+        sold_out, restocked = make_product(stock=2), make_product(stock=2)
+        stock.move({sold_out.id: -2, restocked.id: -2}, StockMovement.SALE)
+        StockMovement.objects.create(product=restocked, kind=StockMovement.RESTOCK, quantity=4, balance=4)
+        # Stock written past the ledger
+        Product.objects.filter(id=sold_out.id).update(stock=3, available=True, hidden_out_of_stock=False)
+        stock.rebuild_balances(stock.find_drift())
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('stock', 'available', 'hidden_out_of_stock')),
+            [(0, False, True), (4, True, False)],
+        )
+        self.assertEqual(stock.find_drift(), [])
+
+    def test_only_threshold_crossings_send_alerts(self):
+        product = make_product(stock=8)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.move({product.id: -1}, StockMovement.SALE)  # 7: still above the threshold
+        self.assertFalse(OutboundEmail.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.move({product.id: -3}, StockMovement.SALE)  # 4: low
+            stock.move({product.id: -4}, StockMovement.SALE)  # 0: out
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+        self.assertIn('out of stock', OutboundEmail.objects.latest('id').body)
+
+    def test_cancelled_cash_order_is_restocked(self):
+        product = make_product(stock=6)
+        order = make_order({product: 4}, payment_method='cod')
+        stock.return_order_stock(order.id, note='Cancelled')
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 6)
+        self.assertEqual(stock.order_holdings(order.id), {})
+        # Nothing left to return the second time
+        self.assertEqual(stock.return_order_stock(order.id), [])
+
+
+class JobQueueTests(TransactionTestCase):
+    """The database job queue (store/jobs.py); run_job manages its own connections, so no test transaction"""
+
+    def setUp(self):
+        self.calls = []
+        self.addCleanup(jobs._tasks.pop, 'tests.record', None)
+        self.addCleanup(jobs._tasks.pop, 'tests.fail', None)
+
+        @jobs.task(name='tests.record')
+        def record(value):
+            self.calls.append(value)
+
+        @jobs.task(name='tests.fail', max_attempts=2)
+        def fail():
+            raise RuntimeError('boom')
+
+        self.record, self.fail = record, fail
+
+    def test_idempotency_key_enqueues_once(self):
+        first = self.record.enqueue(value=1, idempotency_key='once')
+        second = self.record.enqueue(value=2, idempotency_key='once')
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_claimed_job_runs_once(self):
+        job = self.record.enqueue(value='a')
+        self.assertEqual(jobs.claim_jobs('default', 10, 'worker-1'), [job.id])
+        self.assertEqual(jobs.claim_jobs('default', 10, 'worker-2'), [])
+        jobs.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, self.calls), (Job.DONE, 1, ['a']))
+
+    def test_claims_respect_the_queue_concurrency(self):
+        for value in range(6):
+            self.record.enqueue(value=value)
+        with mock.patch.dict(jobs.JOB_QUEUES, {'default': 4}):
+            self.assertEqual(len(jobs.claim_jobs('default', 10, 'worker-1')), 4)
+            self.assertEqual(jobs.claim_jobs('default', 10, 'worker-2'), [])
+
+    def test_concurrent_claimers_share_the_queue_concurrency(self):
+        for value in range(20):
+            self.record.enqueue(value=value)
+        barrier = threading.Barrier(2)
+        claimed = {}
+
+        def claim(worker_id):
+            try:
+                barrier.wait()
+                claimed[worker_id] = jobs.claim_jobs('default', 4, worker_id)
+            finally:
+                connections.close_all()
+
+        with mock.patch.dict(jobs.JOB_QUEUES, {'default': 4}):
+            for _ in range(3):
+                Job.objects.update(status=Job.QUEUED, locked_by='', locked_at=None)
+                threads = [threading.Thread(target=claim, args=(f'worker-{n}',)) for n in range(2)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(sum(len(ids) for ids in claimed.values()), 4)
+                self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 4)
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = self.fail.enqueue()
+        jobs.claim_jobs('default', 1, 'worker-1')
+        jobs.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=jobs.JOB_RETRY_BASE_DELAY - 1))
+        self.assertIn('RuntimeError: boom', job.last_error)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        jobs.claim_jobs('default', 1, 'worker-1')
+        jobs.run_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_only_silent_jobs_are_requeued(self):
+        alive, dead = self.record.enqueue(value=1), self.record.enqueue(value=2)
+        jobs.claim_jobs('default', 2, 'worker-1')
+        stale = timezone.now() - timedelta(seconds=jobs.JOB_LOCK_TIMEOUT + 1)
+        Job.objects.update(locked_at=stale)
+        self.assertEqual(jobs.heartbeat([alive.id], 'worker-1'), 1)
+        self.assertEqual(jobs.requeue_stuck_jobs(), 1)
+        self.assertEqual(
+            dict(Job.objects.values_list('id', 'status')), {alive.id: Job.RUNNING, dead.id: Job.QUEUED}
+        )
+        # Another worker's heartbeat can't keep a job alive
+        self.assertEqual(jobs.heartbeat([dead.id], 'worker-2'), 0)
+
+
+class PromotionTests(TestCase):
+    """Promotion rules and catalog repricing (store/promotions.py)"""
+
+    def setUp(self):
+        self.shoes = make_product()
+        self.hats = make_product()
+        self.hats.category = Category.objects.create(name='Hats', slug='hats')
+        self.hats.save()
+
+    def promote(self, kind, amount, categories=(), products=(), **fields):
+        promotion = Promotion.objects.create(name='Sale', kind=kind, amount=amount, published=True, **fields)
+        promotion.categories.set(categories)
+        promotion.products.set(products)
+        return promotion
+
+    def prices(self, product):
+        product.refresh_from_db()
+        return product.price, product.old_price, product.promotion_id
+
+    def test_reprice_applies_the_best_rule_per_product(self):
+        everywhere = self.promote(Promotion.PERCENTAGE, 10)
+        hats = self.promote(Promotion.FIXED, 25, categories=[self.hats.category])
+        self.assertEqual(promotions.reprice_catalog(), 2)
+        self.assertEqual(self.prices(self.shoes), (Decimal('90.00'), Decimal('100.00'), everywhere.id))
+        self.assertEqual(self.prices(self.hats), (Decimal('75.00'), Decimal('100.00'), hats.id))
+        self.hats.refresh_from_db()
+        self.assertEqual(self.hats.discount_percentage, 25)
+        # Nothing changed, nothing written
+        self.assertEqual(promotions.reprice_catalog(), 0)
+
+    def test_ended_promotion_restores_regular_prices(self):
+        now = timezone.now()
+        self.promote(Promotion.PERCENTAGE, 20, products=[self.shoes], ends_at=now + timedelta(hours=1))
+        promotions.reprice_catalog(now)
+        self.assertEqual(self.prices(self.shoes)[0], Decimal('80.00'))
+        promotions.reprice_catalog(now + timedelta(hours=2))
+        self.assertEqual(self.prices(self.shoes), (Decimal('100.00'), None, None))
+
+    def test_saving_a_product_applies_live_rules(self):
+        self.promote(Promotion.FIXED, 30, categories=[self.hats.category])
+        self.hats.regular_price = Decimal('50.00')
+        self.hats.save()
+        self.assertEqual(self.prices(self.hats)[:2], (Decimal('20.00'), Decimal('50.00')))
+
+    def test_amounts_are_validated(self):
+        invalid = [(Promotion.PERCENTAGE, '150'), (Promotion.PERCENTAGE, '0'), (Promotion.FIXED, '-5')]
+        for kind, amount in invalid:
+            with self.subTest(kind=kind, amount=amount), self.assertRaises(ValidationError):
+                Promotion(name='Sale', kind=kind, amount=Decimal(amount)).full_clean()
+        Promotion(name='Sale', kind=Promotion.PERCENTAGE, amount=Decimal('100')).full_clean()
+        Promotion(name='Sale', kind=Promotion.FIXED, amount=Decimal('150')).full_clean()
+
+
+class AdmissionControlTests(TestCase):
+    """Rate limits and concurrency gates (store/ratelimit.py)"""
+
+    def setUp(self):
+        self.cache = caches[ratelimit.RATELIMIT_CACHE]
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def test_rate_limit_answers_429_with_retry_after(self):
+        url = reverse('find_order')
+        data = {'email': 'nobody@example.com', 'order_number': 'ES-1'}
+        statuses = [self.client.post(url, data).status_code for _ in range(11)]
+        self.assertEqual(statuses, [302] * 10 + [429])
+        response = self.client.post(url, data)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # Limits are per client
+        self.assertEqual(self.client.post(url, data, REMOTE_ADDR='10.0.0.2').status_code, 302)
+        # GETs of the form are free
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_gate_admits_at_most_concurrency(self):
+        policy = ratelimit.Policy(concurrency=2)
+        first = ratelimit.acquire_slot(self.cache, 'test', policy)
+        second = ratelimit.acquire_slot(self.cache, 'test', policy)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(ratelimit.acquire_slot(self.cache, 'test', policy))
+        ratelimit.release_slot(self.cache, first)
+        self.assertIsNotNone(ratelimit.acquire_slot(self.cache, 'test', policy))
+
+    def test_gate_costs_one_round_trip_each_way(self):
+        policy = ratelimit.Policy(concurrency=1)
+        with mock.patch.object(self.cache, 'add', wraps=self.cache.add) as add:
+            slot = ratelimit.acquire_slot(self.cache, 'test', policy)
+        with mock.patch.object(self.cache, 'get') as get, \
+                mock.patch.object(self.cache, 'delete', wraps=self.cache.delete) as delete:
+            ratelimit.release_slot(self.cache, slot)
+        self.assertEqual((add.call_count, get.call_count, delete.call_count), (1, 0, 1))
+
+    def test_add_to_cart_only_accepts_post(self):
+        product = make_product()
+        url = reverse('add_to_cart', args=[product.id])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertFalse(product.cartitem_set.exists())
+
+    def test_expired_slot_release_does_not_free_another(self):
+        policy = ratelimit.Policy(concurrency=1)
+        key, token, acquired_at = ratelimit.acquire_slot(self.cache, 'test', policy)
+        # The slot expired while its request ran
+        self.cache.delete(key)
+        slow = (key, token, acquired_at - ratelimit.GATE_TIMEOUT)
+        fresh = ratelimit.acquire_slot(self.cache, 'test', policy)
+        ratelimit.release_slot(self.cache, slow)
+        self.assertIsNone(ratelimit.acquire_slot(self.cache, 'test', policy))
+        ratelimit.release_slot(self.cache, fresh)
+        self.assertIsNotNone(ratelimit.acquire_slot(self.cache, 'test', policy))
+
+    def test_queued_request_gets_the_released_slot(self):
+        policy = ratelimit.Policy(concurrency=1, queue=2)
+        held = ratelimit.acquire_slot(self.cache, 'test', policy)
+        timer = threading.Timer(0.1, ratelimit.release_slot, args=(self.cache, held))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertIsNotNone(ratelimit.acquire_slot(self.cache, 'test', policy))
+
+
+def start_smtp_server():
+    """The smtp_debug_server command's server, on a free local port"""
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+    server.daemon_threads = True
+    server.command = SMTPDebugCommand(stdout=io.StringIO())
+    server.lock = threading.Lock()
+    server.connections = server.messages = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def closed_port():
+    """A local port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class MailSpoolTests(TransactionTestCase):
+    """The outbound mail spool against the SMTP debugging server (store/mail.py, store/buffers.py)"""
+
+    def setUp(self):
+        self.server = start_smtp_server()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        smtp = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.server_address[1],
+        )
+        smtp.enable()
+        self.addCleanup(smtp.disable)
+
+    def queue(self, count):
+        return OutboundEmail.objects.bulk_create([
+            mail.compose(f'customer{n}@example.com', f'Message {n}', 'Hello') for n in range(count)
+        ])
+
+    def test_batch_shares_one_connection(self):
+        self.queue(3)
+        self.assertEqual(mail.send_spool(batch_size=10), (3, 0))
+        self.assertEqual((self.server.connections, self.server.messages), (1, 3))
+        self.assertEqual(set(OutboundEmail.objects.values_list('status', flat=True)), {OutboundEmail.SENT})
+        # One connection per batch
+        self.queue(3)
+        mail.send_spool(batch_size=2)
+        self.assertEqual((self.server.connections, self.server.messages), (3, 6))
+
+    def test_unreachable_server_leaves_emails_queued(self):
+        self.queue(2)
+        with override_settings(EMAIL_PORT=closed_port()), self.assertLogs('store.mail', 'WARNING'):
+            self.assertEqual(mail.send_spool(), (0, 2))
+        self.assertEqual(
+            list(OutboundEmail.objects.values_list('status', 'attempts')), [(OutboundEmail.QUEUED, 1)] * 2
+        )
+        self.assertTrue(OutboundEmail.objects.exclude(last_error='').exists())
+        # A retry run is scheduled, and the next run delivers them
+        self.assertTrue(Job.objects.filter(task='store.tasks.send_mail_spool').exists())
+        self.assertEqual(mail.send_spool(), (2, 0))
+
+    def test_repeated_failures_give_up(self):
+        self.queue(1)
+        with override_settings(EMAIL_PORT=closed_port()), self.assertLogs('store.mail', 'WARNING'):
+            for _ in range(mail.MAIL_MAX_ATTEMPTS):
+                mail.send_spool()
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.FAILED, mail.MAIL_MAX_ATTEMPTS))
+
+    def test_buffer_flushes_when_full(self):
+        flushed = threading.Event()
+        buffer = BulkInsertBuffer('tests', interval=60, max_size=2, on_flush=lambda by_model: flushed.set())
+        buffer.add(mail.compose('a@example.com', 'A', 'A'))
+        self.assertFalse(flushed.wait(0.2))
+        buffer.add(mail.compose('b@example.com', 'B', 'B'))
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+
+    def test_buffer_flush_writes_pending_rows(self):
+        flushes = []
+        buffer = BulkInsertBuffer('tests', interval=60, on_flush=flushes.append)
+        with mock.patch.object(buffer, '_ensure_flusher'):
+            buffer.add(mail.compose('a@example.com', 'A', 'A'), ContactMessage(
+                name='A', email='a@example.com', subject='Hi', message='Hello',
+            ))
+            self.assertEqual(OutboundEmail.objects.count(), 0)
+            self.assertEqual(buffer.flush(), 2)
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual((OutboundEmail.objects.count(), ContactMessage.objects.count()), (1, 1))
+        self.assertEqual(set(flushes[0]), {OutboundEmail, ContactMessage})
+
+    def test_contact_form_goes_through_the_outbox(self):
+        data = {'name': 'Amira', 'email': 'amira@example.com', 'subject': 'Sizes', 'message': 'Do you have XL?'}
+        with mock.patch.object(mail.outbox, '_ensure_flusher'):
+            self.client.post(reverse('contact'), data)
+            self.client.post(reverse('contact'), dict(data, email='not an email'))
+            self.assertEqual(ContactMessage.objects.count(), 0)
+            self.assertEqual(mail.outbox.flush(), 3)
+        self.assertEqual(ContactMessage.objects.get().email, 'amira@example.com')
+        self.assertEqual(
+            sorted(OutboundEmail.objects.values_list('to_email', flat=True)),
+            sorted([settings.CONTACT_EMAIL, 'amira@example.com']),
+        )
+        self.assertEqual(mail.send_spool(), (2, 0))
+        self.assertEqual(self.server.connections, 1)
+
+
+class OrderClaimTests(TestCase):
+    """Guest order lookup and claiming (store/customers.py)"""
+
+    def setUp(self):
+        self.order = make_order({make_product(): 1}, payment_method='cash')
+        Order.objects.filter(id=self.order.id).update(email='Customer@Example.com')
+        customers.upsert_customers([self.order])
+        self.user = User.objects.create_user('customer', 'customer@EXAMPLE.com', 'secret-password')
+        self.client.force_login(self.user)
+
+    def find(self, email='customer@example.com', order_number=None):
+        return self.client.post(reverse('find_order'), {
+            'email': email, 'order_number': order_number or self.order.order_number.lower(),
+        })
+
+    def owner(self):
+        return Order.objects.values_list('user', flat=True).get(id=self.order.id)
+
+    def test_wrong_details_claim_nothing(self):
+        self.assertRedirects(self.find(email='someone@example.com'), reverse('find_order'))
+        self.assertRedirects(self.find(order_number='TEST-999'), reverse('find_order'))
+        self.assertIsNone(self.owner())
+
+    def test_matching_email_claims_ignoring_case(self):
+        response = self.find(email=' CUSTOMER@example.com ')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.owner(), self.user.id)
+        self.assertEqual(Customer.objects.get().user, self.user)
+        self.assertEqual(self.client.get(reverse('order_detail', args=[self.order.id])).status_code, 200)
+
+    def test_account_with_another_email_only_views(self):
+        self.client.force_login(User.objects.create_user('other', 'other@example.com', 'secret-password'))
+        self.assertEqual(self.find().status_code, 200)
+        self.assertIsNone(self.owner())
+
+    def test_claimed_order_is_not_reassigned(self):
+        self.find()
+        twin = User.objects.create_user('twin', 'customer@example.com', 'secret-password')
+        self.client.force_login(twin)
+        self.find()
+        self.assertEqual(self.owner(), self.user.id)
+        self.assertFalse(customers.claim_order(twin, Order.objects.get(id=self.order.id)))
+
+    def test_archived_order_can_be_claimed(self):
+        Order.objects.filter(id=self.order.id).update(status='delivered')
+        archive.archive_batch(timezone.now() + timedelta(days=1))
+        self.find()
+        self.assertEqual(ArchivedOrder.objects.get().user, self.user)
+
+    def test_sync_does_not_link_accounts_by_email(self):
+        Customer.objects.all().delete()
+        Order.objects.update(customer=None)
+        customers.sync_customers()
+        self.assertIsNone(Customer.objects.get().user)
+
+
+class MediaFileTests(TestCase):
+    """Serving uploaded files with ranges and revalidation (store/media.py)"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = os.path.join(directory.name, 'media')
+        os.makedirs(self.root)
+        with open(os.path.join(directory.name, 'secret.txt'), 'w') as secret:
+            secret.write('outside MEDIA_ROOT')
+        self.path = os.path.join(self.root, 'letters.txt')
+        with open(self.path, 'wb') as letters:
+            letters.write(b'abcdefghijklmnopqrstuvwxyz')
+        media_root = override_settings(MEDIA_ROOT=self.root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def get(self, path='letters.txt', **headers):
+        response = self.client.get(f'/media/{path}', **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def content(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_paths_outside_media_root_are_rejected(self):
+        self.assertEqual(self.get('../secret.txt').status_code, 404)
+        self.assertEqual(self.get('%2E%2E/secret.txt').status_code, 404)
+        self.assertIsNone(media.media_path('../secret.txt'))
+        self.assertIsNone(media.media_path('/etc/passwd'))
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), b'abcdefghijklmnopqrstuvwxyz')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={media.MEDIA_MAX_AGE}')
+
+    def test_single_range(self):
+        response = self.get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/26')
+        self.assertEqual(response['Content-Length'], '4')
+        self.assertEqual(self.content(response), b'cdef')
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual((response['Content-Range'], self.content(response)), ('bytes 23-25/26', b'xyz'))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=26-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */26')
+
+    def test_parse_range(self):
+        self.assertEqual(media.parse_range('bytes=0-', 26), (0, 25))
+        self.assertEqual(media.parse_range('bytes=20-99', 26), (20, 25))
+        self.assertEqual(media.parse_range('bytes=-99', 26), (0, 25))
+        self.assertIsNone(media.parse_range(None, 26))
+        self.assertIsNone(media.parse_range('bytes=0-1,4-5', 26))
+        self.assertIs(media.parse_range('bytes=5-2', 26), False)
+        self.assertIs(media.parse_range('bytes=-0', 26), False)
+
+    def test_revalidation(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # A stale If-Range gets the whole file instead of the range
+        response = self.get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_versioned_urls_are_immutable(self):
+        version = media.fingerprint(os.stat(self.path))
+        self.assertEqual(self.get(f'v/{version}/letters.txt')['Cache-Control'], media.IMMUTABLE)
+        old = self.get('v/000000000000/letters.txt')
+        self.assertEqual(old['Cache-Control'], f'public, max-age={media.MEDIA_MAX_AGE}')
+
+    def test_offload_headers(self):
+        with mock.patch('store.media.MEDIA_OFFLOAD', 'x-accel-redirect'):
+            response = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/letters.txt')
+        self.assertEqual(response.content, b'')
+        with mock.patch('store.media.MEDIA_OFFLOAD', 'x-sendfile'):
+            response = self.get(HTTP_RANGE='bytes=2-5')
+        # The front server answers the range itself
+        self.assertEqual((response.status_code, response['X-Sendfile']), (200, self.path))
+
+
+class CatalogConditionalGetTests(TestCase):
+    """304 Not Modified for catalog pages (store/catalog.py)"""
+
+    def setUp(self):
+        self.product = make_product(stock=5)
+        self.url = reverse('products')
+        self.client.get(self.url)  # Sets the CSRF cookie, which is part of the ETag
+
+    def test_repeat_get_is_answered_without_rendering(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        with mock.patch('store.views.render') as render:
+            repeat = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+        render.assert_not_called()
+        self.assertEqual(repeat['ETag'], response['ETag'])
+
+    def test_etag_changes_with_products_and_stock(self):
+        etags = [self.client.get(self.url)['ETag']]
+        self.product.name = 'Renamed'
+        self.product.save()
+        etags.append(self.client.get(self.url)['ETag'])
+        stock.move({self.product.id: -1}, StockMovement.SALE)
+        etags.append(self.client.get(self.url)['ETag'])
+        self.assertEqual(len(set(etags)), 3)
+        detail = reverse('product_detail', args=[self.product.id, self.product.slug])
+        # Views are counted in memory; don't leave them for the exit-time flush
+        self.addCleanup(popularity._pending.clear)
+        etag = self.client.get(detail)['ETag']
+        stock.move({self.product.id: 2}, StockMovement.RESTOCK)
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pending_messages_bypass_the_304(self):
+        etag = self.client.get(self.url)['ETag']
+        # A failed lookup leaves an error message for the next page
+        self.client.post(reverse('find_order'), {'email': 'nobody@example.com', 'order_number': 'ES-1'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'No order matches')
+
+    def test_responses_are_private_and_vary_on_cookie(self):
+        for response in (self.client.get(self.url), self.client.get(self.url, HTTP_IF_NONE_MATCH='"x"')):
+            self.assertIn('Cookie', response['Vary'])
+            self.assertIn('private', response['Cache-Control'])
+            self.assertIn('no-cache', response['Cache-Control'])
+        etag = self.client.get(self.url)['ETag']
+        self.assertIn('Cookie', self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)['Vary'])
+
+
+class OrderArchiveTests(TestCase):
+    """Moving finished orders to ArchivedOrder and reading them back (store/archive.py)"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'secret-password')
+        self.shirt, self.hat = make_product(), make_product()
+        self.order = make_order({self.shirt: 2, self.hat: 1}, payment_method='cod')
+        self.live = make_order({self.hat: 1}, payment_method='cod')
+        year_ago = timezone.now() - timedelta(days=400)
+        Order.objects.filter(id=self.order.id).update(
+            user=self.user, status='delivered', created_at=year_ago, updated_at=year_ago,
+        )
+        Order.objects.filter(id=self.live.id).update(user=self.user, status='delivered')
+        self.order.refresh_from_db()
+
+    def items(self, order):
+        return sorted((item.product_id, item.product_name, item.product_price, item.quantity)
+                      for item in order.items.all())
+
+    def test_round_trip(self):
+        items, total = self.items(self.order), self.order.get_total()
+        self.assertEqual(archive.archive_orders(older_than_days=365), 1)
+        self.assertFalse(Order.objects.filter(id=self.order.id).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=self.order.id).exists())
+        self.assertTrue(Order.objects.filter(id=self.live.id).exists())
+
+        order = archive.get_order_or_404(self.order.id, user=self.user)
+        self.assertTrue(order.is_archived)
+        self.assertEqual(
+            (order.order_number, order.status, order.created_at),
+            (self.order.order_number, 'delivered', self.order.created_at),
+        )
+        self.assertEqual(self.items(order), items)
+        self.assertEqual(order.get_total(), total)
+        self.assertEqual([order.id for order in archive.user_orders(self.user)], [self.live.id, self.order.id])
+
+    def test_archived_orders_stay_private(self):
+        archive.archive_orders(older_than_days=365)
+        with self.assertRaises(Http404):
+            archive.get_order_or_404(self.order.id, user=User.objects.create_user('other'))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('order_detail', args=[self.order.id]))
+        self.assertContains(response, self.order.order_number)
+        self.assertContains(self.client.get(reverse('order_history')), self.order.order_number)
+
+    def test_unfinished_orders_stay_live(self):
+        Order.objects.filter(id=self.order.id).update(status='shipped')
+        self.assertEqual(archive.archive_orders(older_than_days=365), 0)
+
+
+class AnonymousSessionTests(TestCase):
+    """Anonymous browsing stores no session (store/sessions.py)"""
+
+    def setUp(self):
+        self.product = make_product()
+        self.addCleanup(popularity._pending.clear)
+
+    def test_browsing_creates_no_session(self):
+        for url in (
+            reverse('home'), reverse('products'), reverse('products') + '?sort=price_low',
+            reverse('product_detail', args=[self.product.id, self.product.slug]), reverse('cart_count'),
+        ):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+        self.assertEqual(Session.objects.count(), 0)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+    def test_adding_to_the_cart_starts_one(self):
+        self.client.post(reverse('add_to_cart', args=[self.product.id]), {'quantity': 1})
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+
+class RecommendationTests(TestCase):
+    """Co-purchase recommendations (store/recommendations.py)"""
+
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (make_product(stock=100) for _ in range(4))
+
+    def stored(self):
+        return list(ProductRecommendation.objects.order_by('product', 'rank').values_list(
+            'product', 'rank', 'recommended', 'score',
+        ))
+
+    def test_refresh_matches_a_full_rebuild(self):
+        make_order({self.a: 1, self.b: 1}, payment_method='cod')
+        make_order({self.b: 1, self.c: 1}, payment_method='cod')
+        make_order({self.b: 1, self.c: 1}, payment_method='cod')
+        recommendations.rebuild_recommendations()
+        # a is in more orders now, which lowers b's score for it although b isn't in the new order
+        make_order({self.a: 1, self.d: 1}, payment_method='cod')
+        run = recommendations.refresh_recommendations()
+        self.assertFalse(run.full_rebuild)
+        refreshed = self.stored()
+        recommendations.rebuild_recommendations()
+        self.assertEqual(refreshed, self.stored())
+
+    def test_cancelled_orders_are_ignored(self):
+        make_order({self.a: 1, self.b: 1}, payment_method='cod')
+        Order.objects.update(status='cancelled')
+        recommendations.rebuild_recommendations()
+        self.assertEqual(self.stored(), [])
+
+
+class OrderAdminTests(TestCase):
+    """The order change page's paginated items (store/admin.py)"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret-password'))
+        products = [make_product(stock=5) for _ in range(OrderItemInline.formset.per_page + 5)]
+        self.order = make_order({product: 1 for product in products}, payment_method='cod')
+
+    def test_item_pages_keep_the_query(self):
+        url = reverse('admin:store_order_change', args=[self.order.id])
+        response = self.client.get(url, {'_changelist_filters': 'status=pending', 'items_page': 2})
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.forms), 5)
+        self.assertContains(response, 'href="?_changelist_filters=status%3Dpending&amp;items_page=1"')
+        response = self.client.get(url)
+        self.assertContains(response, 'href="?items_page=2"')
@@ -1,14 +1,23 @@
-from django.urls import path
-from . import views
+from django.urls import include, path, re_path
+from rest_framework.routers import DefaultRouter
+from . import api, views
+from .ratelimit import Policy
+
+router = DefaultRouter()
+router.register('products', api.ProductViewSet, basename='api-product')
+router.register('categories', api.CategoryViewSet, basename='api-category')
+router.register('orders', api.OrderViewSet, basename='api-order')
 
 urlpatterns = [
     # Home and Products
     path('', views.home, name='home'),
     path('products/', views.product_list, name='products'),
     path('product/<int:product_id>/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('search/autocomplete/', views.autocomplete, name='autocomplete'),
     
     # Cart
     path('cart/', views.cart, name='cart'),
+    path('cart/count/', views.cart_count, name='cart_count'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:cart_item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/update/<int:cart_item_id>/', views.update_cart, name='update_cart'),
@@ -17,6 +26,8 @@ urlpatterns = [
     path('checkout/', views.checkout, name='checkout'),
     path('checkout/process/', views.process_checkout, name='process_checkout'),
     path('order/confirmation/<int:order_id>/', views.order_confirmation, name='order_confirmation'),
+    path('order/<int:order_id>/payment/', views.order_payment_status, name='order_payment_status'),
+    path('payments/webhook/', views.payment_webhook, name='payment_webhook'),
     
     # Authentication
     path('register/', views.register, name='register'),
@@ -27,7 +38,29 @@ urlpatterns = [
     path('profile/', views.profile, name='profile'),
     path('orders/', views.order_history, name='order_history'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
+    path('orders/find/', views.find_order, name='find_order'),
     
     # Contact
     path('contact/', views.contact, name='contact'),
+    
+    # Sitemaps and product feeds
+    path('sitemap.xml', views.sitemap, name='sitemap'),
+    re_path(r'^feeds/(?P<filename>[\w.-]+)$', views.feed_file, name='feed_file'),
+    
+    # JSON API
+    path('api/', include(router.urls)),
 ]
+
+# Admission control per URL name, applied by store.ratelimit.AdmissionControlMiddleware.
+# Keeps flash-sale traffic on the expensive endpoints from starving catalog reads.
+rate_limits = {
+    'process_checkout': Policy(rate='10/m', concurrency=8, queue=3),
+    'add_to_cart': Policy(rate='60/m', concurrency=16, queue=1),
+    'update_cart': Policy(rate='60/m'),
+    'remove_from_cart': Policy(rate='60/m', methods=('GET', 'POST')),
+    # authenticate() runs PBKDF2; limit by IP so cycling sessions doesn't help
+    'login': Policy(rate='10/m', key='ip', concurrency=4, queue=2),
+    'register': Policy(rate='5/m', key='ip', concurrency=4, queue=2),
+    # Order numbers are sequential; keep guesses for other people's orders slow
+    'find_order': Policy(rate='10/m', key='ip'),
+}
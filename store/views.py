@@ -1,13 +1,41 @@
+import os
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import transaction
 from django.db.models import Q
-from .models import Product, CartItem, Category, Order, OrderItem, Customer
-import uuid
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from .models import Product, CartItem, Category, Order, OrderItem, Customer, ContactMessage, ArchivedOrder, StockMovement
+from .catalog import DEFAULT_SORT, PRODUCT_SORTS, catalog_condition
+from .feeds import FEEDS_ROOT
+from .media import IMMUTABLE, MEDIA_MAX_AGE, FileRange, content_type, fingerprint, media_path, offload_headers, parse_range
+from .facets import build_facets, count_facets, filter_by_facets, get_selected_facets
+from .popularity import record_view
+from .sequences import next_order_number
+from .stock import InsufficientStock, move as move_stock
+from .snapshot import get_snapshot
+from .archive import get_order_or_404, user_orders
+from .customers import by_email, claim_order, find_order as find_guest_order, upsert_customers
+from .autocomplete import get_index as get_autocomplete_index
+from .payments import InvalidWebhook, get_provider as get_payment_provider, handle_event as handle_payment_event
+from .mail import compose, outbox
+from .tasks import create_payment_intent
 from django.utils.text import slugify
 
+PRODUCTS_PER_PAGE = 24
+
 
 def get_cart_count(request):
     """Helper function to get cart item count"""
@@ -23,76 +51,122 @@ def get_cart_count(request):
     return sum(item.quantity for item in cart_items)
 
 
+def get_cart_items(request):
+    """The visitor's cart items; empty for anonymous visitors who have no session yet"""
+    if request.user.is_authenticated:
+        return CartItem.objects.filter(user=request.user)
+    session_key = request.session.session_key
+    if not session_key:
+        return CartItem.objects.none()
+    return CartItem.objects.filter(session_key=session_key)
+
+
 def home(request):
     """Home page view"""
-    categories = Category.objects.all()[:3]
-    featured_products = Product.objects.filter(featured=True, available=True)[:8]
-    new_products = Product.objects.filter(available=True).order_by('-created_at')[:8]
+    snapshot = get_snapshot()
+    popular = snapshot.get_products(snapshot.product_ids('popular')[:4])
     
     context = {
-        'categories': categories,
-        'featured_products': featured_products,
-        'new_products': new_products,
+        'categories': snapshot.categories[:3],
+        'featured_products': snapshot.get_products(snapshot.featured_ids[:8]),
+        'new_products': snapshot.get_products(snapshot.product_ids('newest')[:8]),
+        'trending_products': [product for product in popular if product.popularity > 0],
         'cart_count': get_cart_count(request)
     }
     return render(request, 'store/home.html', context)
 
 
+@catalog_condition
 def product_list(request):
-    """Products listing page with filters and search"""
-    products = Product.objects.filter(available=True)
-    categories = Category.objects.all()
-    
-    # Search
+    """Products listing page with faceted filters and search"""
+    snapshot = get_snapshot(getattr(request, 'catalog_version', None), getattr(request, 'stock_version', None))
+    categories = snapshot.categories
+    selected = get_selected_facets(request.GET, categories)
+    sort_by = request.GET.get('sort', DEFAULT_SORT)
     search_query = request.GET.get('search', '')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+    min_discount = request.GET.get('min_discount', '')
     
-    # Category filter
-    category_slug = request.GET.get('category', '')
-    if category_slug:
-        products = products.filter(category__slug=category_slug)
-    
-    # Sorting
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'name':
-        products = products.order_by('name')
-    else:  # newest
-        products = products.order_by('-created_at')
+    from_snapshot = not (search_query or min_discount.isdigit())
     
+    if not from_snapshot:
+        products = Product.objects.filter(available=True)
+        
+        # Search
+        if search_query:
+            products = products.filter(
+                Q(name__icontains=search_query) | 
+                Q(description__icontains=search_query)
+            )
+        
+        # Minimum discount
+        if min_discount.isdigit():
+            products = products.filter(discount_percentage__gte=int(min_discount))
+        
+        # Facets: counts for every value come from one grouped query over the
+        # search results, then the selected facets narrow the listing itself
+        facet_counts, result_count = count_facets(products, selected)
+        products = filter_by_facets(products, selected)
+        products = products.order_by(*PRODUCT_SORTS.get(sort_by, PRODUCT_SORTS[DEFAULT_SORT]))
+        products = products.select_related('category')
+    else:
+        # Plain browsing is answered from the in-memory snapshot: presorted
+        # ids per category, facet counts from precomputed groups
+        products, facet_counts, result_count = snapshot.listing(sort_by, selected)
+    
+    # Pagination (the facet counts already include the number of results)
+    paginator = Paginator(products, PRODUCTS_PER_PAGE)
+    paginator.count = result_count
+    page_obj = paginator.get_page(request.GET.get('page'))
+    if from_snapshot:
+        page_obj.object_list = snapshot.get_products(page_obj.object_list)
+    
+    params = request.GET.copy()
+    params.pop('page', None)
+    
+    # No cart_count here: the badge is fetched from the cart_count view
+    # so the page stays cacheable (see catalog_condition)
     context = {
-        'products': products,
+        'products': page_obj.object_list,
+        'page_obj': page_obj,
+        'result_count': result_count,
         'categories': categories,
-        'cart_count': get_cart_count(request)
+        'facets': build_facets(request.GET, categories, selected, facet_counts),
+        'base_query': params.urlencode(),
     }
     return render(request, 'store/product_list.html', context)
 
 
+@catalog_condition
 def product_detail(request, product_id, slug):
     """Single product detail page"""
-    product = get_object_or_404(Product, id=product_id, available=True)
+    snapshot = get_snapshot(getattr(request, 'catalog_version', None), getattr(request, 'stock_version', None))
+    product = snapshot.get_product(product_id)
+    if product is None:
+        raise Http404('No Product matches the given query.')
     
-    # Get related products from same category
-    related_products = Product.objects.filter(
-        category=product.category,
-        available=True
-    ).exclude(id=product.id)[:4]
+    # Buffered in memory and flushed in batches, so no write happens here.
+    # Revalidations answered with 304 by catalog_condition are not counted.
+    record_view(product.id)
     
+    # Products frequently bought together with this one; the snapshot falls
+    # back to the same category until the product has order history
     context = {
         'product': product,
-        'related_products': related_products,
-        'cart_count': get_cart_count(request)
+        'related_products': snapshot.related_products(product),
     }
     return render(request, 'store/product_detail.html', context)
 
 
+def autocomplete(request):
+    """Search-as-you-type suggestions, answered from the in-memory prefix index"""
+    query = request.GET.get('q', '')[:100]
+    suggestions = get_autocomplete_index().search(query) if len(query.strip()) >= 2 else []
+    response = JsonResponse({'suggestions': [suggestion.as_dict() for suggestion in suggestions]})
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
+
+
+@require_POST
 def add_to_cart(request, product_id):
     """Add product to cart"""
     product = get_object_or_404(Product, id=product_id)
@@ -104,7 +178,7 @@ def add_to_cart(request, product_id):
     
     quantity = int(request.POST.get('quantity', 1))
     
-    # Ensure session exists
+    # The cart is the first thing worth storing; only now create the session
     if not request.session.session_key:
         request.session.create()
     
@@ -132,17 +206,16 @@ def add_to_cart(request, product_id):
     return redirect(request.META.get('HTTP_REFERER', 'products'))
 
 
+def cart_count(request):
+    """Cart badge count for pages rendered without per-user data"""
+    response = JsonResponse({'count': get_cart_count(request)})
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
 def cart(request):
     """Shopping cart page"""
-    if not request.session.session_key:
-        request.session.create()
-    
-    session_key = request.session.session_key
-    
-    if request.user.is_authenticated:
-        cart_items = CartItem.objects.filter(user=request.user)
-    else:
-        cart_items = CartItem.objects.filter(session_key=session_key)
+    cart_items = get_cart_items(request)
     
     total = sum(item.total_price() for item in cart_items)
     
@@ -164,7 +237,7 @@ def remove_from_cart(request, cart_item_id):
             messages.error(request, 'You cannot remove this item.')
             return redirect('cart')
     else:
-        if item.session_key != request.session.session_key:
+        if not item.session_key or item.session_key != request.session.session_key:
             messages.error(request, 'You cannot remove this item.')
             return redirect('cart')
     
@@ -196,15 +269,7 @@ def update_cart(request, cart_item_id):
 
 def checkout(request):
     """Checkout page"""
-    if not request.session.session_key:
-        request.session.create()
-    
-    session_key = request.session.session_key
-    
-    if request.user.is_authenticated:
-        cart_items = CartItem.objects.filter(user=request.user)
-    else:
-        cart_items = CartItem.objects.filter(session_key=session_key)
+    cart_items = get_cart_items(request)
     
     if not cart_items:
         messages.warning(request, 'Your cart is empty.')
@@ -225,16 +290,8 @@ def process_checkout(request):
     if request.method != 'POST':
         return redirect('checkout')
     
-    if not request.session.session_key:
-        request.session.create()
-    
-    session_key = request.session.session_key
-    
     # Get cart items
-    if request.user.is_authenticated:
-        cart_items = CartItem.objects.filter(user=request.user)
-    else:
-        cart_items = CartItem.objects.filter(session_key=session_key)
+    cart_items = get_cart_items(request)
     
     if not cart_items:
         messages.error(request, 'Your cart is empty.')
@@ -244,45 +301,64 @@ def process_checkout(request):
     total = sum(item.total_price() for item in cart_items)
     shipping_cost = 0 if total >= 100 else 7.00
     
-    # Create order
-    order = Order.objects.create(
-        user=request.user if request.user.is_authenticated else None,
-        order_number=str(uuid.uuid4())[:13].upper(),
-        full_name=request.POST.get('full_name'),
-        email=request.POST.get('email'),
-        phone=request.POST.get('phone'),
-        address=request.POST.get('address'),
-        city=request.POST.get('city'),
-        postal_code=request.POST.get('postal_code'),
-        country=request.POST.get('country', 'Tunisia'),
-        total_amount=total,
-        shipping_cost=shipping_cost,
-        payment_method=request.POST.get('payment_method', 'cod'),
-        status='pending'
-    )
-    
-    # Create order items
-    for cart_item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=cart_item.product,
-            product_name=cart_item.product.name,
-            product_price=cart_item.product.price,
-            quantity=cart_item.quantity
-        )
-        
-        # Update stock
-        cart_item.product.stock -= cart_item.quantity
-        cart_item.product.save()
-    
-    # Clear cart
-    cart_items.delete()
+    # Order, items and stock movements commit together or not at all
+    try:
+        with transaction.atomic():
+            order = Order(
+                user=request.user if request.user.is_authenticated else None,
+                order_number=next_order_number(),
+                full_name=request.POST.get('full_name'),
+                email=(request.POST.get('email') or '').strip(),
+                phone=request.POST.get('phone'),
+                address=request.POST.get('address'),
+                city=request.POST.get('city'),
+                postal_code=request.POST.get('postal_code'),
+                country=request.POST.get('country', 'Tunisia'),
+                total_amount=total,
+                shipping_cost=shipping_cost,
+                payment_method=request.POST.get('payment_method', 'cod'),
+                status='pending'
+            )
+            upsert_customers([order])
+            order.save()
+            if order.payment_method == 'stripe':
+                order.payment_status = Order.PAYMENT_PENDING
+                order.payment_updated_at = order.created_at
+                order.save(update_fields=['payment_status', 'payment_updated_at'])
+
+            # Create order items
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product=cart_item.product,
+                    product_name=cart_item.product.name,
+                    product_price=cart_item.product.price,
+                    quantity=cart_item.quantity
+                )
+                for cart_item in cart_items
+            ])
+
+            # Take the items out of stock; unpaid online orders hold them as a reservation
+            quantities = {}
+            for cart_item in cart_items:
+                quantities[cart_item.product_id] = quantities.get(cart_item.product_id, 0) - cart_item.quantity
+            kind = StockMovement.RESERVATION if order.payment_method == 'stripe' else StockMovement.SALE
+            move_stock(quantities, kind, order=order)
+
+            # Clear cart
+            cart_items.delete()
+    except InsufficientStock as exc:
+        messages.error(request, f'Sorry, only {exc.available} of "{exc.product.name}" left in stock.')
+        return redirect('cart')
     
-    # If payment method is Stripe, handle payment (placeholder for now)
+    # Online payment: the intent is created by the job worker so the
+    # customer never waits on the provider; the confirmation page picks
+    # up the payment link as soon as it exists.
     if order.payment_method == 'stripe':
-        # TODO: Integrate Stripe payment here
-        order.payment_completed = True
-        order.save()
+        return_url = request.build_absolute_uri(reverse('order_confirmation', args=[order.id]))
+        transaction.on_commit(lambda: create_payment_intent.enqueue(
+            order_id=order.id, return_url=return_url, idempotency_key=f'payment-intent:{order.id}'
+        ))
     
     messages.success(request, f'Order placed successfully! Order number: {order.order_number}')
     return redirect('order_confirmation', order_id=order.id)
@@ -305,6 +381,33 @@ def order_confirmation(request, order_id):
     return render(request, 'store/order_confirmation.html', context)
 
 
+def order_payment_status(request, order_id):
+    """Payment state of an order, polled by the confirmation page"""
+    order = get_object_or_404(
+        Order.objects.only('user_id', 'payment_status', 'payment_url'), id=order_id
+    )
+    if request.user.is_authenticated and order.user_id != request.user.id:
+        raise Http404
+    return JsonResponse({
+        'status': order.payment_status,
+        'label': order.get_payment_status_display(),
+        'payment_url': order.payment_url if order.payment_status == Order.PAYMENT_AWAITING else '',
+    })
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """Payment provider callbacks; safe to redeliver, each event applies once"""
+    provider = get_payment_provider()
+    try:
+        event = provider.parse_webhook(request.body, request.headers)
+    except InvalidWebhook:
+        return HttpResponseBadRequest('Invalid webhook')
+    result = handle_payment_event(event, provider.name)
+    return JsonResponse({'result': result})
+
+
 def register(request):
     """User registration"""
     if request.user.is_authenticated:
@@ -327,7 +430,7 @@ def register(request):
             messages.error(request, 'Username already exists.')
             return redirect('register')
         
-        if User.objects.filter(email=email).exists():
+        if by_email(User.objects, email).exists():
             messages.error(request, 'Email already exists.')
             return redirect('register')
         
@@ -363,11 +466,12 @@ def user_login(request):
         user = authenticate(request, username=username, password=password)
         
         if user is not None:
+            # login() rotates the session key, so remember the anonymous cart's first
+            session_key = request.session.session_key
             login(request, user)
             messages.success(request, f'Welcome back, {user.username}!')
             
             # Merge session cart with user cart
-            session_key = request.session.session_key
             if session_key:
                 session_cart_items = CartItem.objects.filter(session_key=session_key)
                 for item in session_cart_items:
@@ -403,8 +507,9 @@ def user_logout(request):
 def profile(request):
     """User profile page"""
     orders = Order.objects.filter(user=request.user)
-    order_count = orders.count()
-    completed_orders = orders.filter(status='delivered').count()
+    archived = ArchivedOrder.objects.filter(user=request.user)
+    order_count = orders.count() + archived.count()
+    completed_orders = orders.filter(status='delivered').count() + archived.filter(status='delivered').count()
     pending_orders = orders.filter(status__in=['pending', 'processing']).count()
     
     context = {
@@ -419,7 +524,7 @@ def profile(request):
 @login_required
 def order_history(request):
     """User order history"""
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
+    orders = user_orders(request.user)
     
     context = {
         'orders': orders,
@@ -431,7 +536,7 @@ def order_history(request):
 @login_required
 def order_detail(request, order_id):
     """Single order detail"""
-    order = get_object_or_404(Order, id=order_id, user=request.user)
+    order = get_order_or_404(order_id, user=request.user)
     
     context = {
         'order': order,
@@ -440,6 +545,28 @@ def order_detail(request, order_id):
     return render(request, 'store/order_confirmation.html', context)
 
 
+def find_order(request):
+    """Guest order lookup by email and order number"""
+    if request.method == 'POST':
+        order = find_guest_order(request.POST.get('email'), request.POST.get('order_number'))
+        if order is None:
+            messages.error(request, 'No order matches that email and order number.')
+            return redirect('find_order')
+        # A guest order placed with the account's own email joins the account
+        if request.user.is_authenticated and claim_order(request.user, order):
+            messages.success(request, f'Order {order.order_number} is now in your order history.')
+        context = {
+            'order': order,
+            'cart_count': get_cart_count(request)
+        }
+        return render(request, 'store/order_confirmation.html', context)
+
+    context = {
+        'cart_count': get_cart_count(request)
+    }
+    return render(request, 'store/find_order.html', context)
+
+
 def contact(request):
     """Contact page with form submission"""
     if request.method == 'POST':
@@ -449,12 +576,29 @@ def contact(request):
         subject = request.POST.get('subject')
         message = request.POST.get('message')
         
-        # Here you can add logic to:
-        # 1. Send email to admin
-        # 2. Save to database (create a ContactMessage model)
-        # 3. Send auto-reply to customer
+        contact_message = ContactMessage(name=name, email=email, phone=phone, subject=subject, message=message)
+        try:
+            # Checked here because the row is only inserted later, with others
+            contact_message.full_clean()
+        except ValidationError:
+            messages.error(request, 'Please fill in your name, a valid email, a subject and your message.')
+            return redirect('contact')
+        
+        # Saved and emailed in batches off the request path (see store/mail.py)
+        outbox.add(
+            contact_message,
+            compose(
+                settings.CONTACT_EMAIL, f'[Contact] {subject}',
+                f'From: {name} <{email}>\nPhone: {phone}\n\n{message}',
+                reply_to=email,
+            ),
+            compose(
+                email, 'We received your message',
+                f'Hello {name},\n\nThank you for contacting Elite Shop. '
+                f'We received your message "{subject}" and will get back to you soon.\n\nElite Shop',
+            ),
+        )
         
-        # For now, just show a success message
         messages.success(
             request, 
             f'Thank you {name}! Your message has been received. We will get back to you soon at {email}.'
@@ -465,3 +609,69 @@ def contact(request):
         'cart_count': get_cart_count(request)
     }
     return render(request, 'store/contact.html', context)
+
+
+def feed_file(request, filename):
+    """Sitemaps and product feeds, pre-generated by `manage.py generate_feeds`"""
+    path = os.path.join(FEEDS_ROOT, filename)
+    if filename.startswith('.') or filename.endswith(('.tmp', '.json')) or not os.path.isfile(path):
+        raise Http404('Feed not found')
+    stat = os.stat(path)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), int(stat.st_mtime)):
+        return HttpResponseNotModified()
+    content_type = 'application/gzip' if filename.endswith('.gz') else 'application/xml'
+    response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
+def sitemap(request):
+    """Sitemap index; the shards it lists are served by feed_file"""
+    return feed_file(request, 'sitemap.xml')
+
+
+def media_file(request, path, version=None):
+    """
+    Uploaded images. Whole files go out through FileResponse (sendfile under
+    gunicorn) or the front server (MEDIA_OFFLOAD); single byte ranges and
+    conditional requests are answered here. Versioned URLs are immutable.
+    """
+    file_path = media_path(path)
+    if file_path is None or file_path.startswith(os.path.join(str(FEEDS_ROOT), '')):
+        raise Http404('File not found')
+    stat = os.stat(file_path)
+    etag = f'"{fingerprint(stat)}"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), stat.st_size)
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range and if_range != etag and if_range != http_date(stat.st_mtime):
+            byte_range = None  # The client's copy is stale; send it all
+        offload = offload_headers(file_path, path)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+        elif offload:
+            # The front server sends the file, and handles Range itself
+            response = HttpResponse(content_type=content_type(file_path), headers=offload)
+        elif byte_range:
+            start, end = byte_range
+            response = FileResponse(
+                FileRange(open(file_path, 'rb'), start, end - start + 1),
+                status=206, content_type=content_type(file_path),
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        else:
+            response = FileResponse(open(file_path, 'rb'), content_type=content_type(file_path))
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if version and version == etag.strip('"'):
+        response['Cache-Control'] = IMMUTABLE
+    else:
+        response['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}'
+    return response
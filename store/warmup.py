@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+
+logger = logging.getLogger(__name__)
+
+# Warm each worker up when config/wsgi.py or asgi.py is imported
+WARMUP_ON_BOOT = getattr(settings, 'WARMUP_ON_BOOT', not settings.DEBUG)
+
+# Pages requested internally at the end of the warm-up, so middleware, views
+# and template rendering have all run once before real traffic arrives
+WARMUP_PATHS = getattr(settings, 'WARMUP_PATHS', ['/', '/products/'])
+
+
+def resolve_urls():
+    """Populate the URL resolver's reverse and namespace tables"""
+    resolver = get_resolver()
+    # Reading the tables builds them
+    return len(resolver.reverse_dict) + len(resolver.namespace_dict)
+
+
+def preload_templates():
+    """Compile every template the project's apps ship into the cached loader"""
+    count = 0
+    for app_config in apps.get_app_configs():
+        if not app_config.path.startswith(str(settings.BASE_DIR)):
+            continue  # Django's and third-party templates load on demand
+        root = os.path.join(app_config.path, 'templates')
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith('.html'):
+                    get_template(os.path.relpath(os.path.join(directory, filename), root))
+                    count += 1
+    return count
+
+
+def prime_catalog():
+    """Build this worker's catalog snapshot and autocomplete index"""
+    from .autocomplete import get_index
+    from .serializers import product_url_template
+    from .snapshot import get_snapshot
+
+    snapshot = get_snapshot()
+    get_index()
+    product_url_template()
+    return len(snapshot.products)
+
+
+def request_pages(paths=None):
+    """Request a few catalog pages through the full middleware stack"""
+    from django.test import Client
+
+    host = urlsplit(settings.SITE_URL).netloc or 'localhost'
+    client = Client(HTTP_HOST=host, secure=settings.SITE_URL.startswith('https'))
+    statuses = []
+    for path in paths or WARMUP_PATHS:
+        statuses.append(client.get(path).status_code)
+    return statuses
+
+
+STEPS = [
+    ('urls', resolve_urls),
+    ('templates', preload_templates),
+    ('catalog', prime_catalog),
+    ('requests', request_pages),
+]
+
+
+def warm_up():
+    """Run every warm-up step; returns [(step, seconds, result)]. A failing step is logged and skipped."""
+    timings = []
+    for name, step in STEPS:
+        started = time.perf_counter()
+        try:
+            result = step()
+        except Exception as exc:
+            logger.exception('Warm-up step %s failed', name)
+            result = exc
+        timings.append((name, time.perf_counter() - started, result))
+    # A pre-forking server (gunicorn --preload) must not hand this
+    # connection to its workers
+    connections.close_all()
+    return timings
+
+
+def warm_up_on_boot():
+    """Called from config/wsgi.py and asgi.py once the application exists"""
+    if not WARMUP_ON_BOOT:
+        return
+    started = time.perf_counter()
+    timings = warm_up()
+    logger.info(
+        'Worker %s warmed up in %.0f ms (%s)', os.getpid(), (time.perf_counter() - started) * 1000,
+        ', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds, result in timings),
+    )